@@ -1,113 +1,183 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
 import sqlite3
-import numpy as np
-import cv2
-import face_recognition
+import functools
 import json
+import queue
+import tempfile
+import time
+import uuid
+import zipfile
 from datetime import datetime
+from utils import attendance_summary, metrics, templates
+from utils.attendance_writer import WriteTimeout, attendance_writer
+from utils.config import PAGE_SIZE_MAX, RECOGNITION_RETRY_AFTER, SERVER_TIMING
+from utils.db import get_connection, is_busy_error, release_connection, retry_on_busy, transaction
+from utils.detection import encoder_version
+from utils.encodings import encoding_to_blob
+from utils.enrollment import MANIFEST_NAME, enrollment_jobs, parse_manifest, resolve_directory
+from utils.gallery import gallery
+from utils.ingest import InvalidImage, upload_store, upload_stream
+from utils.migrations import migrate
+from utils.pagination import csv_rows, decode_cursor, encode_cursor, iter_rows, json_array, ndjson
+from utils.quality import REJECT_MESSAGES
+from utils.recognition import encode_image, recognize_image, warm_up
+from utils.recognition_cache import recognition_cache
+from utils.rosters import bump_version
+from utils.streaming import read_frames, stream_sessions
+from utils.workers import PoolBusy, recognition_pool
+
+class UploadRequest(Request):
+    """
+    Keeps uploaded images in memory, so they are decoded from the request buffer
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return upload_stream(total_content_length, content_type, filename, content_length)
+
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 CORS(app)
 
 # Create uploads directory if it doesn't exist
 os.makedirs('uploads', exist_ok=True)
 os.makedirs('database', exist_ok=True)
 
-# Initialize database
-def init_db():
-    conn = sqlite3.connect('database/attendance.db')
-    c = conn.cursor()
-    
-    # Create tables if they don't exist
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS students (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            roll_number TEXT UNIQUE NOT NULL,
-            image_path TEXT NOT NULL,
-            face_encoding TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS subjects (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            code TEXT UNIQUE NOT NULL,
-            name TEXT NOT NULL,
-            faculty TEXT NOT NULL,
-            description TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS attendance (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            student_id INTEGER NOT NULL,
-            subject_id INTEGER NOT NULL,
-            date TEXT NOT NULL,
-            time TEXT NOT NULL,
-            status TEXT NOT NULL,
-            FOREIGN KEY (student_id) REFERENCES students (id),
-            FOREIGN KEY (subject_id) REFERENCES subjects (id)
-        )
-    ''')
+# Create the database or bring its schema up to date, keeping existing data
+db_changed = bool(migrate())
+
+# Map the shared gallery snapshot, rebuilding it if migrations changed the database
+warm_up(rebuild=db_changed)
+
+metrics.Gauge('gallery_size', 'Enrolled face encodings in the matching gallery', lambda: len(gallery))
+metrics.Gauge('recognition_pending', 'Recognition calls queued or running', lambda: recognition_pool.pending)
+metrics.Gauge('attendance_write_pending', 'Attendance records queued for writing', lambda: attendance_writer.pending)
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.request_seconds.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
     
-    conn.commit()
-    conn.close()
+    # Per-stage breakdown of recognition requests, for browser dev tools and clients
+    timings = g.get('timings')
+    if SERVER_TIMING and timings:
+        response.headers['Server-Timing'] = server_timing(timings)
+    return response
 
-# Ensure database schema is correct
-def check_and_fix_db():
-    try:
-        conn = sqlite3.connect('database/attendance.db')
-        c = conn.cursor()
-        
-        # Check if tables exist
-        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='attendance'")
-        if not c.fetchone():
-            print("Database tables missing. Creating tables...")
-            init_db()
-            return True
-            
-        # Check if attendance table has subject_id column
-        c.execute("PRAGMA table_info(attendance)")
-        columns = [col[1] for col in c.fetchall()]
-        
-        # If subject_id column doesn't exist, recreate the database
-        needs_recreation = 'subject_id' not in columns
-        conn.close()
-        
-        if needs_recreation:
-            print("Database schema outdated. Recreating database...")
-            import os
-            if os.path.exists('database/attendance.db'):
-                os.remove('database/attendance.db')
-            init_db()
-            return True
-        return False
-    except Exception as e:
-        print(f"Error checking database: {e}")
-        return False
+@app.teardown_appcontext
+def release_db(exception=None):
+    # Roll back anything a request left uncommitted on this thread's pooled connection
+    release_connection()
+
+def observe_timings(timings, start):
+    """
+    Add the time spent waiting for a recognition worker (everything not
+    accounted for by the worker's own stages) and record the breakdown
+    """
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    timings['queue_ms'] = round(max(elapsed_ms - sum(timings.values()), 0), 2)
+    metrics.record_timings(timings)
+
+def record_timings(timings, start):
+    # Also reported in the response's Server-Timing header
+    observe_timings(timings, start)
+    g.timings = timings
 
-# Initialize database only if it doesn't exist
-if not os.path.exists('database/attendance.db'):
-    print("Database not found. Creating new database...")
-    init_db()
-else:
-    check_and_fix_db()
+def server_timing(timings):
+    return ', '.join(f'{key[:-3]};dur={value}' for key, value in timings.items() if key.endswith('_ms'))
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Counters and latency histograms for this process, in Prometheus text format
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+INVALID_IMAGE_MESSAGE = 'Could not read the uploaded image. Please upload a JPEG or PNG photo.'
+
+def invalid_image_response():
+    """
+    400 returned when an upload cannot be decoded as an image
+    """
+    metrics.face_rejects.inc(reason='invalid_image')
+    return jsonify({'error': INVALID_IMAGE_MESSAGE}), 400
+
+WRITE_TIMEOUT_MESSAGE = 'Attendance is still being saved. Please retry shortly.'
+
+def busy_response(message='Recognition service is busy. Please retry shortly.', resource='recognition'):
+    """
+    503 returned when the recognition queue is full, the database stays locked
+    or the attendance writer falls behind
+    """
+    metrics.busy_rejections.inc(resource=resource)
+    return jsonify({'error': message}), 503, {
+        'Retry-After': str(RECOGNITION_RETRY_AFTER)
+    }
+
+def page_args():
+    """
+    Page size and output format from the query string; ValueError if invalid
+    """
+    limit = request.args.get('limit')
+    if limit is not None:
+        limit = int(limit)
+        if not 1 <= limit <= PAGE_SIZE_MAX:
+            raise ValueError(f'limit must be between 1 and {PAGE_SIZE_MAX}')
+    output_format = request.args.get('format', 'json')
+    if output_format not in ('json', 'ndjson', 'csv'):
+        raise ValueError('format must be json, ndjson or csv')
+    return limit, output_format
+
+def list_response(c, limit, output_format, fields, sort_key, filename):
+    """
+    Respond with the rows of an executed query, ordered by sort_key.
+
+    With a limit, one page is returned and the cursor for the next page (if
+    any) is sent in the X-Next-Cursor header. Without one, every row is
+    streamed from the database cursor, so memory use does not grow with the
+    result size.
+    """
+    headers = {}
+    if limit is None:
+        rows = iter_rows(c)
+    else:
+        rows = [dict(row) for row in c.fetchmany(limit + 1)]
+        if len(rows) > limit:
+            rows = rows[:limit]
+            headers['X-Next-Cursor'] = encode_cursor([rows[-1][key] for key in sort_key])
+    
+    if output_format == 'ndjson':
+        body, mimetype = ndjson(rows), 'application/x-ndjson'
+    elif output_format == 'csv':
+        body, mimetype = csv_rows(rows, fields), 'text/csv'
+        headers['Content-Disposition'] = f'attachment; filename={filename}.csv'
+    else:
+        body, mimetype = json_array(rows), 'application/json'
+    return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
 
 @app.route('/api/students', methods=['GET'])
 def get_students():
-    conn = sqlite3.connect('database/attendance.db')
-    conn.row_factory = sqlite3.Row
+    try:
+        limit, output_format = page_args()
+        after_id = decode_cursor(request.args['cursor'], (int,))[0] if request.args.get('cursor') else 0
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    conn = get_connection()
     c = conn.cursor()
-    c.execute('SELECT id, name, roll_number, image_path FROM students')
-    students = [dict(row) for row in c.fetchall()]
-    conn.close()
-    return jsonify(students)
+    c.execute('''
+        SELECT id, name, roll_number, image_path FROM students
+        WHERE id > ?
+        ORDER BY id
+    ''', (after_id,))
+    return list_response(c, limit, output_format, ['id', 'name', 'roll_number', 'image_path'],
+                         ['id'], 'students')
 
 @app.route('/api/students', methods=['POST'])
 def add_student():
@@ -119,50 +189,126 @@ def add_student():
         if not name or not roll_number or not image:
             return jsonify({'error': 'Missing required fields'}), 400
         
-        # Save image
+        # Get face encoding in a recognition worker, straight from the uploaded bytes
+        image_data = image.read()
         image_path = f'uploads/{roll_number}.jpg'
-        image.save(image_path)
-        
-        # Get face encoding
-        img = face_recognition.load_image_file(image_path)
-        face_locations = face_recognition.face_locations(img)
+        start = time.perf_counter()
+        try:
+            face_locations, face_encodings, timings = recognition_pool.run(encode_image, image_data, 1, True)
+        except PoolBusy:
+            return busy_response()
+        except InvalidImage:
+            return invalid_image_response()
+        record_timings(timings, start)
+        metrics.faces_detected.inc(len(face_locations))
         
         if not face_locations:
-            os.remove(image_path)
+            metrics.face_rejects.inc(reason='no_face')
             return jsonify({'error': 'No face detected in the image'}), 400
         
-        face_encoding = face_recognition.face_encodings(img, face_locations)[0]
+        face_encoding = face_encodings[0]
         
         # Save to database
-        conn = sqlite3.connect('database/attendance.db')
-        c = conn.cursor()
-        
+        start = time.perf_counter()
         try:
-            c.execute(
-                'INSERT INTO students (name, roll_number, image_path, face_encoding) VALUES (?, ?, ?, ?)',
-                (name, roll_number, image_path, json.dumps(face_encoding.tolist()))
-            )
-            conn.commit()
-            student_id = c.lastrowid
+            with transaction() as c:
+                c.execute(
+                    'INSERT INTO students (name, roll_number, image_path, face_encoding, encoding_version) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (name, roll_number, image_path, encoding_to_blob(face_encoding), encoder_version())
+                )
+                student_id = c.lastrowid
         except sqlite3.IntegrityError:
-            conn.close()
             return jsonify({'error': 'Student with this roll number already exists'}), 400
         
-        conn.close()
+        gallery.add(student_id, name, face_encoding)
+        # Only enrolled photos are kept, written without holding up the response
+        upload_store.save(image_path, image_data)
+        timings['store_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        metrics.stage_seconds.observe(timings['store_ms'] / 1000, stage='store')
         
         return jsonify({
             'id': student_id,
             'name': name,
             'roll_number': roll_number,
-            'image_path': image_path
+            'image_path': image_path,
+            'timings': timings
         }), 201
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/students/bulk', methods=['POST'])
+def bulk_add_students():
+    """
+    Start a background enrollment job from a ZIP archive (uploaded as 'archive')
+    or a server-side 'directory' under BULK_ENROLL_ROOT, plus a CSV manifest with
+    name, roll_number and image columns (uploaded as 'manifest', or manifest.csv
+    inside the source)
+    """
+    archive = request.files.get('archive')
+    manifest_file = request.files.get('manifest')
+    directory = request.form.get('directory')
+    
+    try:
+        if archive:
+            # Keep the archive on disk for the job; it is removed when the job finishes
+            fd, source_path = tempfile.mkstemp(suffix='.zip')
+            with os.fdopen(fd, 'wb') as f:
+                archive.save(f)
+            cleanup = True
+            if not zipfile.is_zipfile(source_path):
+                os.remove(source_path)
+                return jsonify({'error': 'Archive must be a ZIP file'}), 400
+            if manifest_file:
+                manifest_text = manifest_file.read().decode('utf-8-sig')
+            else:
+                with zipfile.ZipFile(source_path) as zf:
+                    manifest_text = zf.read(MANIFEST_NAME).decode('utf-8-sig')
+        elif directory:
+            directory = resolve_directory(directory)
+            if directory is None:
+                return jsonify({'error': 'Directory is not allowed'}), 400
+            if not os.path.isdir(directory):
+                return jsonify({'error': 'Directory not found'}), 400
+            source_path = directory
+            cleanup = False
+            if manifest_file:
+                manifest_text = manifest_file.read().decode('utf-8-sig')
+            else:
+                with open(os.path.join(directory, MANIFEST_NAME), encoding='utf-8-sig') as f:
+                    manifest_text = f.read()
+        else:
+            return jsonify({'error': 'Missing archive or directory'}), 400
+        
+        manifest = parse_manifest(manifest_text)
+    except (KeyError, FileNotFoundError):
+        if archive:
+            os.remove(source_path)
+        return jsonify({'error': 'Missing manifest'}), 400
+    except (ValueError, UnicodeDecodeError) as e:
+        if archive:
+            os.remove(source_path)
+        return jsonify({'error': f'Invalid manifest: {str(e)}'}), 400
+    
+    job = enrollment_jobs.submit(source_path, manifest, cleanup=cleanup)
+    return jsonify(job.to_dict()), 202, {'Location': f'/api/students/bulk/{job.job_id}'}
+
+@app.route('/api/students/bulk/<job_id>', methods=['GET'])
+def get_bulk_enrollment_job(job_id):
+    job = enrollment_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
 @app.route('/api/students/<int:student_id>', methods=['DELETE'])
 def delete_student(student_id):
-    conn = sqlite3.connect('database/attendance.db')
+    # Queued records must not be written after the student's attendance is deleted
+    try:
+        attendance_writer.flush()
+    except WriteTimeout:
+        return busy_response(WRITE_TIMEOUT_MESSAGE, resource='attendance')
+    conn = get_connection()
     c = conn.cursor()
     
     # Get image path
@@ -170,31 +316,107 @@ def delete_student(student_id):
     result = c.fetchone()
     
     if not result:
-        conn.close()
         return jsonify({'error': 'Student not found'}), 404
     
     image_path = result[0]
     
     # Delete from database
     c.execute('DELETE FROM students WHERE id = ?', (student_id,))
+    attendance_summary.remove_student(c, student_id)
+    template_paths = templates.remove_student(c, student_id)
     c.execute('DELETE FROM attendance WHERE student_id = ?', (student_id,))
+    c.execute('DELETE FROM enrollments WHERE student_id = ?', (student_id,))
     conn.commit()
-    conn.close()
+    gallery.remove(student_id)
+    recognition_cache.clear()
+    attendance_writer.forget()
     
-    # Delete image
-    if image_path and os.path.exists(image_path):
-        os.remove(image_path)
+    # Delete images
+    for path in [image_path, *template_paths]:
+        upload_store.remove(path)
     
     return jsonify({'message': 'Student deleted successfully'})
 
+# Extra face templates: more enrollment photos per student, plus any auto-captured probes
+@app.route('/api/students/<int:student_id>/templates', methods=['GET'])
+def get_student_templates(student_id):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT id FROM students WHERE id = ?', (student_id,))
+    if not c.fetchone():
+        return jsonify({'error': 'Student not found'}), 404
+    
+    c.execute('''
+        SELECT id, source, image_path, encoding_version, created_at FROM face_templates
+        WHERE student_id = ?
+        ORDER BY id
+    ''', (student_id,))
+    return jsonify([dict(row) for row in c.fetchall()])
+
+@app.route('/api/students/<int:student_id>/templates', methods=['POST'])
+def add_student_template(student_id):
+    try:
+        image = request.files.get('image')
+        if not image:
+            return jsonify({'error': 'Missing image'}), 400
+        
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('SELECT roll_number FROM students WHERE id = ?', (student_id,))
+        student = c.fetchone()
+        if not student:
+            return jsonify({'error': 'Student not found'}), 404
+        
+        image_data = image.read()
+        start = time.perf_counter()
+        try:
+            face_locations, face_encodings, timings = recognition_pool.run(encode_image, image_data, 1, True)
+        except PoolBusy:
+            return busy_response()
+        except InvalidImage:
+            return invalid_image_response()
+        record_timings(timings, start)
+        metrics.faces_detected.inc(len(face_locations))
+        
+        if not face_locations:
+            metrics.face_rejects.inc(reason='no_face')
+            return jsonify({'error': 'No face detected in the image'}), 400
+        
+        image_path = f'uploads/{student[0]}_{uuid.uuid4().hex[:8]}.jpg'
+        start = time.perf_counter()
+        template_id = templates.add_template(student_id, face_encodings[0], 'enrollment', image_path)
+        upload_store.save(image_path, image_data)
+        timings['store_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        metrics.stage_seconds.observe(timings['store_ms'] / 1000, stage='store')
+        
+        return jsonify({
+            'id': template_id,
+            'student_id': student_id,
+            'source': 'enrollment',
+            'image_path': image_path,
+            'timings': timings
+        }), 201
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/students/<int:student_id>/templates/<int:template_id>', methods=['DELETE'])
+def delete_student_template(student_id, template_id):
+    found, image_path = templates.remove_template(student_id, template_id)
+    if not found:
+        return jsonify({'error': 'Template not found'}), 404
+    
+    upload_store.remove(image_path)
+    
+    return jsonify({'message': 'Template deleted successfully'})
+
 # Subject API endpoints
 @app.route('/api/subjects', methods=['GET'])
 def get_subjects():
-    conn = sqlite3.connect('database/attendance.db')
+    conn = get_connection()
     c = conn.cursor()
     c.execute('SELECT * FROM subjects ORDER BY created_at DESC')
     subjects = [dict(zip([col[0] for col in c.description], row)) for row in c.fetchall()]
-    conn.close()
     return jsonify(subjects)
 
 @app.route('/api/subjects', methods=['POST'])
@@ -214,13 +436,12 @@ def add_subject():
         if not data['name'].strip() or not data['code'].strip() or not data['faculty'].strip():
             return jsonify({'error': 'Fields cannot be empty'}), 400
             
-        conn = sqlite3.connect('database/attendance.db')
+        conn = get_connection()
         c = conn.cursor()
         
         # Check if subject code already exists
         c.execute('SELECT id FROM subjects WHERE code = ?', (data['code'],))
         if c.fetchone():
-            conn.close()
             return jsonify({'error': 'Subject code already exists'}), 400
             
         # Insert new subject
@@ -240,7 +461,6 @@ def add_subject():
         # Get the newly created subject
         c.execute('SELECT * FROM subjects WHERE id = ?', (subject_id,))
         subject = dict(zip([col[0] for col in c.description], c.fetchone()))
-        conn.close()
         
         return jsonify(subject), 201
         
@@ -250,17 +470,215 @@ def add_subject():
 
 @app.route('/api/subjects/<int:subject_id>', methods=['DELETE'])
 def delete_subject(subject_id):
-    conn = sqlite3.connect('database/attendance.db')
+    try:
+        attendance_writer.flush()
+    except WriteTimeout:
+        return busy_response(WRITE_TIMEOUT_MESSAGE, resource='attendance')
+    conn = get_connection()
     c = conn.cursor()
     
     c.execute('DELETE FROM subjects WHERE id = ?', (subject_id,))
+    attendance_summary.remove_subject(c, subject_id)
     c.execute('DELETE FROM attendance WHERE subject_id = ?', (subject_id,))
+    c.execute('DELETE FROM enrollments WHERE subject_id = ?', (subject_id,))
+    bump_version(c, subject_id)
     
     conn.commit()
-    conn.close()
+    recognition_cache.clear()
+    attendance_writer.forget()
     
     return jsonify({'message': 'Subject deleted successfully'})
 
+# Subject roster (enrollment) endpoints
+@app.route('/api/subjects/<int:subject_id>/students', methods=['GET'])
+def get_subject_students(subject_id):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        SELECT s.id, s.name, s.roll_number, s.image_path
+        FROM enrollments e
+        JOIN students s ON e.student_id = s.id
+        WHERE e.subject_id = ?
+        ORDER BY s.roll_number
+    ''', (subject_id,))
+    students = [dict(row) for row in c.fetchall()]
+    return jsonify(students)
+
+@app.route('/api/subjects/<int:subject_id>/students', methods=['POST'])
+def enroll_subject_students(subject_id):
+    try:
+        data = request.get_json()
+        
+        # Validate required fields
+        if not data or not isinstance(data.get('student_ids'), list):
+            return jsonify({'error': 'Missing student_ids list'}), 400
+            
+        if not all(isinstance(student_id, int) for student_id in data['student_ids']):
+            return jsonify({'error': 'Invalid data types'}), 400
+            
+        conn = get_connection()
+        c = conn.cursor()
+        
+        c.execute('SELECT id FROM subjects WHERE id = ?', (subject_id,))
+        if not c.fetchone():
+            return jsonify({'error': 'Subject not found'}), 404
+        
+        # Only enroll students that exist; ignore ones already enrolled
+        c.executemany('''
+            INSERT OR IGNORE INTO enrollments (student_id, subject_id)
+            SELECT id, ? FROM students WHERE id = ?
+        ''', [(subject_id, student_id) for student_id in data['student_ids']])
+        enrolled = c.rowcount
+        bump_version(c, subject_id)
+        conn.commit()
+        
+        return jsonify({'message': f'Enrolled {enrolled} students', 'enrolled': enrolled}), 201
+        
+    except Exception as e:
+        print(f"Error enrolling students: {str(e)}")
+        return jsonify({'error': 'Failed to enroll students'}), 500
+
+@app.route('/api/subjects/<int:subject_id>/students/<int:student_id>', methods=['DELETE'])
+def unenroll_subject_student(subject_id, student_id):
+    conn = get_connection()
+    c = conn.cursor()
+    
+    c.execute('DELETE FROM enrollments WHERE subject_id = ? AND student_id = ?', (subject_id, student_id))
+    removed = c.rowcount
+    if removed:
+        bump_version(c, subject_id)
+    
+    conn.commit()
+    
+    if not removed:
+        return jsonify({'error': 'Student is not enrolled in this subject'}), 404
+    return jsonify({'message': 'Student removed from subject'})
+
+@retry_on_busy
+def record_attendance(subject_id, student_ids):
+    """
+    Mark students present now; returns the newly marked ids.
+
+    Records go through the write-behind attendance writer, so this returns
+    once they are queued (or committed, with ATTENDANCE_DURABLE).
+    """
+    now = datetime.now()
+    today = now.strftime('%Y-%m-%d')
+    # Students recently seen as marked today are answered from memory
+    known = recognition_cache.marked(subject_id, student_ids, today)
+    pending = [student_id for student_id in student_ids if student_id not in known]
+    newly_marked = set()
+    if pending:
+        newly_marked = attendance_writer.submit(subject_id, pending, today, now.strftime('%H:%M:%S'))
+        recognition_cache.mark(subject_id, pending, today)
+    metrics.attendance_marked.inc(len(newly_marked))
+    metrics.attendance_duplicates.inc(len(student_ids) - len(newly_marked))
+    return newly_marked
+
+def mark_classroom_attendance(subject_id, face_locations, matches, rejects=()):
+    """
+    Bulk-insert attendance for every newly matched face in a classroom photo;
+    faces rejected by the quality gate are listed with their reason
+    """
+    matched_ids = [student_id for student_id, _, _, matched in matches if matched]
+    newly_marked = record_attendance(subject_id, matched_ids)
+    
+    faces = []
+    for (top, right, bottom, left), (student_id, name, distance, matched) in zip(face_locations, matches):
+        if not matched:
+            status = 'unknown'
+        elif student_id in newly_marked:
+            status = 'marked'
+        else:
+            status = 'already_marked'
+        faces.append({
+            'box': {'top': top, 'right': right, 'bottom': bottom, 'left': left},
+            'student_id': student_id if matched else None,
+            'student_name': name if matched else None,
+            'distance': distance,
+            'status': status
+        })
+    for reject in rejects:
+        top, right, bottom, left = reject['box']
+        faces.append({
+            'box': {'top': top, 'right': right, 'bottom': bottom, 'left': left},
+            'student_id': None,
+            'student_name': None,
+            'distance': None,
+            'status': 'rejected',
+            'reason': reject['reason']
+        })
+    
+    return {
+        'message': f'Attendance marked for {len(newly_marked)} of {len(faces)} detected faces',
+        'marked_count': len(newly_marked),
+        'faces': faces
+    }
+
+def subject_exists(subject_id):
+    c = get_connection().cursor()
+    c.execute('SELECT id FROM subjects WHERE id = ?', (subject_id,))
+    return c.fetchone() is not None
+
+def attendance_result(subject_id, classroom, face_locations, matches, rejects, timings):
+    """
+    Count a recognition result and mark attendance for it; returns (body, status).
+
+    Shared by the Flask view below and the ASGI entry point (asgi.py).
+    """
+    matched_count = sum(1 for match in matches if match[3])
+    metrics.faces_detected.inc(len(face_locations) + len(rejects))
+    metrics.face_matches.inc(matched_count)
+    metrics.face_rejects.inc(len(matches) - matched_count, reason='no_match')
+    for reject in rejects:
+        metrics.face_rejects.inc(reason=reject['reason'])
+    
+    if not face_locations and not rejects:
+        metrics.face_rejects.inc(reason='no_face')
+        return {'error': 'No face detected in image. Please ensure your face is clearly visible.'}, 400
+    
+    if not face_locations and not classroom:
+        reject = rejects[0]
+        return {
+            'error': REJECT_MESSAGES[reject['reason']],
+            'reason': reject['reason'],
+            'scores': reject['scores']
+        }, 400
+    
+    if classroom:
+        start = time.perf_counter()
+        result = mark_classroom_attendance(subject_id, face_locations, matches, rejects)
+        timings['store_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        metrics.stage_seconds.observe(timings['store_ms'] / 1000, stage='store')
+        result['timings'] = timings
+        return result, 200
+    
+    matched_student, matched_name, best_distance, matched = matches[0]
+    
+    if matched_student is None:
+        return {'error': 'No students registered in the system. Please add students first.'}, 400
+    
+    # If distance is not below threshold, there is no match
+    if not matched:
+        return {
+            'error': f'No matching student found. Best match was {matched_name} with confidence {1 - best_distance:.2%}. Please try again with better lighting or positioning.'
+        }, 400
+    
+    # Mark attendance unless it is already marked for today
+    start = time.perf_counter()
+    newly_marked = record_attendance(subject_id, [matched_student])
+    timings['store_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    metrics.stage_seconds.observe(timings['store_ms'] / 1000, stage='store')
+    
+    if matched_student not in newly_marked:
+        return {'error': f'Attendance already marked for {matched_name}'}, 400
+    
+    return {
+        'message': f'Attendance marked successfully for {matched_name}',
+        'student_name': matched_name,
+        'timings': timings
+    }, 200
+
 @app.route('/api/attendance', methods=['POST'])
 def mark_attendance():
     try:
@@ -273,177 +691,211 @@ def mark_attendance():
         if not image or not subject_id:
             return jsonify({'error': 'Missing required fields'}), 400
             
-        # Validate subject exists
-        conn = sqlite3.connect('database/attendance.db')
-        c = conn.cursor()
-        c.execute('SELECT id FROM subjects WHERE id = ?', (subject_id,))
-        if not c.fetchone():
-            conn.close()
+        if not subject_exists(subject_id):
             return jsonify({'error': 'Invalid subject ID'}), 400
             
-        # Process image and face recognition
-        image_data = image.read()
-        nparr = np.frombuffer(image_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        # Convert to RGB for face_recognition
-        rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        face_locations = face_recognition.face_locations(rgb_img)
-        
-        if not face_locations:
-            conn.close()
-            return jsonify({'error': 'No face detected in image. Please ensure your face is clearly visible.'}), 400
-            
-        face_encoding = face_recognition.face_encodings(rgb_img, face_locations)[0]
-        
-        # Get current date and time as strings
-        current_date = datetime.now().strftime('%Y-%m-%d')
-        current_time = datetime.now().strftime('%H:%M:%S')
-        
-        # Get all students with their face encodings
-        c.execute('SELECT id, name, face_encoding FROM students')
-        students = c.fetchall()
-        
-        if not students:
-            conn.close()
-            return jsonify({'error': 'No students registered in the system. Please add students first.'}), 400
-        
-        # Find matching student
-        matched_student = None
-        matched_name = None
-        best_match = None
-        best_distance = float('inf')
-        
-        for student_id, name, stored_encoding in students:
-            try:
-                # Convert stored encoding from JSON string to numpy array
-                stored_encoding = np.array(json.loads(stored_encoding))
-                
-                # Calculate face distance
-                face_distance = face_recognition.face_distance([stored_encoding], face_encoding)[0]
-                
-                # Update best match if this is closer
-                if face_distance < best_distance:
-                    best_distance = face_distance
-                    best_match = (student_id, name)
-                
-                # If distance is below threshold, consider it a match
-                if face_distance < 0.6:  # Adjust this threshold as needed
-                    matched_student = student_id
-                    matched_name = name
-                    break
-                    
-            except Exception as e:
-                print(f"Error processing face encoding for student {student_id}: {str(e)}")
-                continue
-                
-        if not matched_student:
-            conn.close()
-            if best_match:
-                return jsonify({
-                    'error': f'No matching student found. Best match was {best_match[1]} with confidence {1 - best_distance:.2%}. Please try again with better lighting or positioning.'
-                }), 400
-            return jsonify({'error': 'No matching student found. Please ensure you are registered in the system.'}), 400
-            
-        # Check for duplicate attendance
-        c.execute('''
-            SELECT id FROM attendance 
-            WHERE student_id = ? AND subject_id = ? AND date = ?
-        ''', (matched_student, subject_id, current_date))
-        
-        if c.fetchone():
-            conn.close()
-            return jsonify({'error': f'Attendance already marked for {matched_name}'}), 400
-            
-        # Mark attendance
-        c.execute('''
-            INSERT INTO attendance (student_id, subject_id, date, time, status)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (matched_student, subject_id, current_date, current_time, 'present'))
-        
-        conn.commit()
-        conn.close()
-        
-        return jsonify({
-            'message': f'Attendance marked successfully for {matched_name}',
-            'student_name': matched_name
-        }), 200
-        
+        # Decode, detect, encode and match in a recognition worker.
+        # Classroom mode marks every recognized face, otherwise only the largest face is used
+        classroom = request.form.get('mode') == 'classroom'
+        start = time.perf_counter()
+        try:
+            result = recognition_pool.run(recognize_image, image.read(), int(subject_id), classroom)
+        except PoolBusy:
+            return busy_response()
+        except InvalidImage:
+            return invalid_image_response()
+        record_timings(result[3], start)
+        
+        body, status = attendance_result(int(subject_id), classroom, *result)
+        return jsonify(body), status
+        
+    except WriteTimeout:
+        return busy_response(WRITE_TIMEOUT_MESSAGE, resource='attendance')
+    except sqlite3.OperationalError as e:
+        if is_busy_error(e):
+            return busy_response('Database is busy. Please retry shortly.', resource='database')
+        print(f"Error marking attendance: {str(e)}")
+        return jsonify({'error': f'Failed to mark attendance: {str(e)}'}), 500
     except Exception as e:
         print(f"Error marking attendance: {str(e)}")
         return jsonify({'error': f'Failed to mark attendance: {str(e)}'}), 500
 
-@app.route('/api/attendance/report', methods=['GET'])
-def get_attendance_report():
-    date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
-    subject_id = request.args.get('subject_id')
+# Streaming attendance for continuous camera feeds
+@app.route('/api/attendance/stream', methods=['POST'])
+def start_attendance_stream():
+    data = request.get_json(silent=True) or request.form
+    subject_id = data.get('subject_id')
+    
+    if not subject_id:
+        return jsonify({'error': 'Missing subject_id'}), 400
     
-    conn = sqlite3.connect('database/attendance.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_connection()
     c = conn.cursor()
+    c.execute('SELECT id FROM subjects WHERE id = ?', (subject_id,))
+    subject = c.fetchone()
     
-    if subject_id:
-        c.execute('''
-        SELECT a.id, a.date, a.time, a.status, 
-               s.id as student_id, s.name, s.roll_number,
-               sub.id as subject_id, sub.code, sub.name as subject_name
-        FROM attendance a
-        JOIN students s ON a.student_id = s.id
-        JOIN subjects sub ON a.subject_id = sub.id
-        WHERE a.date = ? AND a.subject_id = ?
-        ORDER BY a.time
-        ''', (date, subject_id))
+    if not subject:
+        return jsonify({'error': 'Invalid subject ID'}), 400
+    
+    session = stream_sessions.create(subject[0])
+    return jsonify({'session_id': session.session_id, 'subject_id': session.subject_id}), 201
+
+@app.route('/api/attendance/stream/<session_id>/frames', methods=['POST'])
+def post_stream_frames(session_id):
+    """
+    Accepts one multipart 'image' frame, or a chunked body of length-prefixed
+    frames, and streams back NDJSON recognition events as each frame is processed
+    """
+    session = stream_sessions.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Stream session not found'}), 404
+    
+    if 'image' in request.files:
+        frames = [request.files['image'].read()]
     else:
-        c.execute('''
-        SELECT a.id, a.date, a.time, a.status, 
-               s.id as student_id, s.name, s.roll_number,
-               sub.id as subject_id, sub.code, sub.name as subject_name
-        FROM attendance a
-        JOIN students s ON a.student_id = s.id
-        JOIN subjects sub ON a.subject_id = sub.id
-        WHERE a.date = ?
-        ORDER BY a.time
-        ''', (date,))
+        frames = read_frames(request.stream)
+    
+    def generate():
+        try:
+            for frame in frames:
+                try:
+                    events = session.process_frame(frame, recognition_pool.run, functools.partial(record_attendance, session.subject_id))
+                except (PoolBusy, WriteTimeout):
+                    # Drop the frame; the client keeps streaming
+                    events = [{'type': 'busy', 'retry_after': RECOGNITION_RETRY_AFTER}]
+                except ValueError as e:
+                    events = [{'type': 'error', 'error': str(e)}]
+                except Exception as e:
+                    # Headers are already sent; report the failed frame in the stream instead
+                    print(f"Error processing stream frame: {str(e)}")
+                    events = [{'type': 'error', 'error': f'Failed to process frame: {str(e)}'}]
+                for event in events:
+                    if event['type'] == 'frame' and 'timings' in event:
+                        metrics.record_timings(event['timings'])
+                    elif event['type'] == 'rejected':
+                        metrics.face_rejects.inc(reason=event['reason'])
+                    yield json.dumps(event) + '\n'
+        except ValueError as e:
+            yield json.dumps({'type': 'error', 'error': str(e)}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/attendance/stream/<session_id>/events', methods=['GET'])
+def get_stream_events(session_id):
+    """
+    Server-sent events feed of a session's recognition events
+    """
+    session = stream_sessions.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Stream session not found'}), 404
+    
+    def generate():
+        while not session.closed:
+            try:
+                event = session.events.get(timeout=15)
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+                continue
+            yield f'data: {json.dumps(event)}\n\n'
+    
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/api/attendance/stream/<session_id>', methods=['DELETE'])
+def stop_attendance_stream(session_id):
+    session = stream_sessions.close(session_id)
+    if session is None:
+        return jsonify({'error': 'Stream session not found'}), 404
+    return jsonify({
+        'message': 'Stream session closed',
+        'frames': session.frame_count,
+        'marked_student_ids': sorted(session.marked)
+    })
+
+REPORT_FIELDS = ['id', 'date', 'time', 'status', 'student_id', 'name', 'roll_number',
+                 'subject_id', 'code', 'subject_name']
+
+@app.route('/api/attendance/report', methods=['GET'])
+def get_attendance_report():
+    """
+    Attendance records for one date (default today) or a date range
+    (start_date/end_date), optionally for one subject and/or student,
+    ordered by date and time. Supports limit/cursor pagination and
+    format=json|ndjson|csv.
+    """
+    conditions = []
+    params = []
+    try:
+        limit, output_format = page_args()
+        
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        if start_date or end_date:
+            for value in (start_date, end_date):
+                if value:
+                    datetime.strptime(value, '%Y-%m-%d')
+            if start_date:
+                conditions.append('a.date >= ?')
+                params.append(start_date)
+            if end_date:
+                conditions.append('a.date <= ?')
+                params.append(end_date)
+        else:
+            date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+            conditions.append('a.date = ?')
+            params.append(date)
+        
+        for field in ('subject_id', 'student_id'):
+            value = request.args.get(field)
+            if value:
+                conditions.append(f'a.{field} = ?')
+                params.append(int(value))
+        
+        if request.args.get('cursor'):
+            conditions.append('(a.date, a.time, a.id) > (?, ?, ?)')
+            params.extend(decode_cursor(request.args['cursor'], (str, str, int)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    report = [dict(row) for row in c.fetchall()]
-    conn.close()
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(f'''
+    SELECT a.id, a.date, a.time, a.status, 
+           s.id as student_id, s.name, s.roll_number,
+           sub.id as subject_id, sub.code, sub.name as subject_name
+    FROM attendance a
+    JOIN students s ON a.student_id = s.id
+    JOIN subjects sub ON a.subject_id = sub.id
+    WHERE {' AND '.join(conditions)}
+    ORDER BY a.date, a.time, a.id
+    ''', params)
     
-    return jsonify(report)
+    return list_response(c, limit, output_format, REPORT_FIELDS, ['date', 'time', 'id'], 'attendance_report')
 
 @app.route('/api/attendance/statistics', methods=['GET'])
 def get_attendance_statistics():
     student_id = request.args.get('student_id')
     subject_id = request.args.get('subject_id')
     
-    conn = sqlite3.connect('database/attendance.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_connection()
     c = conn.cursor()
     
     statistics = {}
     
     if student_id:
-        # Get total classes for each subject
+        # Classes held and attended per subject, from the precomputed totals
         c.execute('''
-        SELECT s.id, s.code, s.name, COUNT(DISTINCT a.date) as total_classes
+        SELECT s.id, s.code, s.name,
+               COALESCE(st.classes_held, 0) as total_classes,
+               COALESCE(t.attended, 0) as attended_classes
         FROM subjects s
-        LEFT JOIN attendance a ON s.id = a.subject_id
-        GROUP BY s.id
-        ''')
-        subject_totals = {row['id']: row['total_classes'] for row in c.fetchall()}
-        
-        # Get attended classes for this student
-        c.execute('''
-        SELECT s.id, s.code, s.name, COUNT(a.id) as attended_classes
-        FROM subjects s
-        LEFT JOIN attendance a ON s.id = a.subject_id AND a.student_id = ?
-        GROUP BY s.id
+        LEFT JOIN subject_totals st ON st.subject_id = s.id
+        LEFT JOIN attendance_totals t ON t.student_id = ? AND t.subject_id = s.id
         ''', (student_id,))
         
         subjects = []
         for row in c.fetchall():
-            subject_data = dict(row)
-            total_classes = subject_totals.get(row['id'], 0)
-            attended = subject_data['attended_classes'] or 0
+            total_classes = row['total_classes']
+            attended = row['attended_classes']
             
             # Calculate percentage
             percentage = 0
@@ -472,25 +924,20 @@ def get_attendance_statistics():
     
     elif subject_id:
         # Get total classes for this subject
-        c.execute('''
-        SELECT COUNT(DISTINCT date) as total_classes
-        FROM attendance
-        WHERE subject_id = ?
-        ''', (subject_id,))
-        total_classes = c.fetchone()['total_classes']
+        c.execute('SELECT classes_held FROM subject_totals WHERE subject_id = ?', (subject_id,))
+        row = c.fetchone()
+        total_classes = row['classes_held'] if row else 0
         
         # Get attendance stats for all students in this subject
         c.execute('''
-        SELECT s.id, s.name, s.roll_number, COUNT(a.id) as attended_classes
+        SELECT s.id, s.name, s.roll_number, COALESCE(t.attended, 0) as attended_classes
         FROM students s
-        LEFT JOIN attendance a ON s.id = a.student_id AND a.subject_id = ?
-        GROUP BY s.id
+        LEFT JOIN attendance_totals t ON t.student_id = s.id AND t.subject_id = ?
         ''', (subject_id,))
         
         students = []
         for row in c.fetchall():
-            student_data = dict(row)
-            attended = student_data['attended_classes'] or 0
+            attended = row['attended_classes']
             
             # Calculate percentage
             percentage = 0
@@ -526,7 +973,7 @@ def get_attendance_statistics():
         subject_count = c.fetchone()['count']
         
         c.execute('''
-        SELECT COUNT(DISTINCT student_id, date) as count FROM attendance
+        SELECT COUNT(DISTINCT student_id) as count FROM attendance
         WHERE date = ?
         ''', (datetime.now().strftime('%Y-%m-%d'),))
         today_attendance = c.fetchone()['count']
@@ -538,7 +985,6 @@ def get_attendance_statistics():
             'today_percentage': round((today_attendance / student_count) * 100, 2) if student_count > 0 else 0
         }
     
-    conn.close()
     return jsonify(statistics)
 
 if __name__ == '__main__':
@@ -0,0 +1,323 @@
+"""
+ASGI entry point for deployments with many concurrent kiosks.
+
+Serve it with any ASGI server from the backend directory, for example:
+    uvicorn asgi:application --port 5000
+
+POST /api/attendance, which every kiosk calls, is handled on the event
+loop: the upload is read without holding a thread, recognition is awaited
+on the recognition process pool, and only the short database work runs on
+one of ASGI_THREADS threads. Every other route is passed to the Flask app
+on the same threads, so the API is identical to `python app.py`.
+
+Streaming routes keep their thread until the client disconnects, so they
+run on a separate pool of ASGI_STREAM_THREADS threads and cannot starve
+the short requests; when every stream thread is taken, a new stream is
+answered with 503 and Retry-After.
+"""
+import asyncio
+import functools
+import io
+import json
+import re
+import sqlite3
+import threading
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.formparser import parse_form_data
+import app as flask_app
+from utils import metrics
+from utils.attendance_writer import WriteTimeout, attendance_writer
+from utils.config import (
+    ASGI_MAX_BODY_BYTES, ASGI_STREAM_THREADS, ASGI_THREADS, RECOGNITION_RETRY_AFTER, SERVER_TIMING
+)
+from utils.db import is_busy_error, release_connection
+from utils.ingest import InvalidImage, upload_stream
+from utils.recognition import recognize_image
+from utils.workers import PoolBusy, recognition_pool
+
+executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix='asgi')
+stream_executor = ThreadPoolExecutor(max_workers=max(ASGI_STREAM_THREADS, 1), thread_name_prefix='asgi-stream')
+# Free stream threads; a stream is only started when it can have one at once
+stream_slots = threading.BoundedSemaphore(max(ASGI_STREAM_THREADS, 1))
+
+# Frame uploads and event feeds of streaming sessions
+STREAM_PATH = re.compile(r'/api/attendance/stream/[^/]+/(frames|events)')
+
+
+class BodyTooLarge(Exception):
+    """
+    Raised when an upload exceeds ASGI_MAX_BODY_BYTES
+    """
+
+
+class RequestStream(io.RawIOBase):
+    """
+    wsgi.input for a Flask request running on a thread, pulling body chunks
+    from the ASGI receive channel on the event loop as they are read
+    """
+
+    def __init__(self, receive, loop, has_body):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = bytearray()
+        self.complete = not has_body
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer and not self.complete:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            self._buffer += message.get('body', b'')
+            self.complete = message['type'] == 'http.disconnect' or not message.get('more_body', False)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        del self._buffer[:n]
+        return n
+
+
+def _header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin1')
+    return None
+
+
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client')
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': client[0] if client else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    for name, value in scope['headers']:
+        name, value = name.decode('latin1'), value.decode('latin1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def _in_thread(fn, *args):
+    # Like a Flask request teardown: never leave a transaction open on a pooled thread
+    try:
+        return fn(*args)
+    finally:
+        release_connection()
+
+
+async def read_body(receive, limit=ASGI_MAX_BODY_BYTES):
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionResetError('Client disconnected')
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            raise BodyTooLarge()
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+async def send_json(send, body, status, headers=()):
+    payload = json.dumps(body, sort_keys=True).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(payload)).encode()),
+            (b'access-control-allow-origin', b'*'),
+            *((name.encode('latin1'), value.encode('latin1')) for name, value in headers)
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def mark_attendance(scope, receive, send):
+    """
+    Non-blocking version of the Flask mark_attendance view
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        body = await read_body(receive)
+    except BodyTooLarge:
+        return await send_json(send, {'error': 'Upload is too large'}, 413)
+    except ConnectionResetError:
+        return
+
+    environ = wsgi_environ(scope, io.BytesIO(body))
+    environ['CONTENT_LENGTH'] = str(len(body))
+    _, form, files = await loop.run_in_executor(
+        executor, functools.partial(parse_form_data, environ, stream_factory=upload_stream)
+    )
+    if 'image' not in files or 'subject_id' not in form:
+        return await send_json(send, {'error': 'Missing image or subject_id'}, 400)
+
+    image = files['image']
+    subject_id = form['subject_id']
+    if not image or not subject_id:
+        return await send_json(send, {'error': 'Missing required fields'}, 400)
+
+    try:
+        if not await loop.run_in_executor(executor, _in_thread, flask_app.subject_exists, subject_id):
+            return await send_json(send, {'error': 'Invalid subject ID'}, 400)
+
+        classroom = form.get('mode') == 'classroom'
+        start = time.perf_counter()
+        try:
+            future = recognition_pool.submit(recognize_image, image.read(), int(subject_id), classroom)
+        except PoolBusy:
+            metrics.busy_rejections.inc(resource='recognition')
+            return await send_json(send, {'error': 'Recognition service is busy. Please retry shortly.'}, 503,
+                                   [('retry-after', str(RECOGNITION_RETRY_AFTER))])
+        try:
+            result = await asyncio.wrap_future(future)
+        except InvalidImage:
+            metrics.face_rejects.inc(reason='invalid_image')
+            return await send_json(send, {'error': flask_app.INVALID_IMAGE_MESSAGE}, 400)
+        flask_app.observe_timings(result[3], start)
+
+        body, status = await loop.run_in_executor(
+            executor, _in_thread, flask_app.attendance_result, int(subject_id), classroom, *result
+        )
+        headers = [('server-timing', flask_app.server_timing(result[3]))] if SERVER_TIMING else []
+        await send_json(send, body, status, headers)
+
+    except WriteTimeout:
+        metrics.busy_rejections.inc(resource='attendance')
+        return await send_json(send, {'error': flask_app.WRITE_TIMEOUT_MESSAGE}, 503,
+                               [('retry-after', str(RECOGNITION_RETRY_AFTER))])
+    except sqlite3.OperationalError as e:
+        if is_busy_error(e):
+            metrics.busy_rejections.inc(resource='database')
+            return await send_json(send, {'error': 'Database is busy. Please retry shortly.'}, 503,
+                                   [('retry-after', str(RECOGNITION_RETRY_AFTER))])
+        print(f"Error marking attendance: {str(e)}")
+        await send_json(send, {'error': f'Failed to mark attendance: {str(e)}'}, 500)
+    except Exception as e:
+        print(f"Error marking attendance: {str(e)}")
+        await send_json(send, {'error': f'Failed to mark attendance: {str(e)}'}, 500)
+
+
+async def _wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def call_flask(scope, receive, send, loop):
+    """
+    Run the Flask app for one request on the calling (pool) thread.
+
+    A WSGI response must be produced on the thread that started it (it may
+    hold that thread's database cursor), so the whole request runs here and
+    each chunk is sent through the event loop as it is produced. Long-lived
+    responses such as event streams keep their thread until the client leaves.
+    """
+    has_body = _header(scope, b'transfer-encoding') == 'chunked' or (_header(scope, b'content-length') or '0') != '0'
+    stream = RequestStream(receive, loop, has_body)
+    environ = wsgi_environ(scope, io.BufferedReader(stream))
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+
+    def forward(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    iterable = flask_app.app(environ, start_response)
+    disconnected = None
+    try:
+        forward({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+        for chunk in iterable:
+            # Once the request body is consumed, watch for the client going away
+            if disconnected is None and stream.complete:
+                disconnected = asyncio.run_coroutine_threadsafe(_wait_disconnect(receive), loop)
+            if disconnected is not None and disconnected.done():
+                return
+            if chunk:
+                forward({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        forward({'type': 'http.response.body', 'body': b''})
+    finally:
+        if disconnected is not None:
+            disconnected.cancel()
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+
+def _call_stream(scope, receive, send, loop):
+    # The slot is freed by the thread itself, which may outlive a cancelled awaiting coroutine
+    try:
+        call_flask(scope, receive, send, loop)
+    finally:
+        stream_slots.release()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, recognition_pool.shutdown)
+            # Commit queued attendance before the server exits
+            await loop.run_in_executor(None, attendance_writer.close)
+            executor.shutdown(wait=False)
+            stream_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    start = time.perf_counter()
+    if scope['method'] == 'POST' and scope['path'] == '/api/attendance':
+        try:
+            await mark_attendance(scope, receive, send)
+        finally:
+            metrics.request_seconds.observe(time.perf_counter() - start, endpoint='/api/attendance')
+    elif STREAM_PATH.fullmatch(scope['path']):
+        if not stream_slots.acquire(blocking=False):
+            metrics.busy_rejections.inc(resource='stream')
+            return await send_json(send, {'error': 'Too many open streams. Please retry shortly.'}, 503,
+                                   [('retry-after', str(RECOGNITION_RETRY_AFTER))])
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(stream_executor, _call_stream, scope, receive, send, loop)
+        except Exception:
+            stream_slots.release()
+            raise
+        await future
+    else:
+        # The Flask app records its own request metrics
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(executor, call_flask, scope, receive, send, loop)
@@ -0,0 +1,57 @@
+"""
+Recall and latency of the IVF index against exact brute-force search.
+
+Run from the backend directory:
+    python -m benchmarks.bench_ann --students 50000 --queries 500
+"""
+import argparse
+import time
+import numpy as np
+from benchmarks.synthetic import synthetic_gallery
+from utils.ann_index import IVFIndex
+from utils.encodings import ENCODING_DIM
+from utils.gallery import pairwise_distances
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--students', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--n-lists', type=int, default=0)
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--noise', type=float, default=0.02, help='per-dimension probe noise')
+    args = parser.parse_args()
+
+    encodings = synthetic_gallery(args.students)
+    ids = np.arange(1, args.students + 1)
+    rng = np.random.default_rng(1)
+    targets = rng.choice(args.students, args.queries, replace=False)
+    probes = encodings[targets] + rng.normal(0, args.noise, (args.queries, ENCODING_DIM)).astype(np.float32)
+
+    sq_norms = np.einsum('ij,ij->i', encodings, encodings)
+    exact = []
+    start = time.perf_counter()
+    for probe in probes:
+        exact.append(ids[np.argmin(pairwise_distances(probe, encodings, sq_norms)[0])])
+    elapsed = time.perf_counter() - start
+    print(f'students={args.students} queries={args.queries}')
+    print(f'exact      : {1000 * elapsed / args.queries:8.3f} ms/query')
+
+    index = IVFIndex(n_lists=args.n_lists)
+    start = time.perf_counter()
+    index.build(ids, encodings)
+    print(f'build      : {time.perf_counter() - start:8.3f} s ({index.n_lists} lists)')
+
+    for n_probe in args.n_probe:
+        hits = 0
+        start = time.perf_counter()
+        for probe, expected in zip(probes, exact):
+            result = index.search(probe, n_probe=n_probe)
+            hits += bool(result) and result[0][0] == expected
+        elapsed = time.perf_counter() - start
+        print(f'n_probe={n_probe:<3}: {1000 * elapsed / args.queries:8.3f} ms/query  '
+              f'recall@1={hits / args.queries:.4f}')
+
+
+if __name__ == '__main__':
+    main()
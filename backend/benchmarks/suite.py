@@ -0,0 +1,382 @@
+"""
+Benchmark suite for matching, recognition, enrollment and reporting.
+
+Everything runs against a throwaway database in a temporary directory, and
+the results are written as JSON so runs can be compared. Run from the
+backend directory:
+    python -m benchmarks.suite --output benchmarks/results/before.json
+    python -m benchmarks.suite --compare benchmarks/results/before.json
+
+The end-to-end attendance and enrollment benchmarks need real photos:
+put sample images (one face each, e.g. consenting volunteers) in
+benchmarks/images or pass --images. Without them those sections are skipped.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# The backend resolves its database and uploads relative to the working
+# directory, which the suite moves to a temporary one
+sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks.synthetic import seed_attendance, seed_students, seed_subjects, synthetic_gallery
+from utils import attendance_summary
+from utils.ann_index import IVFIndex
+from utils.config import IVF_MIN_GALLERY
+from utils.db import connect, transaction
+from utils.encodings import ENCODING_DIM
+from utils.gallery import FaceGallery
+
+
+def summarize(samples_ms):
+    """
+    Latency percentiles of a list of millisecond samples
+    """
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    if not len(samples):
+        return {}
+    return {
+        'count': int(len(samples)),
+        'mean_ms': round(float(samples.mean()), 3),
+        'p50_ms': round(float(np.percentile(samples, 50)), 3),
+        'p95_ms': round(float(np.percentile(samples, 95)), 3),
+        'p99_ms': round(float(np.percentile(samples, 99)), 3),
+        'max_ms': round(float(samples.max()), 3)
+    }
+
+
+def time_calls(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def bench_matching(sizes, queries, classroom_faces):
+    """
+    Single-probe and classroom matching throughput against synthetic galleries
+    """
+    results = {}
+    rng = np.random.default_rng(1)
+    for size in sizes:
+        encodings = synthetic_gallery(size)
+        ids = list(range(1, size + 1))
+        targets = rng.choice(size, queries, replace=True)
+        probes = encodings[targets] + rng.normal(0, 0.02, (queries, ENCODING_DIM)).astype(np.float32)
+
+        gallery = FaceGallery()
+        start = time.perf_counter()
+        gallery.add_many([(student_id, f'Synthetic {student_id}', encoding)
+                          for student_id, encoding in zip(ids, encodings)])
+        load_s = time.perf_counter() - start
+
+        samples = [time_calls(lambda probe=probe: gallery.match(probe), 1)[0] for probe in probes]
+        exact = [gallery.match(probe)[0] for probe in probes]
+        result = {
+            'load_s': round(load_s, 3),
+            'exact': {**summarize(samples), 'qps': round(1000 / np.mean(samples), 1)}
+        }
+
+        batches = [probes[i:i + classroom_faces] for i in range(0, queries, classroom_faces)]
+        samples = [time_calls(lambda batch=batch: gallery.match_faces(batch), 1)[0] for batch in batches]
+        result['classroom'] = {**summarize(samples), 'faces_per_call': classroom_faces,
+                               'faces_per_s': round(1000 * classroom_faces / np.mean(samples), 1)}
+
+        # Three templates per student: the centroid scan plus top-k refinement
+        templated = FaceGallery()
+        for student_id, encoding in zip(ids, encodings):
+            templated.set_templates(student_id, f'Synthetic {student_id}',
+                                    encoding + rng.normal(0, 0.02, (3, ENCODING_DIM)).astype(np.float32))
+        samples = [time_calls(lambda probe=probe: templated.match(probe), 1)[0] for probe in probes]
+        hits = sum(templated.match(probe)[0] == ids[target] for probe, target in zip(probes, targets))
+        result['templates'] = {**summarize(samples), 'qps': round(1000 / np.mean(samples), 1),
+                               'templates_per_student': 3, 'accuracy': round(hits / queries, 4)}
+
+        if size >= IVF_MIN_GALLERY:
+            start = time.perf_counter()
+            gallery.use_index(IVFIndex())
+            build_s = time.perf_counter() - start
+            samples = [time_calls(lambda probe=probe: gallery.match(probe), 1)[0] for probe in probes]
+            hits = sum(gallery.match(probe)[0] == expected for probe, expected in zip(probes, exact))
+            result['ivf'] = {**summarize(samples), 'qps': round(1000 / np.mean(samples), 1),
+                             'build_s': round(build_s, 3), 'recall_at_1': round(hits / queries, 4)}
+
+        results[str(size)] = result
+        print(f"matching {size:>7}: exact p50 {result['exact']['p50_ms']} ms, "
+              f"classroom {result['classroom']['faces_per_s']} faces/s, "
+              f"templates p50 {result['templates']['p50_ms']} ms"
+              + (f", ivf p50 {result['ivf']['p50_ms']} ms recall {result['ivf']['recall_at_1']}"
+                 if 'ivf' in result else ''))
+    return results
+
+
+def bench_history(app_module, n_students, n_subjects, n_days, repeat):
+    """
+    Seed synthetic students and attendance history, then time the report and statistics queries
+    """
+    conn = connect()
+    c = conn.cursor()
+    start = time.perf_counter()
+    student_ids = seed_students(c, n_students)
+    subject_ids = seed_subjects(c, n_subjects)
+    conn.commit()
+    students_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows = seed_attendance(c, student_ids, subject_ids, n_days)
+    conn.commit()
+    attendance_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    attendance_summary.rebuild(conn)
+    summary_s = time.perf_counter() - start
+    c.execute('SELECT MIN(date), MAX(date) FROM attendance')
+    first_date, last_date = c.fetchone()
+    conn.close()
+
+    start = time.perf_counter()
+    app_module.gallery.rebuild()
+    gallery_s = time.perf_counter() - start
+
+    database = {
+        'students': n_students,
+        'subjects': n_subjects,
+        'attendance_rows': rows,
+        'student_insert_per_s': round(n_students / students_s, 1),
+        'attendance_insert_per_s': round(rows / attendance_s, 1),
+        'summary_rebuild_s': round(summary_s, 3),
+        'gallery_rebuild_s': round(gallery_s, 3)
+    }
+    print(f"history: {rows} attendance rows, {database['attendance_insert_per_s']} rows/s, "
+          f"summary rebuild {database['summary_rebuild_s']} s")
+
+    client = app_module.app.test_client()
+    student_id, subject_id = student_ids[len(student_ids) // 2], subject_ids[0]
+    queries = {
+        'report_day': f'/api/attendance/report?date={last_date}',
+        'report_day_subject': f'/api/attendance/report?date={last_date}&subject_id={subject_id}',
+        'report_range_page': f'/api/attendance/report?start_date={first_date}&end_date={last_date}&limit=100',
+        'report_student_range': f'/api/attendance/report?start_date={first_date}&student_id={student_id}',
+        'statistics_overall': '/api/attendance/statistics',
+        'statistics_student': f'/api/attendance/statistics?student_id={student_id}',
+        'statistics_subject': f'/api/attendance/statistics?subject_id={subject_id}',
+        'students_page': '/api/students?limit=100'
+    }
+    results = {}
+    for name, url in queries.items():
+        def request():
+            response = client.get(url)
+            response.get_data()
+            assert response.status_code == 200, (url, response.status_code)
+        request()
+        results[name] = summarize(time_calls(request, repeat))
+        print(f"query {name:<22}: p50 {results[name]['p50_ms']} ms")
+
+    # Full streaming export of the whole history
+    start = time.perf_counter()
+    exported = client.get(f'/api/attendance/report?start_date={first_date}&format=ndjson').get_data().count(b'\n')
+    export_s = time.perf_counter() - start
+    results['export_ndjson'] = {'rows': exported, 'rows_per_s': round(exported / export_s, 1)}
+    print(f"query {'export_ndjson':<22}: {results['export_ndjson']['rows_per_s']} rows/s")
+
+    return database, results
+
+
+def load_images(directory):
+    if not directory or not os.path.isdir(directory):
+        return []
+    images = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(directory, name), 'rb') as f:
+                images.append((name, f.read()))
+    return images
+
+
+def bench_enrollment(app_module, images):
+    """
+    Enroll every sample image through POST /api/students
+    """
+    client = app_module.app.test_client()
+    samples = []
+    enrolled = []
+    failures = 0
+    start = time.perf_counter()
+    for i, (name, image_data) in enumerate(images):
+        request_start = time.perf_counter()
+        response = client.post('/api/students', data={
+            'name': os.path.splitext(name)[0],
+            'roll_number': f'BENCH-IMG-{i}',
+            'image': (BytesIO(image_data), name)
+        })
+        samples.append((time.perf_counter() - request_start) * 1000)
+        if response.status_code == 201:
+            enrolled.append(response.get_json()['id'])
+        else:
+            failures += 1
+    elapsed = time.perf_counter() - start
+
+    result = {**summarize(samples), 'enrolled': len(enrolled), 'failed': failures,
+              'images_per_s': round(len(images) / elapsed, 2)}
+    print(f"enrollment: {len(enrolled)}/{len(images)} enrolled, {result['images_per_s']} images/s")
+    return result, enrolled
+
+
+def bench_attendance(app_module, images, student_ids, concurrency_levels, requests_per_level):
+    """
+    End-to-end POST /api/attendance latency with concurrent clients
+    """
+    with transaction() as c:
+        c.execute("INSERT INTO subjects (code, name, faculty) VALUES ('BENCH-E2E', 'End-to-end', 'Synthetic')")
+        subject_id = c.lastrowid
+        c.executemany('INSERT INTO enrollments (student_id, subject_id) VALUES (?, ?)',
+                      [(student_id, subject_id) for student_id in student_ids])
+
+    results = {}
+    for concurrency in concurrency_levels:
+        def post(i):
+            name, image_data = images[i % len(images)]
+            client = app_module.app.test_client()
+            start = time.perf_counter()
+            response = client.post('/api/attendance', data={
+                'subject_id': str(subject_id),
+                'image': (BytesIO(image_data), name)
+            })
+            return (time.perf_counter() - start) * 1000, response.status_code
+
+        # Repeats answer "already marked" after the first pass, which still runs the whole pipeline
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(post, range(requests_per_level)))
+        elapsed = time.perf_counter() - start
+
+        statuses = {}
+        for _, status in outcomes:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        results[str(concurrency)] = {**summarize([latency for latency, _ in outcomes]),
+                                     'requests_per_s': round(requests_per_level / elapsed, 2),
+                                     'statuses': statuses}
+        print(f"attendance x{concurrency:<3}: p50 {results[str(concurrency)]['p50_ms']} ms, "
+              f"p95 {results[str(concurrency)]['p95_ms']} ms, {results[str(concurrency)]['requests_per_s']} req/s")
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def flatten(results, prefix=''):
+    values = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[f'{prefix}{key}'] = value
+    return values
+
+
+def compare(previous, current):
+    """
+    Print every numeric result present in both runs with its relative change
+    """
+    before = flatten({key: previous[key] for key in previous if key != 'meta'})
+    after = flatten({key: current[key] for key in current if key != 'meta'})
+    print(f"\ncompared with {previous['meta'].get('revision')} ({previous['meta'].get('timestamp')}):")
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        change = f'{100 * (new - old) / old:+.1f}%' if old else 'n/a'
+        print(f'{key:<55} {old:>12} -> {new:>12}  {change}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='gallery sizes for the matching benchmark')
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--classroom-faces', type=int, default=30)
+    parser.add_argument('--history-students', type=int, default=2000)
+    parser.add_argument('--history-subjects', type=int, default=6)
+    parser.add_argument('--history-days', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=20, help='repetitions per query')
+    parser.add_argument('--images', default=os.path.join(BACKEND_DIR, 'benchmarks', 'images'))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--requests', type=int, default=100, help='attendance requests per concurrency level')
+    parser.add_argument('--skip', nargs='*', default=[], choices=['matching', 'history', 'enrollment', 'attendance'])
+    parser.add_argument('--output', help='results file (default benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output or os.path.join(
+        BACKEND_DIR, 'benchmarks', 'results', f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"))
+    images = load_images(args.images)
+
+    results = {'meta': {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': vars(args),
+        'env': {key: os.environ[key] for key in
+                ('RECOGNITION_WORKERS', 'FACE_MATCHER', 'DETECT_SCALE', 'DETECT_MODEL', 'NUM_JITTERS')
+                if key in os.environ}
+    }}
+
+    if 'matching' not in args.skip:
+        results['matching'] = bench_matching(args.sizes, args.queries, args.classroom_faces)
+
+    workdir = tempfile.mkdtemp(prefix='attendance-bench-')
+    os.chdir(workdir)
+    try:
+        # Importing the app creates its database in the working directory
+        import app as app_module
+
+        if 'history' not in args.skip:
+            results['database'], results['queries'] = bench_history(
+                app_module, args.history_students, args.history_subjects, args.history_days, args.repeat)
+
+        if not images:
+            print(f'No sample images in {args.images}; skipping enrollment and attendance benchmarks')
+        else:
+            enrolled = []
+            if 'enrollment' not in args.skip:
+                results['enrollment'], enrolled = bench_enrollment(app_module, images)
+            if 'attendance' not in args.skip and enrolled:
+                results['attendance'] = bench_attendance(
+                    app_module, images, enrolled, args.concurrency, args.requests)
+        app_module.recognition_pool.shutdown()
+    finally:
+        os.chdir(BACKEND_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'\nresults written to {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
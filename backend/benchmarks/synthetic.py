@@ -0,0 +1,68 @@
+"""
+Synthetic galleries and attendance history for the benchmarks
+"""
+from datetime import date, timedelta
+import numpy as np
+from utils.encodings import ENCODING_DIM, encoding_to_blob
+
+
+def synthetic_gallery(n_students, n_clusters=64, seed=0):
+    """
+    Random 128-d encodings grouped around cluster centres, scaled like dlib encodings
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(0, 0.08, (n_clusters, ENCODING_DIM))
+    labels = rng.integers(0, n_clusters, n_students)
+    encodings = centres[labels] + rng.normal(0, 0.05, (n_students, ENCODING_DIM))
+    return encodings.astype(np.float32)
+
+
+def seed_students(c, n_students, seed=0):
+    """
+    Insert n_students with synthetic encodings; returns their ids
+    """
+    encodings = synthetic_gallery(n_students, seed=seed)
+    c.executemany(
+        'INSERT INTO students (name, roll_number, image_path, face_encoding) VALUES (?, ?, ?, ?)',
+        ((f'Synthetic {i}', f'SYN{seed}-{i:07d}', '', encoding_to_blob(encoding))
+         for i, encoding in enumerate(encodings))
+    )
+    c.execute('SELECT id FROM students WHERE roll_number LIKE ? ORDER BY id', (f'SYN{seed}-%',))
+    return [row[0] for row in c.fetchall()]
+
+
+def seed_subjects(c, n_subjects):
+    c.executemany(
+        'INSERT INTO subjects (code, name, faculty, description) VALUES (?, ?, ?, ?)',
+        ((f'BENCH{i:03d}', f'Benchmark subject {i}', 'Synthetic', None) for i in range(n_subjects))
+    )
+    c.execute("SELECT id FROM subjects WHERE code LIKE 'BENCH%' ORDER BY id")
+    return [row[0] for row in c.fetchall()]
+
+
+def seed_attendance(c, student_ids, subject_ids, n_days, rate=0.8, seed=0, start=date(2024, 1, 1)):
+    """
+    Every student enrolled in every subject, one class per subject per
+    weekday, each attended with probability rate. Returns the rows inserted.
+    """
+    rng = np.random.default_rng(seed)
+    c.executemany(
+        'INSERT OR IGNORE INTO enrollments (student_id, subject_id) VALUES (?, ?)',
+        ((student_id, subject_id) for subject_id in subject_ids for student_id in student_ids)
+    )
+
+    inserted = 0
+    day = start
+    held = 0
+    while held < n_days:
+        if day.weekday() < 5:
+            held += 1
+            for subject_id in subject_ids:
+                present = np.asarray(student_ids)[rng.random(len(student_ids)) < rate]
+                c.executemany(
+                    'INSERT INTO attendance (student_id, subject_id, date, time, status) VALUES (?, ?, ?, ?, ?)',
+                    ((int(student_id), subject_id, day.isoformat(), '09:00:00', 'present') for student_id in present)
+                )
+                inserted += len(present)
+        day += timedelta(days=1)
+    return inserted
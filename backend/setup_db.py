@@ -1,43 +1,18 @@
-import sqlite3
 import os
+from utils.migrations import SCHEMA_VERSION, migrate
 
 # Create directories if they don't exist
 os.makedirs('database', exist_ok=True)
 os.makedirs('uploads', exist_ok=True)
 
-# Initialize database
+# Initialize the database, or upgrade an existing one in place
 def init_db():
-    conn = sqlite3.connect('database/attendance.db')
-    c = conn.cursor()
+    applied = migrate()
     
-    # Students table
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS students (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        roll_number TEXT UNIQUE NOT NULL,
-        image_path TEXT,
-        face_encoding TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    # Attendance table
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS attendance (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        student_id INTEGER,
-        date TEXT,
-        time TEXT,
-        status TEXT,
-        FOREIGN KEY (student_id) REFERENCES students (id)
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    
-    print("Database initialized successfully!")
+    if applied:
+        print(f"Database initialized successfully (schema version {SCHEMA_VERSION})!")
+    else:
+        print(f"Database is already up to date (schema version {SCHEMA_VERSION})")
 
 if __name__ == "__main__":
-    init_db() 
\ No newline at end of file
+    init_db() 
@@ -0,0 +1,206 @@
+import json
+import sqlite3
+import numpy as np
+import pytest
+from utils.encodings import ENCODING_DIM, blob_to_encoding
+from utils.migrations import LEGACY_SUBJECT_CODE, SCHEMA_VERSION, migrate, schema_version
+
+ENCODING = [i / ENCODING_DIM for i in range(ENCODING_DIM)]
+
+
+def create_setup_db_schema(c):
+    # Schema created by the original setup_db.py: no subjects, nullable encodings as JSON text
+    c.execute('''
+        CREATE TABLE students (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            roll_number TEXT UNIQUE NOT NULL,
+            image_path TEXT,
+            face_encoding TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE attendance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER,
+            date TEXT,
+            time TEXT,
+            status TEXT,
+            FOREIGN KEY (student_id) REFERENCES students (id)
+        )
+    ''')
+
+
+def create_init_db_schema(c):
+    # Schema created by the original app.py init_db: subjects, and attendance with a subject
+    c.execute('''
+        CREATE TABLE students (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            roll_number TEXT UNIQUE NOT NULL,
+            image_path TEXT NOT NULL,
+            face_encoding TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE subjects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT UNIQUE NOT NULL,
+            name TEXT NOT NULL,
+            faculty TEXT NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE attendance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL,
+            subject_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            status TEXT NOT NULL,
+            FOREIGN KEY (student_id) REFERENCES students (id),
+            FOREIGN KEY (subject_id) REFERENCES subjects (id)
+        )
+    ''')
+
+
+@pytest.fixture
+def setup_db_database(tmp_path):
+    db_path = str(tmp_path / 'attendance.db')
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    create_setup_db_schema(c)
+    c.executemany(
+        'INSERT INTO students (name, roll_number, image_path, face_encoding) VALUES (?, ?, ?, ?)',
+        [('Ann', '1', 'uploads/1.jpg', json.dumps(ENCODING)),
+         ('Ben', '2', 'uploads/2.jpg', json.dumps(ENCODING)),
+         ('Cid', '3', None, None)]
+    )
+    c.executemany(
+        'INSERT INTO attendance (student_id, date, time, status) VALUES (?, ?, ?, ?)',
+        [(1, '2024-01-01', '09:00:00', 'present'),
+         # Same student and day twice: only the first is kept
+         (1, '2024-01-01', '09:05:00', 'present'),
+         (2, '2024-01-01', '09:01:00', 'present'),
+         (2, '2024-01-02', None, None),
+         # Cannot satisfy the new NOT NULL constraints
+         (None, '2024-01-02', '09:00:00', 'present'),
+         (1, None, '09:00:00', 'present')]
+    )
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+@pytest.fixture
+def init_db_database(tmp_path):
+    db_path = str(tmp_path / 'attendance.db')
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    create_init_db_schema(c)
+    c.execute("INSERT INTO subjects (code, name, faculty) VALUES ('CS101', 'Programming', 'Dr. X')")
+    c.executemany(
+        'INSERT INTO students (name, roll_number, image_path, face_encoding) VALUES (?, ?, ?, ?)',
+        [('Ann', '1', 'uploads/1.jpg', json.dumps(ENCODING)),
+         ('Ben', '2', 'uploads/2.jpg', json.dumps(ENCODING))]
+    )
+    c.executemany(
+        'INSERT INTO attendance (student_id, subject_id, date, time, status) VALUES (?, ?, ?, ?, ?)',
+        [(1, 1, '2024-01-01', '09:00:00', 'present'),
+         (1, 1, '2024-01-01', '09:30:00', 'present'),
+         (2, 1, '2024-01-01', '09:01:00', 'present')]
+    )
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def query(db_path, sql, params=()):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def table_contents(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )]
+        return {table: conn.execute(f'SELECT * FROM {table} ORDER BY 1').fetchall() for table in tables}
+    finally:
+        conn.close()
+
+
+def test_setup_db_schema_is_migrated(setup_db_database):
+    applied = migrate(setup_db_database)
+
+    assert applied == list(range(1, SCHEMA_VERSION + 1))
+    conn = sqlite3.connect(setup_db_database)
+    try:
+        assert schema_version(conn) == SCHEMA_VERSION
+    finally:
+        conn.close()
+
+    # Old attendance belongs to the placeholder subject
+    legacy = query(setup_db_database, 'SELECT id FROM subjects WHERE code = ?', (LEGACY_SUBJECT_CODE,))
+    assert len(legacy) == 1
+    legacy_id = legacy[0][0]
+    rows = query(setup_db_database, 'SELECT id, student_id, subject_id, date, time, status FROM attendance ORDER BY id')
+    assert rows == [
+        (1, 1, legacy_id, '2024-01-01', '09:00:00', 'present'),
+        (3, 2, legacy_id, '2024-01-01', '09:01:00', 'present'),
+        (4, 2, legacy_id, '2024-01-02', '', 'present'),
+    ]
+    assert query(setup_db_database, 'SELECT student_id, attended FROM attendance_totals ORDER BY 1') == [(1, 1), (2, 2)]
+    assert query(setup_db_database, 'SELECT classes_held FROM subject_totals') == [(2,)]
+
+    # JSON encodings become float32 blobs; students without one are kept as they are
+    students = query(setup_db_database, 'SELECT id, face_encoding FROM students ORDER BY id')
+    assert len(students) == 3
+    for _, stored_encoding in students[:2]:
+        assert isinstance(stored_encoding, bytes)
+        np.testing.assert_allclose(blob_to_encoding(stored_encoding), ENCODING, rtol=1e-6)
+    assert students[2][1] is None
+
+
+def test_init_db_schema_is_migrated(init_db_database):
+    migrate(init_db_database)
+
+    # Attendance that already had a subject keeps it, minus the duplicate
+    assert query(init_db_database, 'SELECT id, student_id, subject_id FROM attendance ORDER BY id') == [
+        (1, 1, 1), (3, 2, 1)
+    ]
+    assert query(init_db_database, 'SELECT code FROM subjects') == [('CS101',)]
+    with pytest.raises(sqlite3.IntegrityError):
+        query(init_db_database,
+              "INSERT INTO attendance (student_id, subject_id, date, time, status) "
+              "VALUES (1, 1, '2024-01-01', '10:00:00', 'present')")
+
+
+def test_migrate_is_idempotent(setup_db_database):
+    migrate(setup_db_database)
+    before = table_contents(setup_db_database)
+
+    assert migrate(setup_db_database) == []
+    assert table_contents(setup_db_database) == before
+
+
+@pytest.mark.parametrize('interrupted_at', [2, 4])
+def test_interrupted_migration_is_rerun(setup_db_database, interrupted_at):
+    # Migrations must be safe to re-run when a crash happened before user_version was saved
+    migrate(setup_db_database)
+    before = table_contents(setup_db_database)
+    conn = sqlite3.connect(setup_db_database)
+    conn.execute(f'PRAGMA user_version = {interrupted_at - 1}')
+    conn.commit()
+    conn.close()
+
+    assert migrate(setup_db_database) == list(range(interrupted_at, SCHEMA_VERSION + 1))
+    assert table_contents(setup_db_database) == before
@@ -0,0 +1,179 @@
+import numpy as np
+from utils.encodings import ENCODING_DIM
+
+
+def _sq_distances(probes, vectors):
+    # Squared Euclidean distances between (M x D) probes and (N x D) vectors
+    sq = (np.einsum('ij,ij->i', vectors, vectors)[None, :]
+          - 2.0 * (probes @ vectors.T)
+          + np.einsum('ij,ij->i', probes, probes)[:, None])
+    return np.maximum(sq, 0.0)
+
+
+def kmeans(vectors, n_clusters, n_iter=15, seed=0):
+    """
+    Plain Lloyd's k-means in NumPy, returning (n_clusters x D) float32 centroids
+    """
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = np.argmin(_sq_distances(vectors, centroids), axis=1)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty clusters from random points
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+    return centroids
+
+
+class _InvertedList:
+    """
+    Growable vector/id storage for one IVF cluster
+    """
+
+    def __init__(self):
+        self.vectors = np.zeros((0, ENCODING_DIM), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.size = 0
+
+    def extend(self, ids, vectors):
+        needed = self.size + len(ids)
+        if needed > len(self.ids):
+            capacity = max(8, needed, 2 * len(self.ids))
+            grown_vectors = np.zeros((capacity, ENCODING_DIM), dtype=np.float32)
+            grown_ids = np.zeros(capacity, dtype=np.int64)
+            grown_vectors[:self.size] = self.vectors[:self.size]
+            grown_ids[:self.size] = self.ids[:self.size]
+            self.vectors, self.ids = grown_vectors, grown_ids
+        self.vectors[self.size:needed] = vectors
+        self.ids[self.size:needed] = ids
+        self.size = needed
+
+    def remove(self, student_id):
+        rows = np.flatnonzero(self.ids[:self.size] == student_id)
+        if not len(rows):
+            return False
+        row, last = rows[0], self.size - 1
+        self.vectors[row] = self.vectors[last]
+        self.ids[row] = self.ids[last]
+        self.size = last
+        return True
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbour index over face encodings.
+
+    Encodings are partitioned by a k-means coarse quantizer; a query scans
+    only the n_probe clusters whose centroids are nearest to it. Raising
+    n_probe trades latency for recall, and n_probe == n_lists is exact.
+    Inserts and deletes are incremental; centroids are kept until rebuilt.
+    """
+
+    def __init__(self, n_lists=0, n_probe=8, seed=0):
+        self.requested_lists = n_lists
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.seed = seed
+        self.centroids = None
+        self.trained_size = 0
+        self._lists = []
+        self._where = {}
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def __len__(self):
+        return len(self._where)
+
+    def train(self, encodings):
+        """
+        Fit the coarse quantizer on (a sample of) the encodings
+        """
+        encodings = np.asarray(encodings, dtype=np.float32)
+        n_lists = self.requested_lists or max(1, int(np.sqrt(len(encodings))))
+        n_lists = min(n_lists, len(encodings))
+        # k-means only needs a few hundred points per cluster to converge
+        sample_size = min(len(encodings), 256 * n_lists)
+        rng = np.random.default_rng(self.seed)
+        sample = encodings[rng.choice(len(encodings), sample_size, replace=False)]
+        self.centroids = kmeans(sample, n_lists, seed=self.seed)
+        self.n_lists = n_lists
+        self.trained_size = len(encodings)
+
+    def build(self, ids, encodings, retrain=False):
+        """
+        (Re)populate the index from scratch, training first if needed.
+
+        The quantizer is also retrained once the data has grown well past
+        the size it was trained on.
+        """
+        encodings = np.asarray(encodings, dtype=np.float32)
+        if retrain or not self.is_trained or len(encodings) > 4 * self.trained_size:
+            if not len(encodings):
+                self.centroids = None
+                self._lists, self._where = [], {}
+                return
+            self.train(encodings)
+        self._lists = [_InvertedList() for _ in range(self.n_lists)]
+        self._where = {}
+        self._insert(np.asarray(ids, dtype=np.int64), encodings)
+
+    def _insert(self, ids, encodings):
+        if not len(ids):
+            return
+        labels = np.argmin(_sq_distances(encodings, self.centroids), axis=1)
+        order = np.argsort(labels, kind='stable')
+        labels, ids, encodings = labels[order], ids[order], encodings[order]
+        bounds = np.flatnonzero(np.diff(labels)) + 1
+        for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(labels)]):
+            list_no = int(labels[start])
+            self._lists[list_no].extend(ids[start:end], encodings[start:end])
+            for student_id in ids[start:end]:
+                self._where[int(student_id)] = list_no
+
+    def add(self, student_id, encoding):
+        """
+        Insert (or replace) one encoding without retraining
+        """
+        if not self.is_trained:
+            return False
+        self.remove(student_id)
+        self._insert(np.array([student_id], dtype=np.int64),
+                     np.asarray(encoding, dtype=np.float32).reshape(1, -1))
+        return True
+
+    def remove(self, student_id):
+        list_no = self._where.pop(int(student_id), None)
+        if list_no is None:
+            return False
+        return self._lists[list_no].remove(student_id)
+
+    def search(self, probe, k=1, n_probe=None):
+        """
+        Return up to k (student_id, distance) pairs, nearest first
+        """
+        if not self.is_trained or not self._where:
+            return []
+        probe = np.asarray(probe, dtype=np.float32).reshape(1, -1)
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        centroid_dist = _sq_distances(probe, self.centroids)[0]
+        probed = np.argpartition(centroid_dist, n_probe - 1)[:n_probe]
+
+        lists = [self._lists[i] for i in probed if self._lists[i].size]
+        if not lists:
+            return []
+        vectors = np.concatenate([lst.vectors[:lst.size] for lst in lists])
+        ids = np.concatenate([lst.ids[:lst.size] for lst in lists])
+        distances = np.sqrt(_sq_distances(probe, vectors)[0])
+
+        k = min(k, len(ids))
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest])]
+        return [(int(ids[i]), float(distances[i])) for i in nearest]
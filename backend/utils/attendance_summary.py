@@ -0,0 +1,132 @@
+"""
+Materialized attendance aggregates behind /api/attendance/statistics.
+
+attendance_totals holds the classes each student attended per subject,
+class_sessions the number of students present per subject and date, and
+subject_totals the number of distinct class dates held per subject. They
+are kept up to date in the same transaction as every attendance change.
+
+Rebuild them from the attendance table, from the backend directory, with:
+    python -m utils.attendance_summary
+"""
+from utils.db import connect
+
+
+def create_tables(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_totals (
+            student_id INTEGER NOT NULL,
+            subject_id INTEGER NOT NULL,
+            attended INTEGER NOT NULL,
+            PRIMARY KEY (student_id, subject_id)
+        ) WITHOUT ROWID
+    ''')
+
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS class_sessions (
+            subject_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            present INTEGER NOT NULL,
+            PRIMARY KEY (subject_id, date)
+        ) WITHOUT ROWID
+    ''')
+
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS subject_totals (
+            subject_id INTEGER PRIMARY KEY,
+            classes_held INTEGER NOT NULL
+        )
+    ''')
+
+
+def record_present(c, student_id, subject_id, date):
+    """
+    Count one newly inserted attendance record
+    """
+    c.execute('''
+        INSERT INTO attendance_totals (student_id, subject_id, attended) VALUES (?, ?, 1)
+        ON CONFLICT (student_id, subject_id) DO UPDATE SET attended = attended + 1
+    ''', (student_id, subject_id))
+
+    c.execute('''
+        INSERT INTO class_sessions (subject_id, date, present) VALUES (?, ?, 1)
+        ON CONFLICT (subject_id, date) DO UPDATE SET present = present + 1
+    ''', (subject_id, date))
+    c.execute('SELECT present FROM class_sessions WHERE subject_id = ? AND date = ?', (subject_id, date))
+    if c.fetchone()[0] == 1:
+        # First record for this subject on this date: a new class was held
+        c.execute('''
+            INSERT INTO subject_totals (subject_id, classes_held) VALUES (?, 1)
+            ON CONFLICT (subject_id) DO UPDATE SET classes_held = classes_held + 1
+        ''', (subject_id,))
+
+
+def remove_student(c, student_id):
+    """
+    Uncount a student's attendance; call before deleting their attendance rows
+    """
+    c.execute('''
+        UPDATE class_sessions SET present = present - 1
+        WHERE (subject_id, date) IN (SELECT subject_id, date FROM attendance WHERE student_id = ?)
+    ''', (student_id,))
+
+    # Dates nobody else attended no longer count as held classes
+    c.execute('''
+        UPDATE subject_totals SET classes_held = classes_held - (
+            SELECT COUNT(*) FROM class_sessions
+            WHERE class_sessions.subject_id = subject_totals.subject_id AND present <= 0
+        )
+        WHERE subject_id IN (SELECT subject_id FROM class_sessions WHERE present <= 0)
+    ''')
+    c.execute('DELETE FROM class_sessions WHERE present <= 0')
+    c.execute('DELETE FROM attendance_totals WHERE student_id = ?', (student_id,))
+
+
+def remove_subject(c, subject_id):
+    """
+    Drop all aggregates for a deleted subject
+    """
+    c.execute('DELETE FROM attendance_totals WHERE subject_id = ?', (subject_id,))
+    c.execute('DELETE FROM class_sessions WHERE subject_id = ?', (subject_id,))
+    c.execute('DELETE FROM subject_totals WHERE subject_id = ?', (subject_id,))
+
+
+def rebuild(conn):
+    """
+    Recompute every aggregate from the attendance table in one transaction
+    """
+    c = conn.cursor()
+    create_tables(c)
+    c.execute('DELETE FROM attendance_totals')
+    c.execute('DELETE FROM class_sessions')
+    c.execute('DELETE FROM subject_totals')
+
+    c.execute('''
+        INSERT INTO attendance_totals (student_id, subject_id, attended)
+        SELECT student_id, subject_id, COUNT(*) FROM attendance GROUP BY student_id, subject_id
+    ''')
+    c.execute('''
+        INSERT INTO class_sessions (subject_id, date, present)
+        SELECT subject_id, date, COUNT(*) FROM attendance GROUP BY subject_id, date
+    ''')
+    c.execute('''
+        INSERT INTO subject_totals (subject_id, classes_held)
+        SELECT subject_id, COUNT(*) FROM class_sessions GROUP BY subject_id
+    ''')
+    conn.commit()
+
+
+def main():
+    conn = connect()
+    try:
+        rebuild(conn)
+        counts = [conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                  for table in ('attendance_totals', 'class_sessions', 'subject_totals')]
+    finally:
+        conn.close()
+    print(f"Rebuilt attendance summary: {counts[0]} student/subject totals, "
+          f"{counts[1]} class sessions, {counts[2]} subject totals")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""
+Write-behind queue for attendance records.
+
+Marking a student present used to cost one transaction (and one commit)
+per request. Requests now hand their records to the process's writer,
+which answers at once and commits everything queued in one transaction
+every ATTENDANCE_FLUSH_MS milliseconds, or as soon as ATTENDANCE_BATCH_SIZE
+records are waiting. With ATTENDANCE_DURABLE the caller instead waits
+until its records are committed (still grouped with concurrent requests),
+and commits are synced to disk with synchronous=FULL.
+
+A batch that fails because the database is locked is retried; any other
+failure is logged and the batch dropped, so one bad batch cannot stall the
+queue. Callers waiting for the writer give up with WriteTimeout after
+ATTENDANCE_WAIT_TIMEOUT seconds.
+
+Records are deduplicated by (student, subject, date) before they are
+queued: against what this writer already accepted today and against the
+attendance table, so a response can tell a new record from a repeat
+without waiting for the write. The table's unique index still settles
+races with other processes.
+
+Pending records are flushed when the process exits; code that deletes
+attendance must call flush() first so a queued record cannot reappear.
+"""
+import atexit
+import threading
+import time
+from collections import deque
+from utils import attendance_summary, metrics
+from utils.config import (
+    ATTENDANCE_BATCH_SIZE, ATTENDANCE_DURABLE, ATTENDANCE_FLUSH_MS, ATTENDANCE_WAIT_TIMEOUT, DATABASE_PATH
+)
+from utils.db import get_connection, is_busy_error, release_connection, retry_on_busy, transaction
+
+# Seconds before a batch that found the database locked is retried
+RETRY_DELAY = 1.0
+
+
+class WriteTimeout(Exception):
+    """
+    Raised when queued records are not written within the wait timeout
+    """
+
+
+def insert_attendance(c, records):
+    """
+    Insert (student_id, subject_id, date, time) present records in the
+    caller's transaction; returns the number actually inserted
+    """
+    # The unique (student_id, subject_id, date) index turns repeats into no-ops
+    inserted = 0
+    for student_id, subject_id, date, time_of_day in records:
+        c.execute('''
+            INSERT INTO attendance (student_id, subject_id, date, time, status)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (student_id, subject_id, date) DO NOTHING
+        ''', (student_id, subject_id, date, time_of_day, 'present'))
+        if c.rowcount:
+            attendance_summary.record_present(c, student_id, subject_id, date)
+            inserted += 1
+    return inserted
+
+
+class AttendanceWriter:
+    """
+    Batches attendance inserts from every request thread into one
+    background writer thread
+    """
+
+    def __init__(self, db_path=DATABASE_PATH, flush_ms=ATTENDANCE_FLUSH_MS,
+                 batch_size=ATTENDANCE_BATCH_SIZE, durable=ATTENDANCE_DURABLE,
+                 wait_timeout=ATTENDANCE_WAIT_TIMEOUT):
+        self.db_path = db_path
+        self.flush_interval = max(flush_ms, 0) / 1000
+        self.batch_size = max(batch_size, 1)
+        self.durable = durable
+        self.wait_timeout = wait_timeout
+        self._cond = threading.Condition()
+        self._queue = []
+        # (student_id, subject_id) accepted per date; only the two newest dates are kept
+        self._accepted = {}
+        # Records ever queued and ever written or dropped; a record is done once done passes its number
+        self._queued_total = 0
+        self._done_total = 0
+        # (first, last] record numbers of recently dropped batches
+        self._dropped = deque(maxlen=64)
+        self._flush_requested = False
+        self._thread = None
+        self._closed = False
+
+    @property
+    def pending(self):
+        return len(self._queue)
+
+    def _accepted_on(self, date):
+        # Caller holds the lock
+        accepted = self._accepted.get(date)
+        if accepted is None:
+            accepted = self._accepted[date] = set()
+            for old in sorted(self._accepted)[:-2]:
+                del self._accepted[old]
+        return accepted
+
+    def _in_database(self, subject_id, student_ids, date):
+        c = get_connection(self.db_path).cursor()
+        c.execute(
+            f'SELECT student_id FROM attendance WHERE subject_id = ? AND date = ? '
+            f'AND student_id IN ({",".join("?" * len(student_ids))})',
+            (subject_id, date, *student_ids)
+        )
+        return {row[0] for row in c.fetchall()}
+
+    def submit(self, subject_id, student_ids, date, time_of_day, durable=None):
+        """
+        Queue present records for the students not yet marked; returns the
+        newly marked ids. Waits for the commit if durable (default: the
+        ATTENDANCE_DURABLE setting), raising WriteTimeout if it takes too
+        long or RuntimeError if the records were dropped.
+        """
+        with self._cond:
+            accepted = self._accepted_on(date)
+            candidates = [s for s in dict.fromkeys(student_ids) if (s, subject_id) not in accepted]
+        if not candidates:
+            return set()
+        existing = self._in_database(subject_id, candidates, date)
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Attendance writer is closed')
+            accepted = self._accepted_on(date)
+            # Re-checked under the lock: a concurrent request may have queued the same student
+            new = [s for s in candidates if s not in existing and (s, subject_id) not in accepted]
+            accepted.update((s, subject_id) for s in candidates)
+            self._queue.extend((s, subject_id, date, time_of_day) for s in new)
+            self._queued_total += len(new)
+            target = self._queued_total
+            self._start()
+            self._cond.notify_all()
+
+        if new and (self.durable if durable is None else durable):
+            self._wait_committed(target)
+            with self._cond:
+                if any(first < target and target - len(new) < last for first, last in self._dropped):
+                    raise RuntimeError('Attendance records could not be saved')
+        return set(new)
+
+    def flush(self):
+        """
+        Wait until every record queued so far is written (or dropped);
+        raises WriteTimeout if that takes longer than the wait timeout
+        """
+        with self._cond:
+            target = self._queued_total
+            self._flush_requested = bool(self._queue)
+            self._cond.notify_all()
+        self._wait_committed(target)
+
+    def forget(self):
+        """
+        Drop the accepted-record memory, e.g. after attendance was deleted
+        """
+        with self._cond:
+            self._accepted.clear()
+
+    def close(self):
+        """
+        Flush pending records and stop the writer thread
+        """
+        with self._cond:
+            self._closed = True
+            thread = self._thread
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join()
+
+    def _wait_committed(self, target):
+        deadline = time.monotonic() + self.wait_timeout
+        with self._cond:
+            while self._done_total < target:
+                if self._thread is None or not self._thread.is_alive():
+                    raise RuntimeError('Attendance writer is not running')
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise WriteTimeout()
+                self._cond.wait(min(remaining, 1.0))
+
+    def _start(self):
+        # Caller holds the lock; started lazily so forked workers each get their own thread
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='attendance-writer', daemon=True)
+            self._thread.start()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            # The first record opens the batch; it is written when full, due, or on close/flush
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._queue) < self.batch_size and not (self._closed or self._flush_requested):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._queue[:self.batch_size]
+            del self._queue[:self.batch_size]
+            if not self._queue:
+                self._flush_requested = False
+            return batch
+
+    def _drop(self, batch):
+        # Caller holds the lock; batches are taken in queue order, so they are the next numbers
+        print(f"Dropped {len(batch)} unwritten attendance records")
+        first = self._done_total
+        self._done_total += len(batch)
+        self._dropped.append((first, self._done_total))
+        # Not written, so these students may be marked again
+        for student_id, subject_id, date, _ in batch:
+            self._accepted.get(date, set()).discard((student_id, subject_id))
+        self._cond.notify_all()
+
+    @retry_on_busy
+    def _write(self, batch):
+        start = time.perf_counter()
+        if self.durable:
+            # NORMAL (see utils.db.connect) survives app crashes but not power loss
+            get_connection(self.db_path).execute('PRAGMA synchronous=FULL')
+        with transaction(self.db_path) as c:
+            inserted = insert_attendance(c, batch)
+        metrics.attendance_write_seconds.observe(time.perf_counter() - start)
+        metrics.attendance_write_batch.observe(len(batch))
+        return inserted
+
+    def _run(self):
+        try:
+            while True:
+                batch = self._next_batch()
+                if not batch:
+                    return
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    print(f"Error writing {len(batch)} attendance records: {str(e)}")
+                    metrics.attendance_write_failures.inc()
+                    release_connection()
+                    with self._cond:
+                        if not is_busy_error(e):
+                            # Retrying cannot help; drop the batch instead of blocking everything behind it
+                            self._drop(batch)
+                            continue
+                        if self._closed:
+                            # Shutting down: report what is lost rather than retry forever
+                            print(f"Dropped {len(batch) + len(self._queue)} unwritten attendance records")
+                            self._cond.notify_all()
+                            return
+                        # Still locked after retry_on_busy's retries: keep the records and try again
+                        self._queue[:0] = batch
+                    time.sleep(RETRY_DELAY)
+                    continue
+                with self._cond:
+                    self._done_total += len(batch)
+                    self._cond.notify_all()
+        finally:
+            release_connection()
+
+
+# Per-process writer shared by all requests
+attendance_writer = AttendanceWriter()
+atexit.register(attendance_writer.close)
@@ -0,0 +1,143 @@
+import os
+
+# Settings, overridable through environment variables
+
+# SQLite database file and connection tuning
+DATABASE_PATH = os.environ.get('DATABASE_PATH', 'database/attendance.db')
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', '5000'))
+DB_BUSY_RETRIES = int(os.environ.get('DB_BUSY_RETRIES', '3'))
+DB_CACHE_SIZE_KB = int(os.environ.get('DB_CACHE_SIZE_KB', '20000'))
+DB_MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+
+# Maximum face distance accepted as a match
+MATCH_TOLERANCE = float(os.environ.get('MATCH_TOLERANCE', '0.6'))
+
+# Gallery matcher: 'exact' (vectorized brute force) or 'ivf' (approximate inverted-file index)
+FACE_MATCHER = os.environ.get('FACE_MATCHER', 'exact')
+
+# Students can have several face templates: matching scans one centroid per student, then
+# compares the probe with every template of the MATCH_TOP_K nearest students
+MATCH_TOP_K = int(os.environ.get('MATCH_TOP_K', '5'))
+
+# Auto-captured templates: a confident single-face match (distance below TEMPLATE_CAPTURE_DISTANCE,
+# but at least TEMPLATE_MIN_SPREAD from the student's nearest template, so near-duplicates are
+# skipped) is stored as an extra template, keeping the newest TEMPLATE_MAX_PROBES per student
+TEMPLATE_AUTO_CAPTURE = os.environ.get('TEMPLATE_AUTO_CAPTURE', '0') == '1'
+TEMPLATE_CAPTURE_DISTANCE = float(os.environ.get('TEMPLATE_CAPTURE_DISTANCE', '0.4'))
+TEMPLATE_MIN_SPREAD = float(os.environ.get('TEMPLATE_MIN_SPREAD', '0.15'))
+TEMPLATE_MAX_PROBES = int(os.environ.get('TEMPLATE_MAX_PROBES', '3'))
+# Captured probes are stored at once but published to the shared gallery together, at most every
+# TEMPLATE_PUBLISH_INTERVAL seconds (0 publishes each one immediately)
+TEMPLATE_PUBLISH_INTERVAL = float(os.environ.get('TEMPLATE_PUBLISH_INTERVAL', '30'))
+
+# IVF index: number of coarse clusters (0 = about sqrt(N)) and clusters scanned per probe
+IVF_N_LISTS = int(os.environ.get('IVF_N_LISTS', '0'))
+IVF_N_PROBE = int(os.environ.get('IVF_N_PROBE', '8'))
+
+# Galleries smaller than this are always searched exactly
+IVF_MIN_GALLERY = int(os.environ.get('IVF_MIN_GALLERY', '5000'))
+
+# Re-check with exact search when the approximate result is not a match
+IVF_EXACT_FALLBACK = os.environ.get('IVF_EXACT_FALLBACK', '1') == '1'
+
+# Search the whole gallery when a probe matches nobody on the subject's roster
+ROSTER_GLOBAL_FALLBACK = os.environ.get('ROSTER_GLOBAL_FALLBACK', '0') == '1'
+
+# Face detection runs at full resolution by default. With DETECT_SCALE below 1 it runs on a
+# downscaled copy instead, which is faster but misses faces that become too small to detect
+# (e.g. the back rows of a classroom photo at 0.5); boxes are mapped back to full resolution
+# and (optionally) refined on a full-resolution crop
+DETECT_SCALE = float(os.environ.get('DETECT_SCALE', '1'))
+DETECT_UPSAMPLE = int(os.environ.get('DETECT_UPSAMPLE', '1'))
+DETECT_MODEL = os.environ.get('DETECT_MODEL', 'hog')
+DETECT_REFINE = os.environ.get('DETECT_REFINE', '1') == '1'
+
+# Number of re-samples when computing each face encoding (higher is slower but more stable)
+NUM_JITTERS = int(os.environ.get('NUM_JITTERS', '1'))
+
+# Landmark model used to align faces before encoding: 'small' (5 points) or 'large' (68 points)
+ENCODING_MODEL = os.environ.get('ENCODING_MODEL', 'small')
+
+# Image ingestion: multipart uploads up to UPLOAD_MEMORY_BYTES stay in memory rather than in a
+# temporary file. JPEGs are decoded at 1/2, 1/4 or 1/8 size as long as the longer side stays at
+# least DECODE_MIN_SIDE pixels (0 always decodes at full size; changing it changes encoder_version)
+UPLOAD_MEMORY_BYTES = int(os.environ.get('UPLOAD_MEMORY_BYTES', str(16 * 1024 * 1024)))
+DECODE_MIN_SIDE = int(os.environ.get('DECODE_MIN_SIDE', '0'))
+
+# On-disk cache of detected faces and encodings, keyed by image content (empty path disables it)
+ENCODING_CACHE_PATH = os.environ.get('ENCODING_CACHE_PATH', 'database/encoding_cache.db')
+ENCODING_CACHE_SIZE = int(os.environ.get('ENCODING_CACHE_SIZE', '50000'))
+
+# Face quality gate for attendance: faces that are too small (pixels), blurry (variance of
+# the Laplacian), too dark/bright (mean gray level), low contrast (gray level std dev) or,
+# with FACE_POSE_CHECK, turned away (yaw as a fraction of eye distance, roll in degrees)
+# are rejected before they are encoded
+QUALITY_GATE = os.environ.get('QUALITY_GATE', '1') == '1'
+FACE_MIN_SIZE = int(os.environ.get('FACE_MIN_SIZE', '40'))
+FACE_MIN_SHARPNESS = float(os.environ.get('FACE_MIN_SHARPNESS', '25'))
+FACE_MIN_BRIGHTNESS = float(os.environ.get('FACE_MIN_BRIGHTNESS', '40'))
+FACE_MAX_BRIGHTNESS = float(os.environ.get('FACE_MAX_BRIGHTNESS', '215'))
+FACE_MIN_CONTRAST = float(os.environ.get('FACE_MIN_CONTRAST', '20'))
+FACE_POSE_CHECK = os.environ.get('FACE_POSE_CHECK', '0') == '1'
+FACE_MAX_YAW = float(os.environ.get('FACE_MAX_YAW', '0.35'))
+FACE_MAX_ROLL = float(os.environ.get('FACE_MAX_ROLL', '25'))
+
+# Recent-recognition cache per subject and date: matched probes (reused for a new probe within
+# RECOGNITION_CACHE_DISTANCE of one) and students already marked present expire after
+# RECOGNITION_CACHE_TTL seconds (0 disables the cache); beyond RECOGNITION_CACHE_SIZE probes per
+# subject and RECOGNITION_CACHE_SUBJECTS subject/date pairs the least recently used are dropped
+RECOGNITION_CACHE_TTL = float(os.environ.get('RECOGNITION_CACHE_TTL', '30'))
+RECOGNITION_CACHE_DISTANCE = float(os.environ.get('RECOGNITION_CACHE_DISTANCE', '0.25'))
+RECOGNITION_CACHE_SIZE = int(os.environ.get('RECOGNITION_CACHE_SIZE', '256'))
+RECOGNITION_CACHE_SUBJECTS = int(os.environ.get('RECOGNITION_CACHE_SUBJECTS', '64'))
+
+# Write-behind attendance: records are committed by a background thread in batches, every
+# ATTENDANCE_FLUSH_MS milliseconds or ATTENDANCE_BATCH_SIZE records; with ATTENDANCE_DURABLE,
+# requests wait until their records are committed (with synchronous=FULL) instead of returning once
+# they are queued. Requests that wait for the writer get a 503 after ATTENDANCE_WAIT_TIMEOUT seconds
+ATTENDANCE_FLUSH_MS = float(os.environ.get('ATTENDANCE_FLUSH_MS', '50'))
+ATTENDANCE_BATCH_SIZE = int(os.environ.get('ATTENDANCE_BATCH_SIZE', '500'))
+ATTENDANCE_DURABLE = os.environ.get('ATTENDANCE_DURABLE', '0') == '1'
+ATTENDANCE_WAIT_TIMEOUT = float(os.environ.get('ATTENDANCE_WAIT_TIMEOUT', '10'))
+
+# Recognition process pool: worker count (0 runs recognition inline in the request thread)
+# and how many requests may be queued or running before new ones get a 503
+RECOGNITION_WORKERS = int(os.environ.get('RECOGNITION_WORKERS', str(os.cpu_count() or 1)))
+RECOGNITION_QUEUE_SIZE = int(os.environ.get('RECOGNITION_QUEUE_SIZE', str(2 * max(RECOGNITION_WORKERS, 1))))
+RECOGNITION_RETRY_AFTER = int(os.environ.get('RECOGNITION_RETRY_AFTER', '2'))
+
+# ASGI entry point (asgi.py): threads for database work and for the routes passed to the Flask
+# app, and the largest attendance upload read into memory
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', '32'))
+# Streaming routes (frame uploads and event feeds) hold a thread for as long as the client stays
+# connected, so they get their own threads; beyond ASGI_STREAM_THREADS open streams, new ones get a 503
+ASGI_STREAM_THREADS = int(os.environ.get('ASGI_STREAM_THREADS', '16'))
+ASGI_MAX_BODY_BYTES = int(os.environ.get('ASGI_MAX_BODY_BYTES', str(16 * 1024 * 1024)))
+
+# Streaming sessions: frames whose 64x48 grayscale thumbnail differs from the previous
+# frame by less than this mean absolute difference are skipped as near-duplicates
+STREAM_DUPLICATE_THRESHOLD = float(os.environ.get('STREAM_DUPLICATE_THRESHOLD', '2.0'))
+# Minimum box overlap (IoU) for a face to continue an existing track without re-encoding
+STREAM_TRACK_IOU = float(os.environ.get('STREAM_TRACK_IOU', '0.5'))
+# Frames a track survives without being seen, and frames before an unknown face is retried
+STREAM_TRACK_MAX_AGE = int(os.environ.get('STREAM_TRACK_MAX_AGE', '15'))
+STREAM_UNKNOWN_RETRY = int(os.environ.get('STREAM_UNKNOWN_RETRY', '5'))
+# Frames before an identified face is encoded and matched again, so someone stepping into
+# another person's box does not keep their identity
+STREAM_REVERIFY_FRAMES = int(os.environ.get('STREAM_REVERIFY_FRAMES', '10'))
+# Seconds of inactivity after which a streaming session is discarded
+STREAM_SESSION_TIMEOUT = float(os.environ.get('STREAM_SESSION_TIMEOUT', '600'))
+
+# Bulk enrollment: encoding processes and rows inserted per transaction
+BULK_ENROLL_WORKERS = int(os.environ.get('BULK_ENROLL_WORKERS', str(os.cpu_count() or 1)))
+BULK_ENROLL_BATCH_SIZE = int(os.environ.get('BULK_ENROLL_BATCH_SIZE', '200'))
+# Server-side directories a bulk enrollment may read from must be inside this directory;
+# empty (the default) disables enrolling from server-side directories
+BULK_ENROLL_ROOT = os.environ.get('BULK_ENROLL_ROOT', '')
+
+# Paginated listings: largest page a client may request, and rows fetched per batch when streaming
+PAGE_SIZE_MAX = int(os.environ.get('PAGE_SIZE_MAX', '1000'))
+EXPORT_FETCH_SIZE = int(os.environ.get('EXPORT_FETCH_SIZE', '500'))
+
+# Add a Server-Timing header with the per-stage breakdown to recognition responses
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') == '1'
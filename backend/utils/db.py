@@ -0,0 +1,107 @@
+import functools
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from utils.config import DATABASE_PATH, DB_BUSY_RETRIES, DB_BUSY_TIMEOUT_MS, DB_CACHE_SIZE_KB, DB_MMAP_SIZE
+from utils.metrics import db_busy_retries, db_transaction_seconds
+
+_local = threading.local()
+
+
+def connect(db_path=DATABASE_PATH):
+    """
+    Open a new connection with WAL journaling and the tuned pragmas applied.
+
+    WAL lets report readers run while attendance is being written, and
+    synchronous=NORMAL is durable across application crashes in WAL mode.
+    Identical SQL strings reuse their prepared statement from the
+    connection's statement cache.
+    """
+    conn = sqlite3.connect(db_path, timeout=DB_BUSY_TIMEOUT_MS / 1000, cached_statements=256)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+    conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+
+def get_connection(db_path=DATABASE_PATH):
+    """
+    Return this thread's pooled connection, opening it on first use.
+
+    Connections are never shared between threads or across a fork; callers
+    must not close them, and should call release_connection when done.
+    """
+    connections = getattr(_local, 'connections', None)
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = connections[db_path] = connect(db_path)
+    return conn
+
+
+def release_connection(db_path=DATABASE_PATH):
+    """
+    Roll back anything left uncommitted on this thread's connection so it can be reused
+    """
+    conn = getattr(_local, 'connections', {}).get(db_path)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+
+def close_connection(db_path=DATABASE_PATH):
+    """
+    Close and forget this thread's connection (e.g. before replacing the database file)
+    """
+    conn = getattr(_local, 'connections', {}).pop(db_path, None)
+    if conn is not None:
+        conn.close()
+
+
+@contextmanager
+def transaction(db_path=DATABASE_PATH):
+    """
+    Cursor on the pooled connection, committed on success and rolled back on error
+    """
+    conn = get_connection(db_path)
+    start = time.perf_counter()
+    try:
+        yield conn.cursor()
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        db_transaction_seconds.observe(time.perf_counter() - start)
+
+
+def is_busy_error(error):
+    return isinstance(error, sqlite3.OperationalError) and (
+        'locked' in str(error) or 'busy' in str(error)
+    )
+
+
+def retry_on_busy(fn):
+    """
+    Retry a database operation with exponential backoff when SQLite reports it is busy.
+
+    The wrapped function must be safe to re-run, i.e. do all its writes in one transaction.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        for attempt in range(DB_BUSY_RETRIES + 1):
+            try:
+                return fn(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if not is_busy_error(e) or attempt == DB_BUSY_RETRIES:
+                    raise
+                db_busy_retries.inc()
+                time.sleep(0.05 * 2 ** attempt)
+    return wrapper
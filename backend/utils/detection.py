@@ -0,0 +1,111 @@
+import time
+import cv2
+import face_recognition
+from utils.config import (
+    DECODE_MIN_SIDE, DETECT_MODEL, DETECT_REFINE, DETECT_SCALE, DETECT_UPSAMPLE, ENCODING_MODEL, NUM_JITTERS
+)
+
+
+def encoder_version():
+    """
+    Identifier of the detection and encoding settings that produced an encoding.
+
+    Encodings made under different versions are not guaranteed to be
+    comparable; utils.reencode recomputes stored ones for the current version.
+    """
+    version = (f'{DETECT_MODEL}-up{DETECT_UPSAMPLE}-scale{DETECT_SCALE:g}-refine{int(DETECT_REFINE)}'
+               f'-jitter{NUM_JITTERS}-{ENCODING_MODEL}')
+    # Reduced JPEG decoding changes the pixels large photos are encoded from
+    return f'{version}-decode{DECODE_MIN_SIDE}' if DECODE_MIN_SIDE > 0 else version
+
+
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def _refine_location(rgb_img, location, model, margin=0.25):
+    # Re-detect inside a padded full-resolution crop around a coarse box
+    top, right, bottom, left = location
+    height, width = rgb_img.shape[:2]
+    pad_y, pad_x = int((bottom - top) * margin), int((right - left) * margin)
+    y0, y1 = max(0, top - pad_y), min(height, bottom + pad_y)
+    x0, x1 = max(0, left - pad_x), min(width, right + pad_x)
+    refined = face_recognition.face_locations(rgb_img[y0:y1, x0:x1], number_of_times_to_upsample=0, model=model)
+    if len(refined) != 1:
+        return location
+    r_top, r_right, r_bottom, r_left = refined[0]
+    return (r_top + y0, r_right + x0, r_bottom + y0, r_left + x0)
+
+
+def detect_faces(rgb_img, scale=DETECT_SCALE, upsample=DETECT_UPSAMPLE, model=DETECT_MODEL, refine=DETECT_REFINE):
+    """
+    Detect faces on a downscaled copy and return full-resolution (top, right, bottom, left) boxes
+    """
+    height, width = rgb_img.shape[:2]
+    if scale >= 1:
+        return face_recognition.face_locations(rgb_img, number_of_times_to_upsample=upsample, model=model)
+
+    small = cv2.resize(rgb_img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    locations = []
+    for top, right, bottom, left in face_recognition.face_locations(small, number_of_times_to_upsample=upsample, model=model):
+        location = (
+            max(0, int(top / scale)),
+            min(width, int(right / scale)),
+            min(height, int(bottom / scale)),
+            max(0, int(left / scale))
+        )
+        locations.append(_refine_location(rgb_img, location, model) if refine else location)
+    return locations
+
+
+def largest_faces(face_locations, max_faces):
+    """
+    The max_faces largest boxes, largest first
+    """
+    return sorted(face_locations, key=lambda box: (box[2] - box[0]) * (box[1] - box[3]), reverse=True)[:max_faces]
+
+
+def encode_faces(rgb_img, face_locations, num_jitters=NUM_JITTERS, encoding_model=ENCODING_MODEL):
+    """
+    Full-resolution encodings for already detected boxes
+    """
+    return face_recognition.face_encodings(rgb_img, face_locations, num_jitters=num_jitters, model=encoding_model)
+
+
+def detect_and_encode(rgb_img, scale=DETECT_SCALE, upsample=DETECT_UPSAMPLE, model=DETECT_MODEL,
+                      num_jitters=NUM_JITTERS, refine=DETECT_REFINE, max_faces=None,
+                      encoding_model=ENCODING_MODEL):
+    """
+    Run the detection and encoding stages on an RGB image.
+
+    Encodings are computed at full resolution, but only for the detected
+    boxes; with max_faces set, only the largest faces are kept. Returns (face_locations, face_encodings, timings) where timings
+    holds the milliseconds spent in each stage.
+    """
+    timings = {}
+    start = time.perf_counter()
+    face_locations = detect_faces(rgb_img, scale=scale, upsample=upsample, model=model, refine=refine)
+    timings['detect_ms'] = _elapsed_ms(start)
+
+    if not face_locations:
+        return [], [], timings
+    if max_faces:
+        face_locations = largest_faces(face_locations, max_faces)
+
+    start = time.perf_counter()
+    face_encodings = encode_faces(rgb_img, face_locations, num_jitters=num_jitters, encoding_model=encoding_model)
+    timings['encode_ms'] = _elapsed_ms(start)
+    return face_locations, face_encodings, timings
+
+
+def box_iou(a, b):
+    """
+    Intersection over union of two (top, right, bottom, left) boxes
+    """
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    intersection = max(0, bottom - top) * max(0, right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    union = area_a + area_b - intersection
+    return intersection / union if union > 0 else 0.0
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import sqlite3
+import time
+import numpy as np
+from utils.config import ENCODING_CACHE_PATH, ENCODING_CACHE_SIZE
+from utils.db import get_connection, release_connection
+from utils.detection import encoder_version
+from utils.encodings import ENCODING_DIM, STORAGE_DTYPE, encoding_to_blob
+
+# Bump when detection or encoding changes in a way encoder_version() does not capture
+CACHE_VERSION = 1
+
+
+class EncodingCache:
+    """
+    Detected face boxes and encodings, keyed by a hash of the image bytes
+    and the detector settings.
+
+    Entries live in a small SQLite database shared by every process, so
+    they survive restarts and are visible to all recognition workers. Once
+    the cache holds more than max_entries, the least recently used entries
+    are evicted. Cache errors are reported and otherwise ignored: the
+    caller simply recomputes.
+    """
+
+    def __init__(self, path=ENCODING_CACHE_PATH, max_entries=ENCODING_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self._ready = False
+        self._settings = f'{CACHE_VERSION}:{encoder_version()}'.encode()
+
+    @property
+    def enabled(self):
+        return bool(self.path) and self.max_entries > 0
+
+    def _connection(self):
+        conn = get_connection(self.path)
+        if not self._ready:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS encodings (
+                    key TEXT PRIMARY KEY,
+                    locations TEXT NOT NULL,
+                    encodings BLOB NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_encodings_last_used ON encodings (last_used)')
+            conn.commit()
+            self._ready = True
+        return conn
+
+    def key(self, image_data, max_faces=None):
+        digest = hashlib.sha256(self._settings)
+        digest.update(str(max_faces).encode())
+        digest.update(image_data)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Return (face_locations, face_encodings) for a key, or None on a miss
+        """
+        if not self.enabled:
+            return None
+        try:
+            conn = self._connection()
+            row = conn.execute('SELECT locations, encodings FROM encodings WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE encodings SET last_used = ? WHERE key = ?', (time.time(), key))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error reading encoding cache: {str(e)}")
+            release_connection(self.path)
+            return None
+
+        face_locations = [tuple(location) for location in json.loads(row['locations'])]
+        matrix = np.frombuffer(row['encodings'], dtype=STORAGE_DTYPE).reshape(-1, ENCODING_DIM)
+        return face_locations, [encoding.astype(np.float64) for encoding in matrix]
+
+    def put(self, key, face_locations, face_encodings):
+        if not self.enabled:
+            return
+        try:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO encodings (key, locations, encodings, last_used) VALUES (?, ?, ?, ?)',
+                (key, json.dumps([[int(v) for v in location] for location in face_locations]),
+                 b''.join(encoding_to_blob(encoding) for encoding in face_encodings), time.time())
+            )
+            # Evict the least recently used entries beyond the limit
+            conn.execute('''
+                DELETE FROM encodings WHERE key IN (
+                    SELECT key FROM encodings ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error writing encoding cache: {str(e)}")
+            release_connection(self.path)
+
+
+# Shared cache; every process opens its own connection to the same file
+encoding_cache = EncodingCache()
@@ -0,0 +1,82 @@
+import json
+import numpy as np
+
+ENCODING_DIM = 128
+
+# Encodings are stored as raw little-endian floats; the width is inferred from the blob length
+STORAGE_DTYPE = np.dtype('<f4')
+_DTYPES_BY_SIZE = {
+    ENCODING_DIM * 4: np.dtype('<f4'),
+    ENCODING_DIM * 8: np.dtype('<f8'),
+}
+
+
+def encoding_to_blob(face_encoding):
+    """
+    Serialize a 128-d face encoding to the binary column format
+    """
+    return np.ascontiguousarray(face_encoding, dtype=STORAGE_DTYPE).tobytes()
+
+
+def blob_to_encoding(value):
+    """
+    Decode a stored face encoding, accepting both binary blobs and legacy JSON text
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        dtype = _DTYPES_BY_SIZE.get(len(value))
+        if dtype is None:
+            raise ValueError(f'Unexpected face encoding size: {len(value)} bytes')
+        return np.frombuffer(value, dtype=dtype)
+    return np.array(json.loads(value), dtype=np.float64)
+
+
+def blobs_to_matrix(values):
+    """
+    Decode many stored encodings into one (N x 128) float32 matrix.
+
+    float32 blobs are joined and viewed with a single np.frombuffer call;
+    any other rows (float64 or legacy JSON) are decoded individually.
+    """
+    matrix = np.empty((len(values), ENCODING_DIM), dtype=np.float32)
+    fast_rows = [i for i, value in enumerate(values)
+                 if isinstance(value, bytes) and len(value) == ENCODING_DIM * 4]
+    if fast_rows:
+        joined = b''.join(values[i] for i in fast_rows)
+        matrix[fast_rows] = np.frombuffer(joined, dtype=STORAGE_DTYPE).reshape(-1, ENCODING_DIM)
+    fast = set(fast_rows)
+    for i, value in enumerate(values):
+        if i not in fast:
+            matrix[i] = blob_to_encoding(value)
+    return matrix
+
+
+def migrate_json_encodings(conn, batch_size=500):
+    """
+    Convert legacy JSON text encodings to binary blobs in place.
+
+    Rows are converted in batches so a large table never needs to be held
+    in memory at once. Returns the number of rows converted.
+    """
+    c = conn.cursor()
+    converted = 0
+    last_id = 0
+    while True:
+        c.execute(
+            "SELECT id, face_encoding FROM students "
+            "WHERE id > ? AND typeof(face_encoding) = 'text' ORDER BY id LIMIT ?",
+            (last_id, batch_size)
+        )
+        rows = c.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates = []
+        for student_id, stored_encoding in rows:
+            try:
+                updates.append((encoding_to_blob(json.loads(stored_encoding)), student_id))
+            except Exception as e:
+                print(f"Error migrating face encoding for student {student_id}: {str(e)}")
+        c.executemany('UPDATE students SET face_encoding = ? WHERE id = ?', updates)
+        conn.commit()
+        converted += len(updates)
+    return converted
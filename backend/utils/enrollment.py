@@ -0,0 +1,255 @@
+import csv
+import io
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from utils.config import BULK_ENROLL_BATCH_SIZE, BULK_ENROLL_ROOT, BULK_ENROLL_WORKERS, DATABASE_PATH
+from utils.db import get_connection, retry_on_busy, transaction
+from utils.detection import encoder_version
+from utils.encodings import encoding_to_blob
+from utils.gallery import gallery
+from utils.ingest import upload_store
+from utils.recognition import encode_image
+
+MANIFEST_NAME = 'manifest.csv'
+MANIFEST_FIELDS = ('name', 'roll_number', 'image')
+
+
+class ImageSource:
+    """
+    Reads enrollment images from a ZIP archive or a directory
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._zip = zipfile.ZipFile(path) if zipfile.is_zipfile(path) else None
+
+    def read(self, name):
+        if self._zip is not None:
+            return self._zip.read(name)
+        full_path = os.path.realpath(os.path.join(self.path, name))
+        # Manifest entries may not point outside the directory
+        if not full_path.startswith(os.path.realpath(self.path) + os.sep):
+            raise KeyError(name)
+        with open(full_path, 'rb') as f:
+            return f.read()
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+
+
+def resolve_directory(directory, root=BULK_ENROLL_ROOT):
+    """
+    Real path of a server-side enrollment directory given relative to root,
+    or None if directories are disabled or it resolves outside root
+    """
+    if not root:
+        return None
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, directory))
+    if path != root and not path.startswith(root + os.sep):
+        return None
+    return path
+
+
+def parse_manifest(text):
+    """
+    Parse a CSV manifest with name, roll_number and image columns
+    """
+    reader = csv.DictReader(io.StringIO(text))
+    missing = [field for field in MANIFEST_FIELDS if field not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"Manifest is missing columns: {', '.join(missing)}")
+    return [{field: (row[field] or '').strip() for field in MANIFEST_FIELDS} for row in reader]
+
+
+class EnrollmentJob:
+    """
+    Background job that enrolls every student listed in a manifest.
+
+    Images are encoded in parallel on a process pool with a bounded number
+    of images in flight, and rows are inserted in batched transactions.
+    Items that fail (missing image, no face, multiple faces, duplicate roll
+    number) are reported individually and do not stop the job.
+    """
+
+    def __init__(self, source_path, manifest, cleanup=False):
+        self.job_id = uuid.uuid4().hex
+        self.source_path = source_path
+        self.manifest = manifest
+        self.cleanup = cleanup
+        self.status = 'queued'
+        self.error = None
+        self.processed = 0
+        self.enrolled = 0
+        self.failures = []
+        self.created_at = time.time()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'job_id': self.job_id,
+                'status': self.status,
+                'error': self.error,
+                'total': len(self.manifest),
+                'processed': self.processed,
+                'enrolled': self.enrolled,
+                'failed': len(self.failures),
+                'failures': list(self.failures),
+                'created_at': self.created_at,
+                'finished_at': self.finished_at
+            }
+
+    def _fail(self, item, reason):
+        with self._lock:
+            self.processed += 1
+            self.failures.append({'roll_number': item['roll_number'], 'image': item['image'], 'reason': reason})
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self, db_path=DATABASE_PATH):
+        self.status = 'running'
+        source = None
+        try:
+            source = ImageSource(self.source_path)
+            items = self._validate(db_path)
+            self._encode_and_insert(items, source, db_path)
+            self.status = 'completed'
+        except Exception as e:
+            print(f"Error in bulk enrollment job {self.job_id}: {str(e)}")
+            self.status = 'failed'
+            self.error = str(e)
+        finally:
+            if source is not None:
+                source.close()
+            if self.cleanup and os.path.isfile(self.source_path):
+                os.remove(self.source_path)
+            self.finished_at = time.time()
+
+    def _validate(self, db_path):
+        # Reject incomplete rows and duplicate roll numbers before any encoding work
+        c = get_connection(db_path).cursor()
+        c.execute('SELECT roll_number FROM students')
+        existing = {row[0] for row in c.fetchall()}
+
+        items = []
+        seen = set()
+        for item in self.manifest:
+            if not item['name'] or not item['roll_number'] or not item['image']:
+                self._fail(item, 'missing_fields')
+            elif item['roll_number'] in existing or item['roll_number'] in seen:
+                self._fail(item, 'duplicate_roll_number')
+            else:
+                seen.add(item['roll_number'])
+                items.append(item)
+        return items
+
+    def _encode_and_insert(self, items, source, db_path):
+        pending_rows = []
+        with ProcessPoolExecutor(max_workers=BULK_ENROLL_WORKERS) as executor:
+            in_flight = {}
+            remaining = iter(items)
+            while True:
+                # Keep a bounded number of images in flight so large archives are never fully in memory
+                while len(in_flight) < 4 * BULK_ENROLL_WORKERS:
+                    item = next(remaining, None)
+                    if item is None:
+                        break
+                    try:
+                        image_data = source.read(item['image'])
+                    except KeyError:
+                        self._fail(item, 'image_not_found')
+                        continue
+                    in_flight[executor.submit(encode_image, image_data, None, True)] = (item, image_data)
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item, image_data = in_flight.pop(future)
+                    try:
+                        face_locations, face_encodings, _ = future.result()
+                    except ValueError:
+                        self._fail(item, 'invalid_image')
+                        continue
+                    if not face_locations:
+                        self._fail(item, 'no_face')
+                    elif len(face_locations) > 1:
+                        self._fail(item, 'multiple_faces')
+                    else:
+                        pending_rows.append((item, image_data, face_encodings[0]))
+
+                if len(pending_rows) >= BULK_ENROLL_BATCH_SIZE:
+                    self._insert_batch(pending_rows, db_path)
+                    pending_rows = []
+
+        if pending_rows:
+            self._insert_batch(pending_rows, db_path)
+
+    def _insert_batch(self, rows, db_path):
+        """
+        Save the images and insert one batch of students in a single transaction
+        """
+        inserted, duplicates = self._insert_rows(rows, db_path)
+        for item in duplicates:
+            # Enrolled by someone else since validation
+            self._fail(item, 'duplicate_roll_number')
+        for item, image_data, _ in rows:
+            if item not in duplicates:
+                upload_store.save(f"uploads/{item['roll_number']}.jpg", image_data)
+
+        gallery.add_many(inserted)
+        with self._lock:
+            self.processed += len(inserted)
+            self.enrolled += len(inserted)
+
+    @retry_on_busy
+    def _insert_rows(self, rows, db_path):
+        inserted = []
+        duplicates = []
+        with transaction(db_path) as c:
+            for item, _, face_encoding in rows:
+                try:
+                    c.execute(
+                        'INSERT INTO students (name, roll_number, image_path, face_encoding, encoding_version) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        (item['name'], item['roll_number'], f"uploads/{item['roll_number']}.jpg",
+                         encoding_to_blob(face_encoding), encoder_version())
+                    )
+                except sqlite3.IntegrityError:
+                    duplicates.append(item)
+                    continue
+                inserted.append((c.lastrowid, item['name'], face_encoding))
+        return inserted, duplicates
+
+
+class EnrollmentJobs:
+    """
+    Registry of bulk enrollment jobs in this process
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, source_path, manifest, cleanup=False):
+        job = EnrollmentJob(source_path, manifest, cleanup=cleanup)
+        with self._lock:
+            self._jobs[job.job_id] = job
+        job.start()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+
+enrollment_jobs = EnrollmentJobs()
@@ -1,119 +1,106 @@
 
 import cv2
 import numpy as np
-import face_recognition
-import json
-import sqlite3
 import base64
 from datetime import datetime
+from utils.attendance_writer import attendance_writer
+from utils.db import get_connection
+from utils.encodings import blob_to_encoding
+from utils.gallery import assign_faces, pairwise_distances
+from utils.metrics import faces_detected, record_timings
+from utils.recognition import encode_image
 
 def get_student_encodings():
     """
     Retrieve all student face encodings from the database
     """
-    conn = sqlite3.connect('database/attendance.db')
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
+    c = get_connection().cursor()
     c.execute('SELECT id, name, roll_number, face_encoding FROM students')
     students = [dict(row) for row in c.fetchall()]
-    conn.close()
     
-    # Convert stored encodings from JSON to numpy arrays
+    # Decode stored encodings (binary blobs, or legacy JSON text) to numpy arrays
     for student in students:
         if student['face_encoding']:
-            student['face_encoding'] = np.array(json.loads(student['face_encoding']))
+            student['face_encoding'] = blob_to_encoding(student['face_encoding'])
     
     return students
 
 def recognize_faces_from_image(image_path, tolerance=0.6):
     """
-    Recognize faces in an image and match against known students
+    Recognize faces in an image file and match against known students
     """
-    # Load image
-    image = face_recognition.load_image_file(image_path)
-    
-    # Find all face locations and encodings
-    face_locations = face_recognition.face_locations(image)
-    face_encodings = face_recognition.face_encodings(image, face_locations)
+    with open(image_path, 'rb') as f:
+        return recognize_faces(f.read(), tolerance)
+
+def recognize_faces(image_data, tolerance=0.6):
+    """
+    Recognize faces in encoded image bytes (e.g. an upload) and match against known students
+    """
+    # Find all face locations and encodings, reusing cached results for unchanged images
+    face_locations, face_encodings, timings = encode_image(image_data, cached=True)
+    record_timings(timings)
+    faces_detected.inc(len(face_locations))
     
     if not face_encodings:
         return []
     
     # Get all student encodings
-    students = get_student_encodings()
+    students = [student for student in get_student_encodings() if isinstance(student['face_encoding'], np.ndarray)]
     
     if not students:
         return []
     
+    # Score every face against every student in one (M x N) distance pass
+    known_encodings = np.stack([student['face_encoding'] for student in students])
+    face_distances = pairwise_distances(face_encodings, known_encodings)
+    assignment = assign_faces(face_distances, tolerance)
+    
     # Match faces
     recognized_students = []
     current_date = datetime.now().strftime('%Y-%m-%d')
     current_time = datetime.now().strftime('%H:%M:%S')
     
-    for face_encoding, face_location in zip(face_encodings, face_locations):
-        matches = face_recognition.compare_faces(
-            [student['face_encoding'] for student in students if 'face_encoding' in student],
-            face_encoding,
-            tolerance=tolerance
-        )
-        
-        face_distances = face_recognition.face_distance(
-            [student['face_encoding'] for student in students if 'face_encoding' in student],
-            face_encoding
-        )
+    for face_index, face_location in enumerate(face_locations):
+        best_match_index = assignment[face_index]
         
-        if len(face_distances) > 0 and True in matches:
-            best_match_index = np.argmin(face_distances)
+        if best_match_index >= 0:
+            student = students[best_match_index]
+            top, right, bottom, left = face_location
             
-            if matches[best_match_index]:
-                student = students[best_match_index]
-                top, right, bottom, left = face_location
-                
-                recognized_students.append({
-                    'student_id': student['id'],
-                    'name': student['name'],
-                    'roll_number': student['roll_number'],
-                    'location': {
-                        'top': top,
-                        'right': right,
-                        'bottom': bottom,
-                        'left': left
-                    },
-                    'date': current_date,
-                    'time': current_time
-                })
+            recognized_students.append({
+                'student_id': student['id'],
+                'name': student['name'],
+                'roll_number': student['roll_number'],
+                'location': {
+                    'top': top,
+                    'right': right,
+                    'bottom': bottom,
+                    'left': left
+                },
+                'distance': float(face_distances[face_index, best_match_index]),
+                'date': current_date,
+                'time': current_time
+            })
     
     return recognized_students
 
-def mark_attendance(recognized_students):
+def mark_attendance(recognized_students, subject_id):
     """
-    Mark attendance for recognized students
+    Mark attendance for recognized students in a subject; returns the number newly marked.
+
+    Records go through the shared write-behind attendance writer, which
+    skips students already marked and commits in batches.
     """
     if not recognized_students:
         return 0
     
-    conn = sqlite3.connect('database/attendance.db')
-    c = conn.cursor()
-    
+    marked = 0
     for student in recognized_students:
-        # Check if attendance already marked for today
-        c.execute(
-            'SELECT id FROM attendance WHERE student_id = ? AND date = ?',
-            (student['student_id'], student['date'])
-        )
-        
-        existing = c.fetchone()
-        
-        if not existing:
-            c.execute(
-                'INSERT INTO attendance (student_id, date, time, status) VALUES (?, ?, ?, ?)',
-                (student['student_id'], student['date'], student['time'], 'present')
-            )
-    
-    conn.commit()
-    conn.close()
+        marked += len(attendance_writer.submit(
+            subject_id, [student['student_id']], student['date'], student['time']
+        ))
     
-    return len(recognized_students)
+    return marked
 
 def encode_image_to_base64(image_path):
     """
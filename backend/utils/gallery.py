@@ -0,0 +1,504 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+import numpy as np
+from utils.config import DATABASE_PATH, IVF_EXACT_FALLBACK, IVF_MIN_GALLERY, MATCH_TOLERANCE, MATCH_TOP_K
+from utils.db import get_connection
+from utils.encodings import ENCODING_DIM, blob_to_encoding, blobs_to_matrix, encoding_to_blob
+from utils.gallery_snapshot import (
+    SNAPSHOT_PATH, SNAPSHOTS_SUPPORTED, SnapshotLock, read_generation, read_snapshot, snapshot_signature, write_snapshot
+)
+
+
+class FaceGallery:
+    """
+    Process-wide matrix of enrolled face encodings used for vectorized matching.
+
+    Encodings live in one contiguous float32 (N x 128) buffer with parallel
+    id/name arrays. Rows are appended into spare capacity on enrollment and
+    swap-removed on deletion, so the buffer is never rebuilt per request.
+
+    Students with several face templates (see utils.templates) are
+    represented in that buffer by the centroid of their templates, and the
+    templates themselves are kept per student. Matching scans the centroids
+    and then re-scores the MATCH_TOP_K nearest students against their
+    templates, so the scan still costs one vector per student.
+
+    When a snapshot path is set, the gallery is shared between worker
+    processes through a memory-mapped snapshot file: every mutation is
+    published as a new snapshot version, and other workers remap it on
+    their next match. Each snapshot records the database's gallery_version
+    it reflects; open() rebuilds a snapshot that no longer matches.
+
+    An optional approximate index (see utils.ann_index) can be attached
+    with use_index; it is kept in sync with every change and consulted
+    before the exact scan on large galleries.
+    """
+
+    def __init__(self, snapshot_path=None, db_path=DATABASE_PATH):
+        self.snapshot_path = snapshot_path
+        self.db_path = db_path
+        self.index = None
+        self.generation = 0
+        # gallery_version of the database this gallery reflects
+        self.db_version = 0
+        # Bumped on every in-process change so derived caches can detect staleness
+        self.revision = 0
+        self._signature = None
+        self._mapped = False
+        self._lock = threading.RLock()
+        self._reset(0)
+
+    def _reset(self, capacity):
+        self._encodings = np.zeros((capacity, ENCODING_DIM), dtype=np.float32)
+        self._sq_norms = np.zeros(capacity, dtype=np.float32)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._names = np.empty(capacity, dtype=object)
+        self._rows = {}
+        # student_id -> (T x 128) templates, only for students with more than one
+        self._templates = {}
+        self._size = 0
+        self._mapped = False
+
+    def __len__(self):
+        return self._size
+
+    def open(self, db_path=DATABASE_PATH):
+        """
+        Map the shared snapshot if one exists and still matches the
+        database, otherwise build from the database and publish it
+        """
+        if self.snapshot_path:
+            try:
+                if self.refresh() and self.db_version == database_version(db_path):
+                    self.db_path = db_path
+                    return self._size
+            except Exception as e:
+                print(f"Error reading gallery snapshot, rebuilding from database: {str(e)}")
+        return self.rebuild(db_path)
+
+    def rebuild(self, db_path=DATABASE_PATH):
+        """
+        Reload from the database and publish the result as a new snapshot
+        """
+        if not self.snapshot_path:
+            return self.load(db_path)
+        with self._lock, SnapshotLock(self.snapshot_path):
+            self.load(db_path)
+            self.publish()
+        return self._size
+
+    def load(self, db_path=DATABASE_PATH):
+        """
+        Rebuild the gallery from every student row and face template in the database
+        """
+        # Read first: a change committed while loading then only causes an extra rebuild
+        db_version = database_version(db_path)
+        c = get_connection(db_path).cursor()
+        # Legacy rows without an encoding cannot be matched (and are left NULL by the migrations)
+        c.execute('SELECT id, name, face_encoding FROM students WHERE face_encoding IS NOT NULL')
+        rows = c.fetchall()
+
+        # Templates made with other encoder settings than the student's own encoding are not comparable
+        c.execute('''
+            SELECT t.student_id, t.face_encoding FROM face_templates t
+            JOIN students s ON s.id = t.student_id
+            WHERE t.encoding_version IS s.encoding_version
+            ORDER BY t.student_id, t.id
+        ''')
+        extra_templates = {}
+        for student_id, stored_encoding in c.fetchall():
+            extra_templates.setdefault(student_id, []).append(stored_encoding)
+
+        valid = []
+        for student_id, name, stored_encoding in rows:
+            try:
+                # Rows not yet migrated to float32 blobs are normalized individually
+                if not isinstance(stored_encoding, bytes) or len(stored_encoding) != ENCODING_DIM * 4:
+                    stored_encoding = encoding_to_blob(blob_to_encoding(stored_encoding))
+            except Exception as e:
+                print(f"Error loading face encoding for student {student_id}: {str(e)}")
+                continue
+            valid.append((student_id, name, stored_encoding))
+
+        encodings = blobs_to_matrix([row[2] for row in valid])
+        templates = {}
+        for i, (student_id, _, _) in enumerate(valid):
+            if student_id in extra_templates:
+                templates[student_id] = np.vstack([encodings[i:i + 1], blobs_to_matrix(extra_templates[student_id])])
+                encodings[i] = templates[student_id].mean(axis=0)
+
+        with self._lock:
+            size = len(valid)
+            self._reset(max(size, 16))
+            self._encodings[:size] = encodings
+            self._sq_norms[:size] = np.einsum('ij,ij->i', encodings, encodings)
+            self._ids[:size] = [row[0] for row in valid]
+            self._names[:size] = [row[1] for row in valid]
+            self._rows = {row[0]: i for i, row in enumerate(valid)}
+            self._templates = templates
+            self._size = size
+            self.db_path = db_path
+            self.db_version = db_version
+            self.revision += 1
+            self._sync_index()
+        return self._size
+
+    def refresh(self):
+        """
+        Remap the snapshot if a newer version has been published.
+
+        Returns True if a snapshot was (re)mapped.
+        """
+        if not self.snapshot_path:
+            return False
+        signature = snapshot_signature(self.snapshot_path)
+        if signature is None or signature == self._signature:
+            return False
+        generation, encodings, sq_norms, ids, names, templates, owners, db_version = read_snapshot(self.snapshot_path)
+        with self._lock:
+            self._encodings = encodings
+            self._sq_norms = sq_norms
+            self._ids = ids
+            self._names = np.empty(len(names), dtype=object)
+            self._names[:] = names
+            self._rows = {int(student_id): i for i, student_id in enumerate(ids)}
+            self._templates = group_templates(templates, owners)
+            self._size = len(ids)
+            self._mapped = True
+            self.generation = generation
+            self.db_version = db_version
+            self._signature = signature
+            self.revision += 1
+            self._sync_index()
+        return True
+
+    def use_index(self, index):
+        """
+        Attach an approximate nearest-neighbour index (or None for exact search only)
+        """
+        with self._lock:
+            self.index = index
+            self._sync_index()
+
+    def _sync_index(self):
+        if self.index is not None:
+            self.index.build(self._ids[:self._size], self._encodings[:self._size])
+
+    def publish(self):
+        """
+        Write the current gallery as the next snapshot version.
+
+        Callers must hold the SnapshotLock for the snapshot path.
+        """
+        with self._lock:
+            size = self._size
+            self.generation = max(self.generation, read_generation(self.snapshot_path)) + 1
+            if self._templates:
+                templates = np.concatenate(list(self._templates.values()))
+                owners = np.repeat(np.fromiter(self._templates, dtype=np.int64),
+                                   [len(t) for t in self._templates.values()])
+            else:
+                templates = owners = None
+            write_snapshot(
+                self.snapshot_path, self.generation, self._encodings[:size],
+                self._sq_norms[:size], self._ids[:size], self._names[:size], templates, owners, self.db_version
+            )
+            self._signature = snapshot_signature(self.snapshot_path)
+
+    @contextmanager
+    def _mutation(self):
+        # Serialize read-modify-publish across threads and, via the snapshot lock, across processes
+        with self._lock:
+            self.revision += 1
+            if not self.snapshot_path:
+                yield
+                return
+            with SnapshotLock(self.snapshot_path):
+                self.refresh()
+                if self._mapped:
+                    # Copy out of the read-only mapping before modifying in place
+                    self._grow(max(16, 2 * self._size))
+                yield
+                # The change being published was committed to the database before the mutation
+                self.db_version = database_version(self.db_path)
+                try:
+                    self.publish()
+                except Exception as e:
+                    # Other processes would keep the old snapshot: publish a fresh load instead
+                    print(f"Error publishing gallery snapshot, rebuilding from database: {str(e)}")
+                    self.load(self.db_path)
+                    self.publish()
+
+    def _append(self, student_id, name, encoding):
+        if self._size == len(self._ids):
+            self._grow(max(16, 2 * len(self._ids)))
+        row = self._size
+        self._encodings[row] = np.asarray(encoding, dtype=np.float32)
+        self._sq_norms[row] = np.dot(self._encodings[row], self._encodings[row])
+        self._ids[row] = student_id
+        self._names[row] = name
+        self._rows[student_id] = row
+        self._size += 1
+
+    def _grow(self, capacity):
+        size = self._size
+        encodings, sq_norms = self._encodings[:size], self._sq_norms[:size]
+        ids, names = self._ids[:size], self._names[:size]
+        templates = self._templates
+        self._reset(capacity)
+        self._encodings[:size] = encodings
+        self._sq_norms[:size] = sq_norms
+        self._ids[:size] = ids
+        self._names[:size] = names
+        self._rows = {int(student_id): i for i, student_id in enumerate(ids)}
+        self._templates = templates
+        self._size = size
+
+    def _remove(self, student_id):
+        row = self._rows.pop(student_id, None)
+        if row is None:
+            return False
+        self._templates.pop(student_id, None)
+        last = self._size - 1
+        if row != last:
+            self._encodings[row] = self._encodings[last]
+            self._sq_norms[row] = self._sq_norms[last]
+            self._ids[row] = self._ids[last]
+            self._names[row] = self._names[last]
+            self._rows[int(self._ids[row])] = row
+        self._names[last] = None
+        self._size = last
+        return True
+
+    def add(self, student_id, name, encoding):
+        """
+        Add (or replace) a student's encoding in place
+        """
+        with self._mutation():
+            self._remove(student_id)
+            self._append(student_id, name, encoding)
+            if self.index is not None and not self.index.add(student_id, encoding):
+                self._sync_index()
+
+    def set_templates(self, student_id, name, encodings):
+        """
+        Replace all of a student's face templates; their gallery row becomes the centroid
+        """
+        self.set_many_templates([(student_id, name, encodings)])
+
+    def set_many_templates(self, students):
+        """
+        set_templates for several (student_id, name, encodings) entries as one published change
+        """
+        with self._mutation():
+            centroids = []
+            for student_id, name, encodings in students:
+                encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+                centroid = encodings.mean(axis=0)
+                self._remove(student_id)
+                self._append(student_id, name, centroid)
+                if len(encodings) > 1:
+                    self._templates[student_id] = encodings
+                centroids.append((student_id, centroid))
+            if self.index is not None:
+                for student_id, centroid in centroids:
+                    if not self.index.add(student_id, centroid):
+                        self._sync_index()
+                        break
+
+    def add_many(self, students):
+        """
+        Add (or replace) several (student_id, name, encoding) entries as one published change
+        """
+        with self._mutation():
+            for student_id, name, encoding in students:
+                self._remove(student_id)
+                self._append(student_id, name, encoding)
+            if self.index is not None:
+                for student_id, _, encoding in students:
+                    if not self.index.add(student_id, encoding):
+                        self._sync_index()
+                        break
+
+    def remove(self, student_id):
+        """
+        Remove a student by moving the last row into its slot
+        """
+        with self._mutation():
+            if self.index is not None:
+                self.index.remove(student_id)
+            return self._remove(student_id)
+
+    def distances(self, face_encoding):
+        """
+        Euclidean distance from one probe encoding to every enrolled student
+        """
+        return self.distance_matrix([face_encoding])[0]
+
+    def distance_matrix(self, face_encodings):
+        """
+        (M x N) Euclidean distances from M probe encodings to every enrolled student
+        """
+        with self._lock:
+            return pairwise_distances(
+                face_encodings, self._encodings[:self._size], self._sq_norms[:self._size]
+            )
+
+    def _template_distance(self, student_id, face_encoding, centroid_distance):
+        # Nearest template of one student; students with a single template are their centroid
+        templates = self._templates.get(student_id)
+        if templates is None:
+            return centroid_distance
+        return float(pairwise_distances(face_encoding, templates).min())
+
+    def match(self, face_encoding, tolerance=MATCH_TOLERANCE, top_k=MATCH_TOP_K):
+        """
+        Return (student_id, name, distance) of the nearest enrolled student,
+        or None if the gallery is empty.
+
+        The top_k nearest centroids are re-scored against their students'
+        templates. Large galleries with an attached index are searched
+        approximately first; the exact scan runs only if that finds no match
+        within the tolerance and exact fallback is enabled.
+        """
+        self.refresh()
+        with self._lock:
+            if not self._size:
+                return None
+            if self.index is not None and self._size >= IVF_MIN_GALLERY:
+                candidates = self.index.search(face_encoding, k=top_k if self._templates else 1)
+                if candidates:
+                    student_id, distance = min(
+                        ((student_id, self._template_distance(student_id, face_encoding, distance))
+                         for student_id, distance in candidates),
+                        key=lambda candidate: candidate[1]
+                    )
+                    if distance < tolerance or not IVF_EXACT_FALLBACK:
+                        return student_id, self._names[self._rows[student_id]], distance
+            distances = self.distances(face_encoding)
+            if not self._templates:
+                best = int(np.argmin(distances))
+                return int(self._ids[best]), self._names[best], float(distances[best])
+            rows = _nearest_rows(distances, top_k)
+            refined = [self._template_distance(int(self._ids[row]), face_encoding, float(distances[row])) for row in rows]
+            best = int(np.argmin(refined))
+            return int(self._ids[rows[best]]), self._names[rows[best]], refined[best]
+
+    def subset(self, student_ids):
+        """
+        Copy the rows for the given students into a new, standalone gallery
+        """
+        self.refresh()
+        with self._lock:
+            rows = [self._rows[student_id] for student_id in student_ids if student_id in self._rows]
+            sub = FaceGallery()
+            sub._reset(max(len(rows), 16))
+            size = len(rows)
+            sub._encodings[:size] = self._encodings[rows]
+            sub._sq_norms[:size] = self._sq_norms[rows]
+            sub._ids[:size] = self._ids[rows]
+            sub._names[:size] = self._names[rows]
+            sub._rows = {int(student_id): i for i, student_id in enumerate(sub._ids[:size])}
+            sub._templates = {student_id: self._templates[student_id] for student_id in sub._rows
+                              if student_id in self._templates}
+            sub._size = size
+            return sub
+
+    def match_faces(self, face_encodings, tolerance=MATCH_TOLERANCE, top_k=MATCH_TOP_K):
+        """
+        Match several probes from one image in a single (M x N) distance pass.
+
+        Each probe's top_k nearest centroids are re-scored against their
+        students' templates before the assignment. Each face is assigned to
+        at most one student and each student to at most one face. Returns
+        one (student_id, name, distance, matched) tuple per probe; unmatched
+        probes report their nearest student, if any.
+        """
+        self.refresh()
+        with self._lock:
+            if not len(face_encodings) or not self._size:
+                return [(None, None, None, False) for _ in face_encodings]
+            distances = self.distance_matrix(face_encodings)
+            if self._templates:
+                for face, face_encoding in enumerate(face_encodings):
+                    for row in _nearest_rows(distances[face], top_k):
+                        distances[face, row] = self._template_distance(
+                            int(self._ids[row]), face_encoding, distances[face, row]
+                        )
+            assignment = assign_faces(distances, tolerance)
+            nearest = np.argmin(distances, axis=1)
+            results = []
+            for face, row in enumerate(assignment):
+                matched = row >= 0
+                row = row if matched else nearest[face]
+                results.append((int(self._ids[row]), self._names[row], float(distances[face, row]), bool(matched)))
+            return results
+
+
+def database_version(db_path=DATABASE_PATH):
+    """
+    The database's gallery_version counter, bumped by every change the gallery is built from
+    """
+    try:
+        row = get_connection(db_path).execute('SELECT version FROM gallery_version WHERE id = 1').fetchone()
+    except sqlite3.OperationalError:
+        # Not migrated yet
+        return 0
+    return row[0] if row else 0
+
+
+def _nearest_rows(distances, k):
+    # Indices of the k (at least one) smallest distances, in no particular order
+    k = max(k, 1)
+    if k >= len(distances):
+        return np.arange(len(distances))
+    return np.argpartition(distances, k - 1)[:k]
+
+
+def group_templates(templates, owners):
+    """
+    Split a (T x 128) template matrix into {student_id: templates} by its owner column
+    """
+    if not len(owners):
+        return {}
+    starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+    ends = np.r_[starts[1:], len(owners)]
+    return {int(owners[start]): templates[start:end] for start, end in zip(starts, ends)}
+
+
+def pairwise_distances(probes, encodings, sq_norms=None):
+    """
+    Euclidean distances between (M x 128) probes and (N x 128) encodings as one matrix product
+    """
+    probes = np.atleast_2d(np.asarray(probes, dtype=np.float32))
+    encodings = np.asarray(encodings, dtype=np.float32)
+    if sq_norms is None:
+        sq_norms = np.einsum('ij,ij->i', encodings, encodings)
+    probe_norms = np.einsum('ij,ij->i', probes, probes)
+    # |g - p|^2 = |g|^2 - 2 g.p + |p|^2
+    sq_dist = sq_norms[None, :] - 2.0 * (probes @ encodings.T) + probe_norms[:, None]
+    return np.sqrt(np.maximum(sq_dist, 0.0))
+
+
+def assign_faces(distances, tolerance=MATCH_TOLERANCE):
+    """
+    One-to-one assignment of faces (rows) to gallery entries (columns).
+
+    Pairs under the tolerance are taken greedily in order of increasing
+    distance, skipping any face or gallery entry that is already used.
+    Returns the assigned column for each face, or -1 if it has none.
+    """
+    assignment = np.full(distances.shape[0], -1, dtype=np.int64)
+    faces, rows = np.nonzero(distances < tolerance)
+    order = np.argsort(distances[faces, rows], kind='stable')
+    used_rows = set()
+    for face, row in zip(faces[order], rows[order]):
+        if assignment[face] < 0 and row not in used_rows:
+            assignment[face] = row
+            used_rows.add(row)
+    return assignment
+
+
+# Shared gallery for the Flask process, backed by the on-disk snapshot where the platform allows it
+gallery = FaceGallery(snapshot_path=SNAPSHOT_PATH if SNAPSHOTS_SUPPORTED else None)
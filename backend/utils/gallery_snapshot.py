@@ -0,0 +1,150 @@
+import json
+import os
+import struct
+import tempfile
+import numpy as np
+from utils.config import DATABASE_PATH
+
+# The shared snapshot needs POSIX: flock serializes publishes across processes, and
+# os.replace must succeed while other workers still map the old file. Without fcntl
+# (Windows) SNAPSHOTS_SUPPORTED is False and each process keeps a private gallery;
+# SnapshotLock then only marks the critical section and locks nothing.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+SNAPSHOTS_SUPPORTED = fcntl is not None
+
+# Header: magic, format version, generation, row count, encoding dim, names section length,
+# template count, database gallery_version the snapshot was built from
+_MAGIC = b'FGAL'
+_FORMAT_VERSION = 3
+_HEADER = struct.Struct('<4sIQQIQQQ')
+_HEADER_SIZE = 64
+
+
+def snapshot_path_for(db_path):
+    """
+    Snapshot file belonging to a database, kept next to it
+    """
+    return db_path + '.gallery'
+
+
+SNAPSHOT_PATH = snapshot_path_for(DATABASE_PATH)
+
+
+def snapshot_signature(path=SNAPSHOT_PATH):
+    """
+    Cheap identity of the snapshot file currently at path, or None if missing.
+
+    Snapshots are replaced atomically with os.replace, so a new inode or
+    mtime means a new version has been published.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def read_generation(path=SNAPSHOT_PATH):
+    """
+    Generation number stored in the snapshot header, or 0 if there is none
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+    except FileNotFoundError:
+        return 0
+    if len(header) < _HEADER.size:
+        return 0
+    magic, version, generation = struct.unpack_from('<4sIQ', header)
+    if magic != _MAGIC or version != _FORMAT_VERSION:
+        return 0
+    return generation
+
+
+def write_snapshot(path, generation, encodings, sq_norms, ids, names, templates=None, owners=None, db_version=0):
+    """
+    Atomically publish a gallery snapshot.
+
+    Layout after the 64-byte header: float32 (N x dim) encodings, float32
+    squared norms, int64 student ids, float32 (T x dim) templates, int64
+    template owners (grouped by student), then the names as a UTF-8 JSON list.
+    """
+    count, dim = encodings.shape
+    if templates is None:
+        templates, owners = np.zeros((0, dim), dtype=np.float32), np.zeros(0, dtype=np.int64)
+    names_blob = json.dumps(list(names)).encode('utf-8')
+    header = _HEADER.pack(_MAGIC, _FORMAT_VERSION, generation, count, dim, len(names_blob), len(owners), db_version)
+
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.gallery-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header.ljust(_HEADER_SIZE, b'\0'))
+            f.write(np.ascontiguousarray(encodings, dtype='<f4').tobytes())
+            f.write(np.ascontiguousarray(sq_norms, dtype='<f4').tobytes())
+            f.write(np.ascontiguousarray(ids, dtype='<i8').tobytes())
+            f.write(np.ascontiguousarray(templates, dtype='<f4').tobytes())
+            f.write(np.ascontiguousarray(owners, dtype='<i8').tobytes())
+            f.write(names_blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_snapshot(path=SNAPSHOT_PATH):
+    """
+    Memory-map a snapshot read-only.
+
+    Returns (generation, encodings, sq_norms, ids, names, templates, owners,
+    db_version); the arrays are views into the shared mapping, so opening a
+    large gallery copies nothing.
+    """
+    mm = np.memmap(path, dtype=np.uint8, mode='r')
+    magic, version, generation, count, dim, names_len, template_count, db_version = _HEADER.unpack(
+        bytes(mm[:_HEADER.size])
+    )
+    if magic != _MAGIC or version != _FORMAT_VERSION:
+        raise ValueError(f'Unsupported gallery snapshot format in {path}')
+
+    offset = _HEADER_SIZE
+    encodings = mm[offset:offset + count * dim * 4].view('<f4').reshape(count, dim)
+    offset += count * dim * 4
+    sq_norms = mm[offset:offset + count * 4].view('<f4')
+    offset += count * 4
+    ids = mm[offset:offset + count * 8].view('<i8')
+    offset += count * 8
+    templates = mm[offset:offset + template_count * dim * 4].view('<f4').reshape(template_count, dim)
+    offset += template_count * dim * 4
+    owners = mm[offset:offset + template_count * 8].view('<i8')
+    offset += template_count * 8
+    names = json.loads(bytes(mm[offset:offset + names_len]).decode('utf-8'))
+    return generation, encodings, sq_norms, ids, names, templates, owners, db_version
+
+
+class SnapshotLock:
+    """
+    Cross-process lock serializing read-modify-publish cycles on a snapshot
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.lock_path = path + '.lock'
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.lock_path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
@@ -0,0 +1,172 @@
+"""
+In-memory image ingestion.
+
+Uploaded images are decoded straight from the request's bytes: multipart
+files up to UPLOAD_MEMORY_BYTES are kept in memory instead of a temporary
+file, large JPEGs can be decoded at a reduced size (DECODE_MIN_SIDE), and
+OpenCV's BGR output is turned into RGB in place. Originals are written to
+uploads/ by UploadStore, in the background, once enrollment has succeeded.
+"""
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import cv2
+import numpy as np
+from werkzeug.formparser import default_stream_factory
+from utils.config import DECODE_MIN_SIDE, UPLOAD_MEMORY_BYTES
+
+# imdecode flags per reduction factor; JPEG is scaled while decoding, other formats after
+DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+# JPEG start-of-frame markers, which carry the image size (DHT, JPG and DAC share the range)
+_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+class InvalidImage(ValueError):
+    """
+    Raised when uploaded bytes cannot be decoded as an image
+    """
+
+
+def upload_stream(total_content_length, content_type, filename=None, content_length=None):
+    """
+    Stream factory for multipart uploads: memory up to UPLOAD_MEMORY_BYTES, else a temporary file
+    """
+    if total_content_length is not None and total_content_length <= UPLOAD_MEMORY_BYTES:
+        return io.BytesIO()
+    return default_stream_factory(total_content_length, content_type, filename, content_length)
+
+
+def jpeg_size(image_data):
+    """
+    (width, height) from a JPEG's frame header without decoding it, or None if it is not a JPEG
+    """
+    if bytes(image_data[:2]) != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 <= len(image_data):
+        if image_data[i] != 0xFF:
+            return None
+        marker = image_data[i + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            i += 1
+        elif marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            # Markers without a length
+            i += 2
+        elif marker in _SOF_MARKERS:
+            height = int.from_bytes(image_data[i + 5:i + 7], 'big')
+            width = int.from_bytes(image_data[i + 7:i + 9], 'big')
+            return width, height
+        else:
+            i += 2 + int.from_bytes(image_data[i + 2:i + 4], 'big')
+    return None
+
+
+def reduction_factor(image_data, min_side=DECODE_MIN_SIDE):
+    """
+    Largest JPEG decode reduction (1, 2, 4 or 8) that keeps the longer side at least min_side pixels
+    """
+    if min_side <= 0:
+        return 1
+    size = jpeg_size(image_data)
+    if size is None:
+        return 1
+    for factor in (8, 4, 2):
+        if max(size) // factor >= min_side:
+            return factor
+    return 1
+
+
+def decode_image(image_data, min_side=DECODE_MIN_SIDE):
+    """
+    Decode encoded image bytes into an RGB array for face_recognition.
+
+    Returns (rgb_img, factor): boxes found in rgb_img are multiplied by
+    factor to get original image coordinates (see scale_boxes).
+    """
+    factor = reduction_factor(image_data, min_side)
+    img = cv2.imdecode(np.frombuffer(image_data, np.uint8), DECODE_FLAGS[factor])
+    if img is None:
+        raise InvalidImage('Could not decode image')
+    # Swap the channels in place instead of allocating a second frame
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img), factor
+
+
+def scale_boxes(face_locations, factor):
+    """
+    (top, right, bottom, left) boxes from a reduced decode in original image coordinates
+    """
+    if factor == 1:
+        return face_locations
+    return [tuple(int(v) * factor for v in box) for box in face_locations]
+
+
+class UploadStore:
+    """
+    Writes original uploads to disk on a background thread.
+
+    Requests hand over the bytes they already hold and return without
+    waiting for the disk. A file is written under a temporary name and
+    renamed, so readers never see a partial image; remove() waits for a
+    pending write of the same path first.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='uploads')
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def save(self, path, image_data):
+        """
+        Queue image_data to be written to path; returns a Future
+        """
+        with self._lock:
+            future = self._executor.submit(self._write, path, image_data)
+            self._pending[path] = future
+        future.add_done_callback(lambda done: self._forget(path, done))
+        return future
+
+    def _forget(self, path, future):
+        with self._lock:
+            if self._pending.get(path) is future:
+                del self._pending[path]
+
+    @staticmethod
+    def _write(path, image_data):
+        temp_path = f'{path}.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(image_data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Error saving upload {path}: {str(e)}")
+
+    def remove(self, path):
+        """
+        Delete a stored upload, once any pending write of it has finished
+        """
+        with self._lock:
+            future = self._pending.get(path)
+        if future is not None:
+            future.result()
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def flush(self):
+        """
+        Wait for every queued write
+        """
+        with self._lock:
+            pending = list(self._pending.values())
+        wait(pending)
+
+
+# Shared by all requests in this process; queued writes finish before the interpreter exits
+upload_store = UploadStore()
@@ -0,0 +1,132 @@
+import threading
+
+# Latency buckets in seconds, from sub-millisecond matching up to slow CNN detection
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+class Counter:
+    """
+    Monotonically increasing count, optionally split by labels
+    """
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(key)} {value}')
+        return lines
+
+
+class Histogram:
+    """
+    Distribution of observed values in cumulative buckets, optionally split by labels
+    """
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            # Per-bucket counts, then the number and sum of all observations
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += 1
+            entry[2] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, observations, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{_format_labels(key + (("le", bound),))} {cumulative}')
+                lines.append(f'{self.name}_bucket{_format_labels(key + (("le", "+Inf"),))} {observations}')
+                lines.append(f'{self.name}_sum{_format_labels(key)} {total}')
+                lines.append(f'{self.name}_count{_format_labels(key)} {observations}')
+        return lines
+
+
+class Gauge:
+    """
+    Current value read from a callback at scrape time
+    """
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        _registry.append(self)
+
+    def render(self):
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge', f'{self.name} {self.read()}']
+
+
+def render():
+    """
+    Every registered metric in the Prometheus text exposition format
+    """
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Recognition pipeline, labelled by stage (queue, decode, detect, encode, match, store)
+stage_seconds = Histogram('recognition_stage_seconds', 'Time spent in each recognition pipeline stage')
+request_seconds = Histogram('http_request_seconds', 'Request latency by endpoint')
+faces_detected = Counter('faces_detected_total', 'Faces detected in uploaded images')
+face_matches = Counter('face_matches_total', 'Detected faces matched to an enrolled student')
+face_rejects = Counter('face_rejects_total', 'Images or faces rejected, by reason')
+attendance_marked = Counter('attendance_marked_total', 'Attendance records inserted')
+attendance_duplicates = Counter('attendance_duplicates_total', 'Recognized students whose attendance was already marked')
+attendance_write_seconds = Histogram('attendance_write_seconds', 'Duration of batched attendance write transactions')
+attendance_write_batch = Histogram(
+    'attendance_write_batch_rows', 'Attendance records per write transaction', buckets=(1, 5, 10, 50, 100, 500, 1000)
+)
+attendance_write_failures = Counter('attendance_write_failures_total', 'Attendance write batches that failed and were retried')
+busy_rejections = Counter('busy_rejections_total', 'Requests answered with 503, by resource')
+
+# Database
+db_transaction_seconds = Histogram('db_transaction_seconds', 'Duration of write transactions, including lock waits')
+db_busy_retries = Counter('db_busy_retries_total', 'Write transactions retried because the database was locked')
+
+
+def record_timings(timings):
+    """
+    Observe the *_ms entries of a pipeline timings dict as stage durations
+    """
+    for key, value in timings.items():
+        if key.endswith('_ms'):
+            stage_seconds.observe(value / 1000, stage=key[:-3])
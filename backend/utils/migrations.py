@@ -0,0 +1,317 @@
+from utils import attendance_summary
+from utils.config import DATABASE_PATH
+from utils.db import connect
+from utils.encodings import migrate_json_encodings
+from utils.gallery_snapshot import SnapshotLock
+
+# Rows copied per transaction when a migration rewrites a table
+BATCH_SIZE = 1000
+
+# Subject that attendance recorded before subjects existed is assigned to
+LEGACY_SUBJECT_CODE = 'LEGACY'
+
+
+def _columns(c, table):
+    c.execute(f'PRAGMA table_info({table})')
+    return [col[1] for col in c.fetchall()]
+
+
+def create_tables(conn):
+    """
+    Base schema; tables created by older versions are left as they are
+    """
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS students (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            roll_number TEXT UNIQUE NOT NULL,
+            image_path TEXT NOT NULL,
+            face_encoding BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS subjects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT UNIQUE NOT NULL,
+            name TEXT NOT NULL,
+            faculty TEXT NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS attendance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL,
+            subject_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            status TEXT NOT NULL,
+            FOREIGN KEY (student_id) REFERENCES students (id),
+            FOREIGN KEY (subject_id) REFERENCES subjects (id)
+        )
+    ''')
+
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS enrollments (
+            student_id INTEGER NOT NULL,
+            subject_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (subject_id, student_id),
+            FOREIGN KEY (student_id) REFERENCES students (id),
+            FOREIGN KEY (subject_id) REFERENCES subjects (id)
+        )
+    ''')
+
+
+def add_attendance_subject(conn):
+    """
+    Rebuild an attendance table created without subject_id, keeping every record.
+
+    Old records are assigned to a placeholder LEGACY subject. Rows are copied
+    in batches, each in its own short transaction, and the tables are swapped
+    in a final transaction that also copies anything written meanwhile.
+    """
+    c = conn.cursor()
+    if 'subject_id' in _columns(c, 'attendance'):
+        return
+
+    c.execute('''
+        INSERT OR IGNORE INTO subjects (code, name, faculty, description)
+        VALUES (?, 'Legacy attendance', 'Unknown', 'Attendance recorded before subjects were introduced')
+    ''', (LEGACY_SUBJECT_CODE,))
+    c.execute('SELECT id FROM subjects WHERE code = ?', (LEGACY_SUBJECT_CODE,))
+    legacy_subject_id = c.fetchone()[0]
+
+    # Left over from an interrupted run, if any
+    c.execute('DROP TABLE IF EXISTS attendance_migrated')
+    c.execute('''
+        CREATE TABLE attendance_migrated (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL,
+            subject_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            status TEXT NOT NULL,
+            FOREIGN KEY (student_id) REFERENCES students (id),
+            FOREIGN KEY (subject_id) REFERENCES subjects (id)
+        )
+    ''')
+    conn.commit()
+
+    def copy_rows(after_id, up_to_id):
+        # Rows with a missing student or date cannot satisfy the new constraints
+        c.execute('''
+            INSERT INTO attendance_migrated (id, student_id, subject_id, date, time, status)
+            SELECT id, student_id, ?, date, COALESCE(time, ''), COALESCE(status, 'present')
+            FROM attendance
+            WHERE id > ? AND id <= ? AND student_id IS NOT NULL AND date IS NOT NULL
+        ''', (legacy_subject_id, after_id, up_to_id))
+
+    last_id = 0
+    while True:
+        c.execute(
+            'SELECT MAX(id) FROM (SELECT id FROM attendance WHERE id > ? ORDER BY id LIMIT ?)',
+            (last_id, BATCH_SIZE)
+        )
+        batch_last_id = c.fetchone()[0]
+        if batch_last_id is None:
+            break
+        copy_rows(last_id, batch_last_id)
+        conn.commit()
+        last_id = batch_last_id
+
+    # Anything recorded since the last batch is copied in the same transaction as the swap
+    c.execute('SELECT MAX(id) FROM attendance')
+    copy_rows(last_id, c.fetchone()[0] or last_id)
+    c.execute('DROP TABLE attendance')
+    c.execute('ALTER TABLE attendance_migrated RENAME TO attendance')
+    conn.commit()
+
+
+def convert_json_encodings(conn):
+    """
+    Store legacy JSON text face encodings as float32 blobs
+    """
+    converted = migrate_json_encodings(conn)
+    if converted:
+        print(f"Migrated {converted} face encodings from JSON to binary format")
+
+
+def create_indexes(conn):
+    """
+    Indexes for the attendance duplicate check, report filters and statistics
+    """
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_attendance_unique'")
+    if not c.fetchone():
+        # Keep only the first record of any duplicates before enforcing uniqueness
+        c.execute('''
+            DELETE FROM attendance WHERE id NOT IN (
+                SELECT MIN(id) FROM attendance GROUP BY student_id, subject_id, date
+            )
+        ''')
+        if c.rowcount:
+            print(f"Removed {c.rowcount} duplicate attendance records")
+        c.execute('''
+            CREATE UNIQUE INDEX idx_attendance_unique
+            ON attendance (student_id, subject_id, date)
+        ''')
+
+    # Report and statistics per subject (and per subject and date)
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attendance_subject_date
+        ON attendance (subject_id, date, student_id)
+    ''')
+
+    # Report for all subjects on a date, ordered by time
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attendance_date_time
+        ON attendance (date, time)
+    ''')
+
+    # Enrollment lookups by student (the primary key covers lookups by subject)
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_enrollments_student
+        ON enrollments (student_id)
+    ''')
+
+
+def add_encoding_version(conn):
+    """
+    Record the encoder settings behind each stored encoding, and stage re-encoded ones
+    """
+    c = conn.cursor()
+    # NULL for encodings made before versions were recorded
+    if 'encoding_version' not in _columns(c, 'students'):
+        c.execute('ALTER TABLE students ADD COLUMN encoding_version TEXT')
+
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS reencode_staging (
+            student_id INTEGER PRIMARY KEY,
+            version TEXT NOT NULL,
+            status TEXT NOT NULL,
+            face_encoding BLOB
+        )
+    ''')
+
+
+def create_face_templates(conn):
+    """
+    Extra face encodings per student, beyond the one stored on the students row
+    """
+    c = conn.cursor()
+    # source is 'enrollment' (an extra photo, kept at image_path) or 'probe' (auto-captured)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS face_templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            image_path TEXT,
+            face_encoding BLOB NOT NULL,
+            encoding_version TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (student_id) REFERENCES students (id)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_face_templates_student ON face_templates (student_id, source)')
+
+
+def create_roster_versions(conn):
+    """
+    Per-subject roster version, bumped with every enrollment change so all processes see it
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS roster_versions (
+            subject_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    ''')
+
+
+def create_gallery_version(conn):
+    """
+    Database-wide counter of changes to what the face gallery is built from.
+
+    Triggers bump it with every change to student names and encodings or to
+    face templates, so a gallery snapshot can tell whether it still matches
+    the database without reading every row (see utils.gallery).
+    """
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS gallery_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    c.execute('INSERT OR IGNORE INTO gallery_version (id, version) VALUES (1, 0)')
+    for name, event in [
+        ('students_insert', 'INSERT ON students'),
+        ('students_update', 'UPDATE OF name, face_encoding, encoding_version ON students'),
+        ('students_delete', 'DELETE ON students'),
+        ('templates_insert', 'INSERT ON face_templates'),
+        ('templates_update', 'UPDATE ON face_templates'),
+        ('templates_delete', 'DELETE ON face_templates'),
+    ]:
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS gallery_version_{name} AFTER {event}
+            BEGIN
+                UPDATE gallery_version SET version = version + 1 WHERE id = 1;
+            END
+        ''')
+
+
+# Ordered schema migrations; the database's PRAGMA user_version is the last one applied.
+# Each must be safe to re-run, since a crash can interrupt it before the version is saved.
+# Append new migrations to the end and never renumber existing ones.
+MIGRATIONS = [
+    (1, 'create tables', create_tables),
+    (2, 'add subject to attendance', add_attendance_subject),
+    (3, 'binary face encodings', convert_json_encodings),
+    (4, 'attendance indexes', create_indexes),
+    (5, 'attendance summary tables', attendance_summary.rebuild),
+    (6, 'encoding versions', add_encoding_version),
+    (7, 'face templates', create_face_templates),
+    (8, 'roster versions', create_roster_versions),
+    (9, 'gallery version', create_gallery_version),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(db_path=DATABASE_PATH):
+    """
+    Bring the database up to SCHEMA_VERSION, creating it if needed.
+
+    Returns the versions that were applied, so callers can tell whether
+    anything (e.g. stored encodings) changed.
+    """
+    # Workers starting together must not run the same migration concurrently
+    with SnapshotLock(db_path):
+        conn = connect(db_path)
+        try:
+            current = schema_version(conn)
+            if current > SCHEMA_VERSION:
+                print(f"Database schema version {current} is newer than this code ({SCHEMA_VERSION})")
+                return []
+
+            applied = []
+            for version, description, apply in MIGRATIONS:
+                if version <= current:
+                    continue
+                print(f"Applying database migration {version}: {description}")
+                apply(conn)
+                conn.execute(f'PRAGMA user_version = {version}')
+                conn.commit()
+                applied.append(version)
+            return applied
+        finally:
+            conn.close()
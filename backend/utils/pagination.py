@@ -0,0 +1,70 @@
+import base64
+import csv
+import io
+import json
+from utils.config import EXPORT_FETCH_SIZE
+
+
+def encode_cursor(values):
+    """
+    Opaque cursor for the sort key of the last row on a page
+    """
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, types):
+    """
+    Sort key from a cursor made by encode_cursor, with one value of each of
+    types (e.g. (str, int)); ValueError if malformed
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError('Invalid cursor')
+    # Only scalars of the expected types may reach the query (bool is an int subclass)
+    if not all(type(value) is expected for value, expected in zip(values, types)):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def iter_rows(c, fetch_size=EXPORT_FETCH_SIZE):
+    """
+    Yield rows from an executed cursor as dicts, a batch at a time
+    """
+    while True:
+        rows = c.fetchmany(fetch_size)
+        if not rows:
+            return
+        for row in rows:
+            yield dict(row)
+
+
+def json_array(rows):
+    """
+    Stream rows as a JSON array without building the whole list
+    """
+    yield '['
+    for i, row in enumerate(rows):
+        yield (',' if i else '') + json.dumps(row)
+    yield ']\n'
+
+
+def ndjson(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def csv_rows(rows, fields):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, for an empty result
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,95 @@
+import cv2
+import face_recognition
+import numpy as np
+from utils.config import (
+    FACE_MAX_BRIGHTNESS, FACE_MAX_ROLL, FACE_MAX_YAW, FACE_MIN_BRIGHTNESS, FACE_MIN_CONTRAST, FACE_MIN_SHARPNESS,
+    FACE_MIN_SIZE, FACE_POSE_CHECK
+)
+
+# Width the face crop is resized to before measuring sharpness, so scores do not depend on face size
+SHARPNESS_WIDTH = 96
+
+# Messages for rejected faces, shown to the person at the camera
+REJECT_MESSAGES = {
+    'too_small': 'Face is too small. Please move closer to the camera.',
+    'blurry': 'Face is blurry. Please hold still.',
+    'too_dark': 'Face is too dark. Please improve the lighting.',
+    'too_bright': 'Face is overexposed. Please reduce direct light on your face.',
+    'low_contrast': 'Face has too little contrast. Please improve the lighting.',
+    'pose': 'Face is turned away. Please look straight at the camera.'
+}
+
+
+def _pose(rgb_img, location):
+    """
+    (yaw, roll) from the 5-point landmarks: nose offset from the eye midpoint
+    relative to the eye distance, and the eye line angle in degrees
+    """
+    landmarks = face_recognition.face_landmarks(rgb_img, [location], model='small')
+    if not landmarks:
+        return None
+    left_eye = np.mean(landmarks[0]['left_eye'], axis=0)
+    right_eye = np.mean(landmarks[0]['right_eye'], axis=0)
+    nose = np.mean(landmarks[0]['nose_tip'], axis=0)
+    eye_vector = right_eye - left_eye
+    eye_distance = float(np.hypot(*eye_vector)) or 1.0
+    midpoint = (left_eye + right_eye) / 2
+    yaw = abs(float(np.dot(nose - midpoint, eye_vector)) / eye_distance ** 2)
+    roll = abs(float(np.degrees(np.arctan2(eye_vector[1], eye_vector[0]))))
+    return yaw, min(roll, 180 - roll)
+
+
+def assess_face(rgb_img, location, pose_check=FACE_POSE_CHECK):
+    """
+    Cheap quality checks on one detected face, run before it is encoded.
+
+    Returns (reason, scores): reason is None for an acceptable face or one
+    of the REJECT_MESSAGES keys, and scores holds the measured values.
+    """
+    top, right, bottom, left = location
+    size = min(bottom - top, right - left)
+    scores = {'size': int(size)}
+    if size < FACE_MIN_SIZE:
+        return 'too_small', scores
+
+    crop = rgb_img[max(top, 0):bottom, max(left, 0):right]
+    gray = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY)
+    brightness, contrast = cv2.meanStdDev(gray)
+    scores['brightness'] = round(float(brightness[0][0]), 1)
+    scores['contrast'] = round(float(contrast[0][0]), 1)
+    if scores['brightness'] < FACE_MIN_BRIGHTNESS:
+        return 'too_dark', scores
+    if scores['brightness'] > FACE_MAX_BRIGHTNESS:
+        return 'too_bright', scores
+    if scores['contrast'] < FACE_MIN_CONTRAST:
+        return 'low_contrast', scores
+
+    height = max(1, round(gray.shape[0] * SHARPNESS_WIDTH / gray.shape[1]))
+    normalized = cv2.resize(gray, (SHARPNESS_WIDTH, height), interpolation=cv2.INTER_AREA)
+    scores['sharpness'] = round(float(cv2.Laplacian(normalized, cv2.CV_64F).var()), 1)
+    if scores['sharpness'] < FACE_MIN_SHARPNESS:
+        return 'blurry', scores
+
+    if pose_check:
+        pose = _pose(rgb_img, location)
+        if pose is not None:
+            scores['yaw'], scores['roll'] = round(pose[0], 3), round(pose[1], 1)
+            if pose[0] > FACE_MAX_YAW or pose[1] > FACE_MAX_ROLL:
+                return 'pose', scores
+    return None, scores
+
+
+def screen_faces(rgb_img, face_locations):
+    """
+    Split detected faces into (accepted locations, rejects), where each
+    reject is a dict with the box, the reason and the measured scores
+    """
+    accepted = []
+    rejects = []
+    for location in face_locations:
+        reason, scores = assess_face(rgb_img, location)
+        if reason is None:
+            accepted.append(location)
+        else:
+            rejects.append({'box': location, 'reason': reason, 'scores': scores})
+    return accepted, rejects
@@ -0,0 +1,182 @@
+import time
+from utils.ann_index import IVFIndex
+from utils.config import (
+    FACE_MATCHER, IVF_N_LISTS, IVF_N_PROBE, MATCH_TOLERANCE, QUALITY_GATE, ROSTER_GLOBAL_FALLBACK, STREAM_TRACK_IOU
+)
+from utils.detection import box_iou, detect_and_encode, detect_faces, encode_faces, largest_faces
+from utils.encoding_cache import encoding_cache
+from utils.gallery import gallery
+from utils.ingest import decode_image, scale_boxes
+from utils.quality import screen_faces
+from utils.recognition_cache import recognition_cache
+from utils.rosters import rosters
+from utils.templates import capture_probe
+
+
+def warm_up(rebuild=False):
+    """
+    Load the shared gallery (and approximate index, if configured) for this process
+    """
+    if rebuild:
+        gallery.rebuild()
+    else:
+        gallery.open()
+    # The exact scan remains the fallback when the approximate index is attached
+    if FACE_MATCHER == 'ivf' and gallery.index is None:
+        gallery.use_index(IVFIndex(n_lists=IVF_N_LISTS, n_probe=IVF_N_PROBE))
+
+
+def encode_image(image_data, max_faces=None, cached=False):
+    """
+    Decode, detect and encode; returns (face_locations, face_encodings, timings).
+
+    With cached set, results for identical image bytes are served from the
+    encoding cache (enrollment photos are often resubmitted); live camera
+    frames are never repeated, so attendance does not use it.
+    """
+    if cached and encoding_cache.enabled:
+        start = time.perf_counter()
+        key = encoding_cache.key(image_data, max_faces)
+        hit = encoding_cache.get(key)
+        cache_ms = round((time.perf_counter() - start) * 1000, 2)
+        if hit is not None:
+            return hit[0], hit[1], {'cache_ms': cache_ms}
+
+    start = time.perf_counter()
+    rgb_img, factor = decode_image(image_data)
+    decode_ms = round((time.perf_counter() - start) * 1000, 2)
+    face_locations, face_encodings, timings = detect_and_encode(rgb_img, max_faces=max_faces)
+    face_locations = scale_boxes(face_locations, factor)
+    timings = {'decode_ms': decode_ms, **timings}
+
+    if cached and encoding_cache.enabled:
+        encoding_cache.put(key, face_locations, face_encodings)
+        timings['cache_ms'] = cache_ms
+    return face_locations, face_encodings, timings
+
+
+def recognize_image(image_data, subject_id, classroom=False):
+    """
+    Full recognition pipeline for an attendance image.
+
+    Only the largest face is used unless classroom is set. With
+    QUALITY_GATE on, faces failing the quality checks are dropped before
+    encoding. A confident single-face match may be kept as an extra face
+    template for the student (see utils.templates), and is remembered so
+    that near-identical probes shortly after skip the gallery scan. Returns (face_locations, matches, rejects, timings) with one
+    (student_id, name, distance, matched) tuple per accepted face (student_id
+    is None when there is nobody to match against) and one
+    {'box', 'reason', 'scores'} dict per rejected face.
+    """
+    timings = {}
+    start = time.perf_counter()
+    rgb_img, factor = decode_image(image_data)
+    timings['decode_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+    face_locations, matches, rejects, timings = _recognize(rgb_img, subject_id, classroom, timings)
+    # Report boxes in the coordinates of the uploaded image, even after a reduced decode
+    for reject in rejects:
+        reject['box'] = scale_boxes([reject['box']], factor)[0]
+    return scale_boxes(face_locations, factor), matches, rejects, timings
+
+
+def _recognize(rgb_img, subject_id, classroom, timings):
+    start = time.perf_counter()
+    face_locations = detect_faces(rgb_img)
+    timings['detect_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    if not classroom:
+        face_locations = largest_faces(face_locations, 1)
+
+    rejects = []
+    if QUALITY_GATE and face_locations:
+        start = time.perf_counter()
+        face_locations, rejects = screen_faces(rgb_img, face_locations)
+        timings['quality_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    if not face_locations:
+        return face_locations, [], rejects, timings
+
+    start = time.perf_counter()
+    face_encodings = encode_faces(rgb_img, face_locations)
+    timings['encode_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+    start = time.perf_counter()
+    # Match only against students enrolled in this subject (if it has a roster); revision covers
+    # both the gallery and the roster, so cached answers never outlive an enrollment change
+    revision, match_gallery = rosters.slice_for(subject_id)
+    if not classroom:
+        # A face seen moments ago (e.g. the previous camera frame) gets the same answer without a scan
+        cached = recognition_cache.lookup(subject_id, face_encodings[0], revision)
+        if cached is not None:
+            timings['recent_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            return face_locations, [cached], rejects, timings
+    if classroom:
+        matches = match_gallery.match_faces(face_encodings, tolerance=MATCH_TOLERANCE)
+    else:
+        best_match = match_gallery.match(face_encodings[0])
+        # Optionally retry against the whole gallery when nobody on the roster matches
+        if (ROSTER_GLOBAL_FALLBACK and match_gallery is not gallery
+                and (best_match is None or best_match[2] >= MATCH_TOLERANCE)):
+            best_match = gallery.match(face_encodings[0])
+        if best_match is None:
+            matches = [(None, None, None, False)]
+        else:
+            matches = [(*best_match, best_match[2] < MATCH_TOLERANCE)]
+    timings['match_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+    if not classroom and matches[0][3]:
+        recognition_cache.remember(subject_id, face_encodings[0], matches[0], revision)
+        start = time.perf_counter()
+        if capture_probe(matches[0][0], face_encodings[0], matches[0][2]):
+            timings['capture_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    return face_locations, matches, rejects, timings
+
+
+def track_frame(image_data, subject_id, track_boxes):
+    """
+    Detect faces in a stream frame, encoding only faces that do not continue a track.
+
+    A detected box continues the track whose last box it overlaps most, if
+    that overlap is at least STREAM_TRACK_IOU. Returns (faces, timings)
+    where each face is {'box', 'track'} for a continued track,
+    {'box', 'reject'} with the reason for a new face that failed the
+    quality gate, or {'box', 'match'} with a (student_id, name, distance,
+    matched) tuple for a newly encoded face.
+    """
+    timings = {}
+    start = time.perf_counter()
+    rgb_img, factor = decode_image(image_data)
+    timings['decode_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+    start = time.perf_counter()
+    face_locations = detect_faces(rgb_img)
+    timings['detect_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+    faces = []
+    new_boxes = []
+    claimed = set()
+    # Tracks and results use uploaded image coordinates; quality and encoding the decoded image
+    for box in scale_boxes(face_locations, factor):
+        overlaps = [(box_iou(box, track_box), i) for i, track_box in enumerate(track_boxes) if i not in claimed]
+        best_overlap, best_track = max(overlaps, default=(0.0, None))
+        if best_track is not None and best_overlap >= STREAM_TRACK_IOU:
+            claimed.add(best_track)
+            faces.append({'box': box, 'track': best_track})
+        else:
+            new_boxes.append(tuple(v // factor for v in box))
+
+    if QUALITY_GATE and new_boxes:
+        start = time.perf_counter()
+        new_boxes, rejects = screen_faces(rgb_img, new_boxes)
+        timings['quality_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        faces.extend({'box': scale_boxes([reject['box']], factor)[0], 'reject': reject['reason']} for reject in rejects)
+
+    if new_boxes:
+        start = time.perf_counter()
+        face_encodings = encode_faces(rgb_img, new_boxes)
+        timings['encode_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+        start = time.perf_counter()
+        matches = rosters.gallery_for(subject_id).match_faces(face_encodings, tolerance=MATCH_TOLERANCE)
+        timings['match_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        faces.extend({'box': box, 'match': match} for box, match in zip(scale_boxes(new_boxes, factor), matches))
+    return faces, timings
@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+import numpy as np
+from utils.config import (
+    RECOGNITION_CACHE_DISTANCE, RECOGNITION_CACHE_SIZE, RECOGNITION_CACHE_SUBJECTS, RECOGNITION_CACHE_TTL
+)
+from utils.gallery import pairwise_distances
+
+
+class RecognitionCache:
+    """
+    Short-lived memory of recent recognitions, per subject and date.
+
+    A live camera sends the same faces frame after frame. Matched probe
+    encodings are remembered, so a later probe within max_distance of one
+    gets the same answer without a gallery scan, and students already
+    marked present are answered without touching the database. Entries
+    expire after ttl seconds; beyond max_probes probes per subject and
+    date, and max_subjects subject/date pairs, the least recently used are
+    dropped.
+
+    The cache is per process: recognition workers use the probe side and
+    the web process the marked-student side.
+    """
+
+    def __init__(self, ttl=RECOGNITION_CACHE_TTL, max_distance=RECOGNITION_CACHE_DISTANCE,
+                 max_probes=RECOGNITION_CACHE_SIZE, max_subjects=RECOGNITION_CACHE_SUBJECTS):
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.max_probes = max_probes
+        self.max_subjects = max_subjects
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_probes > 0
+
+    def _entry(self, subject_id, day, create=False):
+        # Caller holds the lock
+        key = (int(subject_id), day or date.today().isoformat())
+        entry = self._entries.get(key)
+        if entry is None:
+            if not create:
+                return None
+            entry = {'probes': OrderedDict(), 'revision': None, 'marked': {}, 'next_probe': 0}
+            self._entries[key] = entry
+            while len(self._entries) > self.max_subjects:
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(key)
+        return entry
+
+    def lookup(self, subject_id, face_encoding, revision, day=None):
+        """
+        Cached (student_id, name, distance, matched) for a probe close to a
+        recently matched one, or None. Probes cached under another revision
+        (of the gallery and the subject's roster) are discarded.
+        """
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entry(subject_id, day)
+            if entry is None:
+                return None
+            probes = entry['probes']
+            if entry['revision'] != revision:
+                probes.clear()
+            for probe_id in [probe_id for probe_id, probe in probes.items() if probe[2] <= now]:
+                del probes[probe_id]
+            if not probes:
+                return None
+            probe_ids = list(probes)
+            distances = pairwise_distances(face_encoding, np.stack([probes[i][0] for i in probe_ids]))[0]
+            nearest = int(np.argmin(distances))
+            if distances[nearest] >= self.max_distance:
+                return None
+            probes.move_to_end(probe_ids[nearest])
+            return probes[probe_ids[nearest]][1]
+
+    def remember(self, subject_id, face_encoding, match, revision, day=None):
+        """
+        Keep a matched probe and its answer for later lookups
+        """
+        if not self.enabled or not match[3]:
+            return
+        with self._lock:
+            entry = self._entry(subject_id, day, create=True)
+            if entry['revision'] != revision:
+                entry['probes'].clear()
+                entry['revision'] = revision
+            entry['next_probe'] += 1
+            entry['probes'][entry['next_probe']] = (
+                np.asarray(face_encoding, dtype=np.float32), match, time.monotonic() + self.ttl
+            )
+            while len(entry['probes']) > self.max_probes:
+                entry['probes'].popitem(last=False)
+
+    def marked(self, subject_id, student_ids, day=None):
+        """
+        The given students known to be marked present already
+        """
+        if not self.enabled:
+            return set()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entry(subject_id, day)
+            if entry is None:
+                return set()
+            return {student_id for student_id in student_ids if entry['marked'].get(student_id, 0) > now}
+
+    def mark(self, subject_id, student_ids, day=None):
+        """
+        Remember students as marked present
+        """
+        if not self.enabled or not student_ids:
+            return
+        now = time.monotonic()
+        with self._lock:
+            marked = self._entry(subject_id, day, create=True)['marked']
+            for student_id in [student_id for student_id, expires in marked.items() if expires <= now]:
+                del marked[student_id]
+            for student_id in student_ids:
+                marked[student_id] = now + self.ttl
+
+    def clear(self):
+        """
+        Forget everything, e.g. after attendance records were deleted
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+# Per-process cache shared by all requests
+recognition_cache = RecognitionCache()
@@ -0,0 +1,213 @@
+"""
+Re-encode every stored student photo with the current detection and encoding settings.
+
+Run from the backend directory after changing e.g. NUM_JITTERS, DETECT_MODEL
+or ENCODING_MODEL (with the new settings in the environment):
+    python -m utils.reencode
+
+New encodings are written in batches to the reencode_staging table, so an
+interrupted run resumes where it stopped. The students table is only
+switched over, in one transaction, once every student has been re-encoded.
+Students whose photo fails (missing image, no face) block the switch unless
+--allow-partial is given; they then keep their old encoding.
+
+Extra enrollment photos in face_templates are re-encoded just before the
+switch (they are few, so this step is not resumable); auto-captured probe
+templates have no photo and are dropped.
+
+Running app processes keep encoding camera frames with the settings they
+were started with, so this command does not publish the switch to them: they
+go on matching against the encodings they already have. Restart the app with the
+new settings afterwards; the gallery is rebuilt from the database on
+startup because its snapshot no longer matches it.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from utils.config import BULK_ENROLL_BATCH_SIZE, BULK_ENROLL_WORKERS, DATABASE_PATH
+from utils.db import get_connection, retry_on_busy, transaction
+from utils.detection import encoder_version
+from utils.encodings import encoding_to_blob
+from utils.recognition import encode_image
+
+
+def reencode_file(image_path):
+    """
+    Worker: (status, encoding) for the largest face in a stored photo
+    """
+    if not image_path or not os.path.isfile(image_path):
+        return 'image_not_found', None
+    with open(image_path, 'rb') as f:
+        image_data = f.read()
+    try:
+        # Photos enrolled under the current settings are already in the encoding cache
+        face_locations, face_encodings, _ = encode_image(image_data, max_faces=1, cached=True)
+    except ValueError:
+        return 'invalid_image', None
+    if not face_locations:
+        return 'no_face', None
+    return 'ok', encoding_to_blob(face_encodings[0])
+
+
+@retry_on_busy
+def save_batch(rows, db_path):
+    with transaction(db_path) as c:
+        c.executemany(
+            'INSERT OR REPLACE INTO reencode_staging (student_id, version, status, face_encoding) VALUES (?, ?, ?, ?)',
+            rows
+        )
+
+
+def pending_students(version, db_path, batch_size):
+    """
+    Yield (id, image_path) of students not yet on version or successfully staged, in id order
+    """
+    c = get_connection(db_path).cursor()
+    last_id = 0
+    while True:
+        c.execute('''
+            SELECT id, image_path FROM students
+            WHERE id > ? AND encoding_version IS NOT ?
+              AND id NOT IN (SELECT student_id FROM reencode_staging WHERE status = 'ok')
+            ORDER BY id LIMIT ?
+        ''', (last_id, version, batch_size))
+        rows = c.fetchall()
+        if not rows:
+            return
+        last_id = rows[-1]['id']
+        yield from rows
+
+
+def encode_pending(version, db_path, workers, batch_size):
+    """
+    Encode every pending student in parallel and stage the results; returns how many were processed
+    """
+    processed = 0
+    staged = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+        remaining = pending_students(version, db_path, batch_size)
+        while True:
+            # Bounded in-flight work, like bulk enrollment
+            while len(in_flight) < 4 * workers:
+                student = next(remaining, None)
+                if student is None:
+                    break
+                in_flight[executor.submit(reencode_file, student['image_path'])] = student['id']
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                student_id = in_flight.pop(future)
+                status, blob = future.result()
+                staged.append((student_id, version, status, blob))
+
+            if len(staged) >= batch_size:
+                save_batch(staged, db_path)
+                processed += len(staged)
+                staged = []
+                print(f"Re-encoded {processed} students ({processed / (time.perf_counter() - start):.1f}/s)")
+
+    if staged:
+        save_batch(staged, db_path)
+        processed += len(staged)
+    return processed
+
+
+def reencode_templates(version, db_path):
+    """
+    (encoding, version, template id) updates for extra enrollment photos of students being switched
+    """
+    c = get_connection(db_path).cursor()
+    c.execute('''
+        SELECT id, student_id, image_path FROM face_templates
+        WHERE source = 'enrollment' AND encoding_version IS NOT ?
+          AND student_id NOT IN (SELECT student_id FROM reencode_staging WHERE status != 'ok')
+    ''', (version,))
+    updates = []
+    for template in c.fetchall():
+        status, blob = reencode_file(template['image_path'])
+        if status == 'ok':
+            updates.append((blob, version, template['id']))
+        else:
+            print(f"  template {template['id']} of student {template['student_id']}: {status}, left inactive")
+    return updates
+
+
+@retry_on_busy
+def switch_over(version, db_path, template_updates=()):
+    """
+    Replace stored encodings with the staged ones in one transaction; returns how many changed
+    """
+    with transaction(db_path) as c:
+        c.executemany('UPDATE face_templates SET face_encoding = ?, encoding_version = ? WHERE id = ?',
+                      template_updates)
+        c.execute('''
+            DELETE FROM face_templates
+            WHERE source = 'probe' AND encoding_version IS NOT ?
+              AND student_id NOT IN (SELECT student_id FROM reencode_staging WHERE status != 'ok')
+        ''', (version,))
+        c.execute('''
+            UPDATE students SET
+                face_encoding = (SELECT face_encoding FROM reencode_staging WHERE student_id = students.id),
+                encoding_version = ?
+            WHERE id IN (SELECT student_id FROM reencode_staging WHERE version = ? AND status = 'ok')
+        ''', (version, version))
+        switched = c.rowcount
+        c.execute('DELETE FROM reencode_staging')
+    return switched
+
+
+def run(db_path=DATABASE_PATH, workers=BULK_ENROLL_WORKERS, batch_size=BULK_ENROLL_BATCH_SIZE,
+        allow_partial=False):
+    version = encoder_version()
+    print(f"Re-encoding stored photos for encoder version {version}")
+
+    # Staged results for other settings are from an abandoned run
+    with transaction(db_path) as c:
+        c.execute('DELETE FROM reencode_staging WHERE version != ?', (version,))
+        c.execute("SELECT COUNT(*) FROM reencode_staging WHERE status = 'ok'")
+        resumed = c.fetchone()[0]
+    if resumed:
+        print(f"Resuming: {resumed} students already re-encoded")
+
+    encode_pending(version, db_path, workers, batch_size)
+
+    c = get_connection(db_path).cursor()
+    c.execute('''
+        SELECT r.student_id, s.roll_number, r.status FROM reencode_staging r
+        JOIN students s ON s.id = r.student_id
+        WHERE r.status != 'ok'
+    ''')
+    failures = c.fetchall()
+    for failure in failures:
+        print(f"  student {failure['student_id']} ({failure['roll_number']}): {failure['status']}")
+    if failures and not allow_partial:
+        print(f"{len(failures)} students could not be re-encoded; fix their photos and rerun, "
+              f"or pass --allow-partial to switch over without them")
+        return False
+
+    template_updates = reencode_templates(version, db_path)
+    switched = switch_over(version, db_path, template_updates)
+    print(f"Switched {switched} students to encoder version {version}")
+    if switched or template_updates:
+        print("Restart the app with the same settings to use the new encodings; "
+              "running processes keep matching with their old ones until then")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=BULK_ENROLL_WORKERS)
+    parser.add_argument('--batch-size', type=int, default=BULK_ENROLL_BATCH_SIZE)
+    parser.add_argument('--allow-partial', action='store_true')
+    args = parser.parse_args()
+    if not run(workers=args.workers, batch_size=args.batch_size, allow_partial=args.allow_partial):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
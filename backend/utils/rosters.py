@@ -0,0 +1,66 @@
+import threading
+from utils.config import DATABASE_PATH
+from utils.db import get_connection
+from utils.gallery import gallery
+
+
+def bump_version(c, subject_id):
+    """
+    Record a change to a subject's roster in the caller's transaction
+    """
+    c.execute('''
+        INSERT INTO roster_versions (subject_id, version) VALUES (?, 1)
+        ON CONFLICT (subject_id) DO UPDATE SET version = version + 1
+    ''', (subject_id,))
+
+
+class RosterCache:
+    """
+    Per-subject slices of the face gallery, restricted to enrolled students.
+
+    Every enrollment change bumps the subject's row in roster_versions (see
+    bump_version), in the same transaction. A slice is rebuilt when that
+    version or the underlying gallery changes, which every process,
+    including the recognition workers, checks on each call.
+    """
+
+    def __init__(self, gallery, db_path=DATABASE_PATH):
+        self.gallery = gallery
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._slices = {}
+
+    def slice_for(self, subject_id):
+        """
+        (revision, gallery) to match against for a subject: its roster
+        slice, or the global gallery if the subject has no enrolled
+        students. revision changes whenever the answer could.
+        """
+        subject_id = int(subject_id)
+        self.gallery.refresh()
+        c = get_connection(self.db_path).cursor()
+        c.execute('SELECT version FROM roster_versions WHERE subject_id = ?', (subject_id,))
+        row = c.fetchone()
+        revision = (self.gallery.revision, row[0] if row else 0)
+        with self._lock:
+            cached = self._slices.get(subject_id)
+            if cached and cached[0] == revision:
+                return cached
+
+        # Read after the version, so a concurrent edit can only make the slice newer than its revision
+        c.execute('SELECT student_id FROM enrollments WHERE subject_id = ?', (subject_id,))
+        student_ids = [row[0] for row in c.fetchall()]
+        roster_gallery = self.gallery.subset(student_ids) if student_ids else self.gallery
+        with self._lock:
+            self._slices[subject_id] = (revision, roster_gallery)
+        return revision, roster_gallery
+
+    def gallery_for(self, subject_id):
+        """
+        Gallery to match against for a subject (see slice_for)
+        """
+        return self.slice_for(subject_id)[1]
+
+
+# Shared roster cache for the process, built on the shared gallery
+rosters = RosterCache(gallery)
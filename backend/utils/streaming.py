@@ -0,0 +1,216 @@
+import queue
+import threading
+import time
+import uuid
+import cv2
+import numpy as np
+from utils.config import (
+    STREAM_DUPLICATE_THRESHOLD, STREAM_REVERIFY_FRAMES, STREAM_SESSION_TIMEOUT, STREAM_TRACK_MAX_AGE,
+    STREAM_UNKNOWN_RETRY
+)
+from utils.recognition import track_frame
+
+
+def frame_thumbnail(image_data):
+    """
+    Small grayscale thumbnail used to spot near-duplicate frames.
+
+    JPEG frames are decoded at 1/8 scale, which skips most of the decode work.
+    """
+    img = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if img is None:
+        raise ValueError('Could not decode image')
+    return cv2.resize(img, (64, 48), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def _box_dict(box):
+    top, right, bottom, left = box
+    return {'top': top, 'right': right, 'bottom': bottom, 'left': left}
+
+
+class StreamSession:
+    """
+    State for one continuous camera feed marking attendance for one subject.
+
+    Near-duplicate frames are skipped before any detection runs. Faces are
+    tracked across frames by box overlap, so a face is not re-encoded on
+    every frame while it stays in view: identified faces are re-verified
+    every STREAM_REVERIFY_FRAMES frames and unknown faces retried every
+    STREAM_UNKNOWN_RETRY frames. Recognition events are returned per
+    frame and also queued for event-stream listeners.
+    """
+
+    def __init__(self, subject_id):
+        self.session_id = uuid.uuid4().hex
+        self.subject_id = subject_id
+        self.frame_count = 0
+        self.tracks = []
+        self.marked = set()
+        self.events = queue.Queue(maxsize=1000)
+        self.last_active = time.monotonic()
+        self.closed = False
+        self._previous_thumbnail = None
+        # Frames of one session are processed strictly in order
+        self._lock = threading.Lock()
+
+    def _emit(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            # Nobody is listening; drop the oldest event
+            try:
+                self.events.get_nowait()
+            except queue.Empty:
+                pass
+            self.events.put_nowait(event)
+        return event
+
+    def process_frame(self, image_data, run, mark_students):
+        """
+        Process one frame and return the events it produced.
+
+        run(fn, *args) executes recognition work (e.g. on the process pool);
+        mark_students(student_ids) records attendance and returns the ids
+        that were newly marked.
+        """
+        with self._lock:
+            self.last_active = time.monotonic()
+            self.frame_count += 1
+            frame = self.frame_count
+
+            thumbnail = frame_thumbnail(image_data)
+            previous, self._previous_thumbnail = self._previous_thumbnail, thumbnail
+            if previous is not None and float(np.mean(np.abs(thumbnail - previous))) < STREAM_DUPLICATE_THRESHOLD:
+                return [self._emit({'type': 'frame', 'frame': frame, 'skipped': True})]
+
+            # Tracks due for a retry or re-verification are dropped so their faces get re-encoded
+            self.tracks = [
+                track for track in self.tracks
+                if frame - track['last_seen'] <= STREAM_TRACK_MAX_AGE and frame < track['retry_at']
+            ]
+            faces, timings = run(track_frame, image_data, self.subject_id, [track['box'] for track in self.tracks])
+
+            events = []
+            recognized = []
+            for face in faces:
+                if 'track' in face:
+                    track = self.tracks[face['track']]
+                    track['box'] = face['box']
+                    track['last_seen'] = frame
+                    continue
+                if 'reject' in face:
+                    # No track: the face is re-checked on the next frame, which may be sharper
+                    events.append({'type': 'rejected', 'frame': frame, 'box': _box_dict(face['box']),
+                                   'reason': face['reject']})
+                    continue
+                student_id, name, distance, matched = face['match']
+                track = {
+                    'box': face['box'],
+                    'last_seen': frame,
+                    'student_id': student_id if matched else None,
+                    'name': name if matched else None,
+                    'retry_at': frame + (STREAM_REVERIFY_FRAMES if matched else STREAM_UNKNOWN_RETRY)
+                }
+                self.tracks.append(track)
+                if matched:
+                    recognized.append((track, distance))
+                else:
+                    events.append({'type': 'unknown', 'frame': frame, 'box': _box_dict(face['box']), 'distance': distance})
+
+            # Students already handled in this session are answered without touching the database
+            new_ids = {track['student_id'] for track, _ in recognized} - self.marked
+            try:
+                newly_marked = mark_students(sorted(new_ids)) if new_ids else set()
+            except Exception:
+                # Forget these faces so the next frame identifies, and marks, them again
+                unmarked = {id(track) for track, _ in recognized}
+                self.tracks = [track for track in self.tracks if id(track) not in unmarked]
+                raise
+            self.marked |= new_ids
+            for track, distance in recognized:
+                events.append({
+                    'type': 'recognized',
+                    'frame': frame,
+                    'student_id': track['student_id'],
+                    'student_name': track['name'],
+                    'distance': distance,
+                    'box': _box_dict(track['box']),
+                    'status': 'marked' if track['student_id'] in newly_marked else 'already_marked'
+                })
+
+            events.append({'type': 'frame', 'frame': frame, 'skipped': False,
+                           'faces': len(faces), 'tracks': len(self.tracks), 'timings': timings})
+            return [self._emit(event) for event in events]
+
+
+class StreamSessions:
+    """
+    Registry of live streaming sessions, expiring idle ones
+    """
+
+    def __init__(self, timeout=STREAM_SESSION_TIMEOUT):
+        self.timeout = timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        now = time.monotonic()
+        for session_id, session in list(self._sessions.items()):
+            if now - session.last_active > self.timeout:
+                session.closed = True
+                del self._sessions[session_id]
+
+    def create(self, subject_id):
+        session = StreamSession(subject_id)
+        with self._lock:
+            self._expire()
+            self._sessions[session.session_id] = session
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            self._expire()
+            return self._sessions.get(session_id)
+
+    def close(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.closed = True
+        return session
+
+
+def read_frames(stream, max_frame_size=10 * 1024 * 1024):
+    """
+    Yield frames from a (possibly chunked) upload body.
+
+    Each frame is a 4-byte big-endian length followed by that many bytes of
+    encoded image; a zero length or the end of the body ends the sequence.
+    """
+    def read_exactly(size):
+        data = b''
+        while len(data) < size:
+            chunk = stream.read(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    while True:
+        header = read_exactly(4)
+        if header is None:
+            return
+        size = int.from_bytes(header, 'big')
+        if size == 0:
+            return
+        if size > max_frame_size:
+            raise ValueError(f'Frame of {size} bytes exceeds the {max_frame_size} byte limit')
+        frame = read_exactly(size)
+        if frame is None:
+            return
+        yield frame
+
+
+# Live sessions for this process; clients must stay on the worker that created their session
+stream_sessions = StreamSessions()
+
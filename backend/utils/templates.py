@@ -0,0 +1,192 @@
+"""
+Extra face templates per student.
+
+Every student has the encoding stored on their students row; face_templates
+holds any further ones: extra enrollment photos ('enrollment') and, with
+TEMPLATE_AUTO_CAPTURE, confident attendance probes ('probe'). Only the
+newest TEMPLATE_MAX_PROBES probes are kept per student. The gallery matches
+against the centroid of a student's templates and then against the
+templates themselves (see FaceGallery).
+
+Publishing a gallery change rewrites the shared snapshot and makes every
+other process remap it, so captured probes are published in batches by
+ProbePublisher rather than one by one on the recognition path.
+"""
+import sqlite3
+import threading
+from utils.config import (
+    DATABASE_PATH, TEMPLATE_AUTO_CAPTURE, TEMPLATE_CAPTURE_DISTANCE, TEMPLATE_MAX_PROBES, TEMPLATE_MIN_SPREAD,
+    TEMPLATE_PUBLISH_INTERVAL
+)
+from utils.db import close_connection, get_connection, retry_on_busy, transaction
+from utils.detection import encoder_version
+from utils.encodings import blobs_to_matrix, encoding_to_blob
+from utils.gallery import gallery
+
+
+def load_student(c, student_id):
+    """
+    (name, encodings) with the student's own encoding first, or None if there is no such student
+    """
+    c.execute('SELECT name, face_encoding, encoding_version FROM students WHERE id = ?', (student_id,))
+    student = c.fetchone()
+    if student is None:
+        return None
+    c.execute(
+        'SELECT face_encoding FROM face_templates WHERE student_id = ? AND encoding_version IS ? ORDER BY id',
+        (student_id, student[2])
+    )
+    return student[0], blobs_to_matrix([student[1]] + [row[0] for row in c.fetchall()])
+
+
+def refresh_student(student_id, db_path=DATABASE_PATH):
+    """
+    Publish a student's current templates to the shared gallery
+    """
+    student = load_student(get_connection(db_path).cursor(), student_id)
+    if student is None:
+        gallery.remove(student_id)
+    else:
+        gallery.set_templates(student_id, *student)
+
+
+@retry_on_busy
+def _insert(student_id, face_encoding, source, image_path, db_path):
+    with transaction(db_path) as c:
+        c.execute(
+            'INSERT INTO face_templates (student_id, source, image_path, face_encoding, encoding_version) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (student_id, source, image_path, encoding_to_blob(face_encoding), encoder_version())
+        )
+        template_id = c.lastrowid
+        if source == 'probe':
+            # Evict the oldest probes beyond the per-student cap
+            c.execute('''
+                DELETE FROM face_templates WHERE id IN (
+                    SELECT id FROM face_templates WHERE student_id = ? AND source = 'probe'
+                    ORDER BY id DESC LIMIT -1 OFFSET ?
+                )
+            ''', (student_id, TEMPLATE_MAX_PROBES))
+    return template_id
+
+
+def add_template(student_id, face_encoding, source='enrollment', image_path=None, db_path=DATABASE_PATH):
+    """
+    Store one more template for a student and update the gallery; returns the template id
+    """
+    template_id = _insert(student_id, face_encoding, source, image_path, db_path)
+    refresh_student(student_id, db_path)
+    return template_id
+
+
+class ProbePublisher:
+    """
+    Publishes the students with newly captured probes to the gallery
+    together, interval seconds after the first one is queued.
+
+    The template rows are already committed, so probes still queued when
+    the process exits are picked up by the next gallery rebuild or any
+    later refresh of the student.
+    """
+
+    def __init__(self, interval=TEMPLATE_PUBLISH_INTERVAL, db_path=DATABASE_PATH):
+        self.interval = interval
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._timer = None
+
+    def queue(self, student_id):
+        if self.interval <= 0:
+            refresh_student(student_id, self.db_path)
+            return
+        with self._lock:
+            self._pending.add(student_id)
+            if self._timer is None:
+                self._timer = threading.Timer(self.interval, self._publish_in_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def publish(self):
+        """
+        Publish every queued student's current templates as one gallery change
+        """
+        with self._lock:
+            student_ids, self._pending = self._pending, set()
+            self._timer = None
+        if not student_ids:
+            return
+        try:
+            c = get_connection(self.db_path).cursor()
+            students = []
+            for student_id in sorted(student_ids):
+                student = load_student(c, student_id)
+                # Deleted meanwhile: the deletion already removed it from the gallery
+                if student is not None:
+                    students.append((student_id, *student))
+            gallery.set_many_templates(students)
+        except Exception as e:
+            print(f"Error publishing captured face templates: {str(e)}")
+
+    def _publish_in_timer(self):
+        try:
+            self.publish()
+        finally:
+            # Each timer is a new thread; do not leave its connection behind
+            close_connection(self.db_path)
+
+
+# Per-process publisher for auto-captured probes
+probe_publisher = ProbePublisher()
+
+
+def capture_probe(student_id, face_encoding, distance, db_path=DATABASE_PATH):
+    """
+    Keep a confidently matched attendance probe as a template, if auto-capture is on.
+
+    Probes that are nearly identical to an existing template (distance below
+    TEMPLATE_MIN_SPREAD) add nothing and are skipped, as are students whose
+    stored encoding predates the current encoder settings. Returns True if
+    the probe was stored; it reaches the gallery with the next batch
+    published by probe_publisher.
+    """
+    if not TEMPLATE_AUTO_CAPTURE or TEMPLATE_MAX_PROBES <= 0:
+        return False
+    if not TEMPLATE_MIN_SPREAD <= distance < TEMPLATE_CAPTURE_DISTANCE:
+        return False
+    try:
+        c = get_connection(db_path).cursor()
+        c.execute('SELECT encoding_version FROM students WHERE id = ?', (student_id,))
+        student = c.fetchone()
+        if student is None or student[0] != encoder_version():
+            return False
+        _insert(student_id, face_encoding, 'probe', None, db_path)
+        probe_publisher.queue(student_id)
+        return True
+    except sqlite3.Error as e:
+        print(f"Error capturing face template for student {student_id}: {str(e)}")
+        return False
+
+
+def remove_template(student_id, template_id, db_path=DATABASE_PATH):
+    """
+    Delete one template and update the gallery; returns (found, image_path)
+    """
+    with transaction(db_path) as c:
+        c.execute('SELECT image_path FROM face_templates WHERE id = ? AND student_id = ?', (template_id, student_id))
+        template = c.fetchone()
+        if template is None:
+            return False, None
+        c.execute('DELETE FROM face_templates WHERE id = ?', (template_id,))
+    refresh_student(student_id, db_path)
+    return True, template[0]
+
+
+def remove_student(c, student_id):
+    """
+    Delete all of a student's templates in the caller's transaction; returns their image paths
+    """
+    c.execute('SELECT image_path FROM face_templates WHERE student_id = ? AND image_path IS NOT NULL', (student_id,))
+    image_paths = [row[0] for row in c.fetchall()]
+    c.execute('DELETE FROM face_templates WHERE student_id = ?', (student_id,))
+    return image_paths
@@ -0,0 +1,124 @@
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from utils.config import RECOGNITION_QUEUE_SIZE, RECOGNITION_WORKERS
+from utils.recognition import warm_up
+
+
+class PoolBusy(Exception):
+    """
+    Raised when the recognition queue is full, or a crashed worker pool is being replaced
+    """
+
+
+class RecognitionPool:
+    """
+    Bounded process pool for the CPU-bound decode/detect/encode/match stages.
+
+    dlib holds the GIL for the whole detection call, so running it in
+    worker processes is what lets concurrent kiosks use every core. Each
+    worker maps the shared gallery snapshot once at startup and keeps it
+    warm. At most max_pending calls may be queued or running; beyond that
+    run() raises PoolBusy immediately instead of queueing without bound.
+
+    A worker that dies (e.g. killed by the OOM killer) breaks the whole
+    executor; it is then discarded and the next call starts a new one.
+    Calls that were in flight on the broken executor fail with PoolBusy,
+    so clients retry rather than resubmit the input that may have crashed it.
+    """
+
+    def __init__(self, workers=RECOGNITION_WORKERS, max_pending=RECOGNITION_QUEUE_SIZE):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(max(max_pending, 1))
+        self._executor = None
+        self._lock = threading.Lock()
+        # Calls queued or running, for monitoring
+        self.pending = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up)
+            return self._executor
+
+    def _discard(self, executor):
+        with self._lock:
+            if self._executor is not executor:
+                # Already replaced by another caller
+                return
+            self._executor = None
+        print("Recognition worker pool is broken, starting a new one")
+        executor.shutdown(wait=False)
+
+    def _submit_to_executor(self, fn, *args):
+        # An executor found broken before the call started is replaced once without losing any work
+        for attempt in range(2):
+            executor = self._get_executor()
+            try:
+                inner = executor.submit(fn, *args)
+                break
+            except BrokenProcessPool:
+                self._discard(executor)
+                if attempt:
+                    raise PoolBusy()
+
+        future = Future()
+
+        def _done(inner):
+            error = inner.exception()
+            if isinstance(error, BrokenProcessPool):
+                self._discard(executor)
+                future.set_exception(PoolBusy())
+            elif error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(inner.result())
+
+        inner.add_done_callback(_done)
+        return future
+
+    def submit(self, fn, *args):
+        """
+        Start fn(*args) in a worker process and return its Future without
+        waiting, so asyncio callers can await it without holding a thread
+        """
+        if not self._slots.acquire(blocking=False):
+            raise PoolBusy()
+        with self._lock:
+            self.pending += 1
+        try:
+            # With no workers configured, run inline in the calling thread
+            if self.workers <= 0:
+                future = Future()
+                try:
+                    future.set_result(fn(*args))
+                except Exception as e:
+                    future.set_exception(e)
+            else:
+                future = self._submit_to_executor(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future):
+        with self._lock:
+            self.pending -= 1
+        self._slots.release()
+
+    def run(self, fn, *args):
+        """
+        Run fn(*args) in a worker process and wait for its result
+        """
+        return self.submit(fn, *args).result()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+# Shared recognition pool for the Flask process
+recognition_pool = RecognitionPool()